@@ -0,0 +1,128 @@
+# app/autosend/delivery.py
+"""
+Массовая отправка в Telegram для автоотправки.
+
+Сообщения уходят параллельно (не больше TG_SEND_CONCURRENCY в полёте), но
+с учётом лимитов Telegram:
+  • глобальный — не чаще TG_SEND_RATE сообщений в секунду на бота;
+  • на чат — не чаще раза в TG_CHAT_INTERVAL_SEC в один и тот же чат.
+TelegramRetryAfter ставит на паузу всю трубу (а не только один запрос):
+остальные отправки ждут retry_after, затем сообщение повторяется.
+
+    results = await deliver([(chat_id, lambda: bot.send_message(chat_id, text)), ...], label="mode1")
+
+Фабрика вызывается заново при повторе, поэтому внутри — только сам запрос
+к Telegram; запись результата в БД делает вызывающий по results.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.config import settings
+from app.utils.ttl_cache import TTLCache
+
+log = logging.getLogger("autosend.delivery")
+
+SendFn = Callable[[], Awaitable[Any]]
+
+# Сколько раз повторяем одно сообщение после RetryAfter, прежде чем сдаться.
+_MAX_RETRY_AFTER = 3
+
+_next_slot = 0.0   # monotonic: когда можно отправить следующее сообщение
+_paused_until = 0.0  # monotonic: конец паузы после RetryAfter
+_chat_last: TTLCache[int, float] = TTLCache("tg_chat_last_send", maxsize=50000, ttl=60)
+_last_report: Optional[Dict[str, Any]] = None
+
+
+def _rate() -> float:
+    return max(1.0, float(settings.tg_send_rate))
+
+
+async def _acquire(chat_id: int) -> None:
+    """Дождаться слота: пауза трубы, глобальный темп, интервал на чат."""
+    global _next_slot
+    per_chat = max(0.0, float(settings.tg_chat_interval_sec))
+    while True:
+        now = time.monotonic()
+        at = max(now, _next_slot, _paused_until, (_chat_last.get(chat_id) or 0.0) + per_chat)
+        if at <= now:
+            _next_slot = now + 1.0 / _rate()
+            _chat_last.set(chat_id, now)
+            return
+        # после сна всё перепроверяем: за это время могла начаться пауза
+        await asyncio.sleep(at - now)
+
+
+def _pause(retry_after: float) -> None:
+    global _paused_until
+    until = time.monotonic() + max(1.0, retry_after)
+    if until > _paused_until:
+        _paused_until = until
+        log.warning("telegram flood limit: pausing delivery for %.0fs", retry_after)
+
+
+async def _send_one(chat_id: int, fn: SendFn) -> Tuple[Any, int]:
+    retries = 0
+    while True:
+        await _acquire(chat_id)
+        try:
+            return await fn(), retries
+        except TelegramRetryAfter as e:
+            _pause(e.retry_after)
+            retries += 1
+            if retries > _MAX_RETRY_AFTER:
+                raise
+
+
+async def deliver(items: Sequence[Tuple[int, SendFn]], label: str = "send") -> List[Union[Any, BaseException]]:
+    """
+    Отправить пачку. Возвращает результаты в порядке items:
+    значение fn() (например, Message) или исключение, если отправка не удалась.
+    """
+    global _last_report
+    if not items:
+        return []
+    sem = asyncio.Semaphore(max(1, int(settings.tg_send_concurrency)))
+    results: List[Union[Any, BaseException]] = [None] * len(items)
+    retried = 0
+
+    async def _run(i: int, chat_id: int, fn: SendFn) -> None:
+        nonlocal retried
+        async with sem:
+            try:
+                results[i], n = await _send_one(chat_id, fn)
+                retried += n
+            except Exception as e:
+                results[i] = e
+                log.warning("%s: delivery to chat=%s failed: %s", label, chat_id, e)
+
+    started = time.monotonic()
+    await asyncio.gather(*(_run(i, chat_id, fn) for i, (chat_id, fn) in enumerate(items)))
+    elapsed = time.monotonic() - started
+
+    failed = sum(1 for r in results if isinstance(r, BaseException))
+    _last_report = {
+        "label": label,
+        "total": len(items),
+        "ok": len(items) - failed,
+        "failed": failed,
+        "retried": retried,
+        "elapsed_sec": round(elapsed, 2),
+        "per_sec": round(len(items) / elapsed, 1) if elapsed > 0 else float(len(items)),
+        "at": time.time(),
+    }
+    log.info(
+        "%s: delivered %d/%d in %.1fs (%.1f msg/s, retries=%d, failed=%d)",
+        label, _last_report["ok"], len(items), elapsed, _last_report["per_sec"], retried, failed,
+    )
+    return results
+
+
+def get_delivery_stats() -> Optional[Dict[str, Any]]:
+    """Отчёт о последней пачке (для админки)."""
+    return dict(_last_report) if _last_report else None
@@ -2,37 +2,39 @@
 Алерты об экзаменах.
 
 Логика:
-  • за 1 день  — уведомление накануне вечером (или утром — зависит от времени)
-    Точнее: если сегодня == exam_date - 1 day и текущее время HH:MM совпадает с
-    настроенным временем дневного алерта (по умолчанию 20:00).
-  • за 2 часа  — если сейчас >= start-2h и сейчас < start-1h55 (5-минутное окно).
+  • за 1 день  — накануне в 20:00 (_ALERT_DAY_HOUR), догоняем до 21:00;
+  • за 2 часа  — в start-2h, догоняем до start-1h45.
 
-Оба алерта отправляются один раз: факт записывается в exam_alerts.
+Проверка — «наступил и ещё не отправлен», поэтому запуск чуть позже минуты
+алерта (долгая рассылка, рестарт) его не теряет. Окно догона короткое:
+позже алерт уже не отправляем, чтобы «через ~2 часа» не пришло перед самым
+экзаменом. Оба алерта отправляются один раз: факт записывается в exam_alerts.
+
+exam_alerts_tick возвращает момент следующего алерта — планировщик
+(app/autosend/runner.py) будит его к этому времени, а не каждые 30 с.
+Список экзаменов берётся из кэша exam_parser.load_exams_cached.
 """
 from __future__ import annotations
 
-import asyncio
 import logging
-from datetime import date, datetime, timedelta
-from typing import Optional
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Dict, List, Optional, Tuple
 
 from aiogram import Bot
 
+from app.autosend.delivery import deliver
 from app.config import settings
-from app.services.db import (
-    get_bot_mode,
-    get_bot_setting,
-    list_users_with_group,
-    exam_alert_sent,
-    mark_exam_alert_sent,
-)
-from app.services.exam_parser import load_exams
-from app.utils.dt import now_tz
+from app.services.db_async import adb
+from app.services.exam_parser import load_exams_cached
+from app.utils.dt import get_tz, now_tz
 
 log = logging.getLogger("exam_runner")
 
 _ALERT_DAY_HOUR   = 20   # час для алерта «завтра экзамен»
 _ALERT_DAY_MINUTE = 0
+# Сколько после момента алерта его ещё можно отправить (рестарт, долгая рассылка).
+_ALERT_DAY_CATCHUP = timedelta(hours=1)
+_ALERT_2H_CATCHUP  = timedelta(minutes=15)
 
 
 def _parse_hm(time_range: str) -> Optional[tuple[int, int]]:
@@ -66,69 +68,82 @@ def _format_exam_alert(exam: dict, kind: str) -> str:
     return "\n".join(parts)
 
 
-async def exam_alerts_tick(bot: Bot):
-    if get_bot_mode() != "exams":
-        return
+def _alert_windows(exam: dict, tz) -> List[Tuple[str, datetime, datetime]]:
+    """(вид, с какого момента, до какого) для алертов экзамена."""
+    hm = _parse_hm(exam["time"])
+    if hm is None:
+        return []
+    exam_date: date = exam["date"]
+    start = datetime.combine(exam_date, dtime(hm[0], hm[1]), tzinfo=tz)
+    day_from = datetime.combine(exam_date - timedelta(days=1), dtime(_ALERT_DAY_HOUR, _ALERT_DAY_MINUTE), tzinfo=tz)
+    h2_from = start - timedelta(hours=2)
+    return [("day", day_from, day_from + _ALERT_DAY_CATCHUP), ("2h", h2_from, h2_from + _ALERT_2H_CATCHUP)]
+
 
-    spreadsheet_id = get_bot_setting("exam_spreadsheet_id")
-    sheet_gid_raw  = get_bot_setting("exam_sheet_gid")
+async def exam_alerts_tick(bot: Bot) -> Optional[float]:
+    """Отправить наступившие алерты. Возвращает epoch следующего алерта (None — не известен)."""
+    if await adb.get_bot_mode() != "exams":
+        return None
+
+    spreadsheet_id = await adb.get_bot_setting("exam_spreadsheet_id")
+    sheet_gid_raw  = await adb.get_bot_setting("exam_sheet_gid")
     if not spreadsheet_id or sheet_gid_raw is None:
-        return
+        return None
 
     try:
         sheet_gid = int(sheet_gid_raw)
     except ValueError:
-        return
+        return None
 
-    tz = getattr(settings, "timezone", "Europe/Moscow")
-    now = now_tz(tz)
-    today: date = now.date()
-    now_min = now.hour * 60 + now.minute
+    tz_name = getattr(settings, "timezone", "Europe/Moscow")
+    tz = get_tz(tz_name)
+    now = now_tz(tz_name)
 
     try:
-        all_exams = load_exams(spreadsheet_id, sheet_gid)
+        all_exams = await load_exams_cached(spreadsheet_id, sheet_gid)
     except Exception as e:
         log.error("exam_alerts_tick: load_exams failed: %s", e)
-        return
-
-    users = [u for u in list_users_with_group() if u.get("exam_alerts_enabled")]
+        return None
 
+    by_group: Dict[str, List[Tuple[str, dict, datetime, datetime]]] = {}
+    next_at: Optional[datetime] = None
+    for exam in all_exams:
+        if exam["date"] is None:
+            continue
+        group = exam["group"].strip().upper()
+        for kind, since, until in _alert_windows(exam, tz):
+            if since <= now < until:
+                by_group.setdefault(group, []).append((kind, exam, since, until))
+            elif now < since and (next_at is None or since < next_at):
+                next_at = since
+    if not by_group:
+        return next_at.timestamp() if next_at else None
+
+    users = [u for u in await adb.list_users_with_group() if u.get("exam_alerts_enabled")]
+    keys = {
+        (group, kind, exam["date"], exam["time"]): f"{kind}|{group}|{exam['date']}|{exam['time']}"
+        for group, alerts in by_group.items()
+        for kind, exam, _, _ in alerts
+    }
+    sent = await adb.list_exam_alerts_sent(list(keys.values()))
+    batch: List[Tuple[int, str]] = []  # (uid, key)
+    items = []
     for user in users:
         group = (user.get("group_code") or "").strip().upper()
         uid   = user["telegram_id"]
-
-        group_exams = [
-            e for e in all_exams
-            if e["group"].strip().upper() == group and e["date"] is not None
-        ]
-
-        for exam in group_exams:
-            exam_date: date = exam["date"]
-            hm = _parse_hm(exam["time"])
-            if hm is None:
+        for kind, exam, _, _ in by_group.get(group, ()):
+            key = keys[(group, kind, exam["date"], exam["time"])]
+            if (uid, key) in sent:
                 continue
-            start_min = hm[0] * 60 + hm[1]
-
-            # ─ алерт за день ─
-            if exam_date == today + timedelta(days=1):
-                if now.hour == _ALERT_DAY_HOUR and now.minute == _ALERT_DAY_MINUTE:
-                    key = f"day|{group}|{exam_date}|{exam['time']}"
-                    if not exam_alert_sent(uid, key):
-                        try:
-                            await bot.send_message(uid, _format_exam_alert(exam, "day"))
-                            mark_exam_alert_sent(uid, key)
-                        except Exception as e:
-                            log.warning("exam day-alert failed uid=%s: %s", uid, e)
-
-            # ─ алерт за 2 часа ─
-            if exam_date == today:
-                two_h_before = start_min - 120
-                # окно 5 минут: [start-120, start-115)
-                if two_h_before <= now_min < two_h_before + 5:
-                    key = f"2h|{group}|{exam_date}|{exam['time']}"
-                    if not exam_alert_sent(uid, key):
-                        try:
-                            await bot.send_message(uid, _format_exam_alert(exam, "2h"))
-                            mark_exam_alert_sent(uid, key)
-                        except Exception as e:
-                            log.warning("exam 2h-alert failed uid=%s: %s", uid, e)
+            batch.append((uid, key))
+            items.append((uid, lambda uid=uid, text=_format_exam_alert(exam, kind): bot.send_message(uid, text)))
+
+    results = await deliver(items, label="exam-alerts")
+    delivered: List[Tuple[int, str]] = []
+    for (uid, key), res in zip(batch, results):
+        if isinstance(res, BaseException):
+            log.warning("exam alert %s failed uid=%s: %s", key.split("|", 1)[0], uid, res)
+        else:
+            delivered.append((uid, key))
+    await adb.mark_exam_alerts_sent(delivered)
+    return next_at.timestamp() if next_at else None
@@ -0,0 +1,81 @@
+# app/autosend/prefetch.py
+"""
+Прогрев расписания перед автоотправкой.
+
+Планировщик (app/autosend/runner.py) ставит каждому пользователю с
+автоотправкой задачу прогрева за prefetch_lead_sec() до его времени рассылки
+(в его таймзоне): перепроверяются листы, из которых берётся расписание
+(общий и персональные), а hybrid/myitmo_full-пользователям — ещё и my.itmo.
+В саму минуту отправки расписание берётся уже из кэша.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import List, Set, Tuple
+
+from app.config import settings
+from app.services.lessons_loader import prewarm_myitmo
+from app.services.sheet_cache import get_custom_sheet_snapshot, refresh_sheet_snapshot
+
+log = logging.getLogger("autosend.prefetch")
+
+_tasks: Set[asyncio.Task] = set()
+
+
+def prefetch_lead_sec() -> int:
+    return max(60, int(settings.myitmo_prefetch_lead_sec), int(settings.sheet_prefetch_lead_sec))
+
+
+def needs_myitmo_prefetch(user: dict) -> bool:
+    mode = str(user.get("schedule_source_mode") or "sheets").strip().lower()
+    return mode in ("myitmo_full", "hybrid") and bool((user.get("myitmo_username") or "").strip())
+
+
+def _sheet_sources(users: List[dict]) -> Set[Tuple[str, int]]:
+    sources: Set[Tuple[str, int]] = set()
+    for u in users:
+        sheet_id = str(u.get("user_spreadsheet_id") or "").strip()
+        if not sheet_id:
+            sources.add((settings.spreadsheet_id, int(settings.sheet_gid)))
+            continue
+        try:
+            sources.add((sheet_id, int(u["user_sheet_gid"]) if u.get("user_sheet_gid") is not None else int(settings.sheet_gid)))
+        except (TypeError, ValueError):
+            sources.add((sheet_id, int(settings.sheet_gid)))
+    return sources
+
+
+async def _prewarm_sheets(users: List[dict]) -> None:
+    shared = (settings.spreadsheet_id, int(settings.sheet_gid))
+    for sheet_id, gid in _sheet_sources(users):
+        try:
+            if (sheet_id, gid) == shared:
+                await refresh_sheet_snapshot(sheet_id, gid)
+            else:
+                await get_custom_sheet_snapshot(sheet_id, gid)
+        except Exception as e:
+            log.warning("sheet prewarm failed for %s gid=%s: %s", sheet_id, gid, e)
+
+
+async def _prewarm(users: List[dict], lead_sec: int) -> None:
+    started = time.monotonic()
+    await _prewarm_sheets(users)
+    # держим прогретое с запасом: до отправки + минута на саму рассылку
+    ok, fail = await prewarm_myitmo(
+        [u for u in users if needs_myitmo_prefetch(u)],
+        ttl=lead_sec + 120,
+        concurrency=settings.myitmo_prefetch_concurrency,
+    )
+    log.info("schedule prewarm: users=%d my.itmo ok=%d fail=%d in %.1fs",
+             len(users), ok, fail, time.monotonic() - started)
+
+
+def prewarm_users(users: List[dict]) -> None:
+    """Прогрев фоновой задачей — цикл планировщика его не ждёт."""
+    if not users:
+        return
+    task = asyncio.create_task(_prewarm(users, prefetch_lead_sec()))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
@@ -1,29 +1,28 @@
 from __future__ import annotations
 
 import asyncio
-from datetime import timedelta
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
 import logging
+import time
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
 
 from aiogram import Bot
 
-from app.services.db import (
-    list_users_for_autosend_at,
-    list_users_mode2_enabled,
-    get_autosend_last_date,
-    set_autosend_last_date,
-    set_autosend_message_id,
-    get_autosend_message_id,
-    set_autosend_cur_key,
-    get_autosend_cur_key,
-    get_bot_mode,
-)
-from app.services.lessons_loader import load_lessons_for_user_group
+from app.services.db import add_user_listener
+from app.services.db_async import adb
+from app.services.lessons_loader import load_schedule_for_user, schedule_scope
 from app.utils.week_parity import week_parity_for_date
 from app.utils.dt import now_tz
 from app.utils.format_schedule import format_day
 from app.config import settings
-from app.cron.gcal_autosync import gcal_autosync_tick
+from app.cron.gcal_autosync import gcal_autosync_user
+from app.autosend.delivery import deliver
 from app.autosend.exam_runner import exam_alerts_tick
+from app.autosend.prefetch import prefetch_lead_sec, prewarm_users
+from app.autosend.scheduler import JobHeap, fire_today, local_now, next_fire, parse_hhmm
 
 
 log = logging.getLogger("autosend")
@@ -31,14 +30,6 @@ log = logging.getLogger("autosend")
 DAY_NAMES_UPPER = ["ПОНЕДЕЛЬНИК","ВТОРНИК","СРЕДА","ЧЕТВЕРГ","ПЯТНИЦА","СУББОТА","ВОСКРЕСЕНЬЕ"]
 
 
-def _norm_parity(p: str) -> str:
-    p = str(p or "").strip().lower().replace("ё", "е")
-    if "неч" in p:
-        return "нечёт"
-    if "чет" in p:
-        return "чёт"
-    return p
-
 def _to_minutes(hhmm_or_hhmmss: str) -> int:
     """
     'HH:MM' или 'HH:MM:SS' -> минуты от полуночи.
@@ -67,11 +58,8 @@ async def _build_day_text_for_user(user: dict) -> str:
     parity = week_parity_for_date(dt_now, tz)
     day_upper = DAY_NAMES_UPPER[dt_now.weekday()]
 
-    lessons = await load_lessons_for_user_group(user)
-    day_lessons = [
-        it for it in lessons
-        if _norm_parity(it.get("parity")) == _norm_parity(parity) and str(it["day"]).strip().upper() == day_upper
-    ]
+    schedule = await load_schedule_for_user(user)
+    day_lessons = schedule.day(parity, day_upper)
 
     # красивый вывод «на день»
     text = format_day(user["group_code"], day_upper, parity, day_lessons)
@@ -87,14 +75,8 @@ def _pick_next_lesson(lessons: list[dict], now_minutes: int) -> dict | None:
     if not lessons:
         return None
 
-    def _start_min(lesson: dict) -> int:
-        try:
-            sm, _ = _parse_slot_minutes(str(lesson.get("time", "")))
-            return sm
-        except Exception:
-            return 24 * 60 + 1  # в конец
-
-    for it in sorted(lessons, key=_start_min):
+    # пары дня приходят из LessonIndex уже отсортированными по началу
+    for it in lessons:
         try:
             sm, em = _parse_slot_minutes(str(it.get("time", "")))
         except Exception:
@@ -106,97 +88,388 @@ def _pick_next_lesson(lessons: list[dict], now_minutes: int) -> dict | None:
 
     return None
 
-async def _morning_send_mode1(bot: Bot, hhmm: str, ymd: str):
-    users = list_users_for_autosend_at(hhmm, mode=1)
-    log.debug("mode1 scan @%s -> %d users", hhmm, len(users))
+def _user_ymd(user: dict) -> str:
+    return now_tz(user.get("timezone") or settings.timezone).strftime("%Y-%m-%d")
+
+# telegram_id -> {поле: значение}: состояние автоотправки, накопленное за тик
+# и записанное одним executemany (services/db.save_autosend_states).
+_StateUpdates = Dict[int, Dict[str, Any]]
+
+
+def _new_state() -> _StateUpdates:
+    return defaultdict(dict)
+
+
+async def _flush_state(state: _StateUpdates) -> None:
+    if state:
+        n = await adb.save_autosend_states(dict(state))
+        log.debug("autosend state saved for %d users", n)
+
+
+async def _morning_send_mode1(bot: Bot, users: List[dict], state: _StateUpdates):
+    log.debug("mode1 send -> %d users", len(users))
+    pending: List[dict] = []
     for u in users:
-        if get_autosend_last_date(u["telegram_id"]) == ymd:
+        if u.get("autosend_last_date") == _user_ymd(u):
             log.debug("mode1 skip user=%s already sent today", u["telegram_id"]); continue
-        dt_now, parity, day_upper, day_lessons = await _load_todays_lessons_for_user(u)
-        log.info("mode1 send to user=%s group=%s lessons=%d parity=%s day=%s",
-                 u["telegram_id"], u["group_code"], len(day_lessons), parity, day_upper)
-        text = format_day(u["group_code"], day_upper, parity, day_lessons)
-        try:
-            await bot.send_message(chat_id=u["telegram_id"], text=text)
-            set_autosend_last_date(u["telegram_id"], ymd)
-        except Exception as e:
-            log.exception("mode1 send failed user=%s: %s", u["telegram_id"], e)
-
-async def _morning_send_mode2(bot: Bot, hhmm: str, ymd: str):
-    users = list_users_for_autosend_at(hhmm, mode=2)
-    log.info("mode2 scan @%s -> %d users", hhmm, len(users))  # INFO вместо DEBUG, чтобы точно видеть
+        pending.append(u)
+
+    batch: List[Tuple[dict, str, str]] = []  # (user, ymd, text)
+    for g in await _group_users_by_day(pending):
+        # один текст на всю группу — дальше только отправка
+        text = format_day(g.group_code, g.day_upper, g.parity, g.lessons)
+        log.info("mode1 send group=%s lessons=%d parity=%s day=%s -> %d users",
+                 g.group_code, len(g.lessons), g.parity, g.day_upper, len(g.users))
+        batch.extend((u, g.ymd, text) for u in g.users)
+
+    results = await deliver(
+        [(u["telegram_id"], partial(bot.send_message, chat_id=u["telegram_id"], text=text))
+         for u, _, text in batch],
+        label="mode1",
+    )
+    for (u, ymd, _), res in zip(batch, results):
+        if not isinstance(res, BaseException):
+            state[u["telegram_id"]]["autosend_last_date"] = ymd
+
+async def _morning_send_mode2(bot: Bot, users: List[dict], state: _StateUpdates):
+    log.info("mode2 send -> %d users", len(users))
+    pending: List[dict] = []
     for u in users:
-        last = get_autosend_last_date(u["telegram_id"])
-        msg_id = get_autosend_message_id(u["telegram_id"])
+        last = u.get("autosend_last_date")
+        msg_id = u.get("autosend_msg_id")
         # ⚠️ ФИКС: если уже что-то отправляли сегодня И у нас есть msg_id — пропускаем,
         # а если msg_id нет (например, режим меняли днём) — отправим сейчас.
-        if last == ymd and msg_id:
+        if last == _user_ymd(u) and msg_id:
             log.info("mode2 skip user=%s (already sent today, msg_id=%s)", u["telegram_id"], msg_id)
             continue
-
-        dt_now, parity, day_upper, day_lessons = await _load_todays_lessons_for_user(u)
-        now_minutes = dt_now.hour * 60 + dt_now.minute
-        next_lesson = _pick_next_lesson(day_lessons, now_minutes)
-        log.info("mode2 morning user=%s group=%s next=%s lessons=%d parity=%s day=%s",
-                 u["telegram_id"], u["group_code"], (next_lesson or {}).get("time"),
-                 len(day_lessons), parity, day_upper)
-        text = _format_next_text(u, parity, day_upper, next_lesson)
-        try:
-            m = await bot.send_message(chat_id=u["telegram_id"], text=text)
-            set_autosend_message_id(u["telegram_id"], m.message_id)
-            set_autosend_cur_key(u["telegram_id"], _make_key(ymd, next_lesson))
-            set_autosend_last_date(u["telegram_id"], ymd)
-        except Exception as e:
-            log.exception("mode2 morning send failed user=%s: %s", u["telegram_id"], e)
-
-async def _live_update_mode2(bot: Bot, ymd: str):
-    users = list_users_mode2_enabled()
-    log.debug("mode2 live update scan: %d users", len(users))
+        pending.append(u)
+
+    batch: List[Tuple[dict, str, str, str, Optional[dict]]] = []  # (user, ymd, key, text, пара для live)
+    for g in await _group_users_by_day(pending):
+        rendered: Dict[str, str] = {}  # key -> текст: в группе он зависит только от пары
+        for u in g.users:
+            now_minutes = g.now_minutes[u["telegram_id"]]
+            next_lesson = _pick_next_lesson(g.lessons, now_minutes)
+            key = _make_key(g.ymd, next_lesson)
+            if key not in rendered:
+                rendered[key] = _format_next_text(u, g.parity, g.day_upper, next_lesson)
+            batch.append((u, g.ymd, key, rendered[key], _pick_current_or_next(g.lessons, now_minutes)))
+        log.info("mode2 morning group=%s lessons=%d parity=%s day=%s -> %d users, %d texts",
+                 g.group_code, len(g.lessons), g.parity, g.day_upper, len(g.users), len(rendered))
+
+    results = await deliver(
+        [(u["telegram_id"], partial(bot.send_message, chat_id=u["telegram_id"], text=text))
+         for u, _, _, text, _ in batch],
+        label="mode2",
+    )
+    for (u, ymd, key, _, live_lesson), m in zip(batch, results):
+        if isinstance(m, BaseException):
+            continue
+        state[u["telegram_id"]].update(autosend_msg_id=m.message_id, autosend_cur_key=key, autosend_last_date=ymd)
+        _schedule_live(u, live_lesson)
+
+async def _live_update_mode2(bot: Bot, users: List[dict], state: _StateUpdates):
+    """Правка сообщения «ближайшая пара» у пользователей, для которых наступила смена пары."""
+    log.debug("mode2 live update -> %d users", len(users))
+    pending: List[dict] = []
+    msg_ids: Dict[int, int] = {}
     for u in users:
-        if get_autosend_last_date(u["telegram_id"]) != ymd:
+        if not (u.get("autosend_enabled") and u.get("autosend_mode") == 2):
+            _jobs.cancel(("live", u["telegram_id"]))
+            continue
+        if u.get("autosend_last_date") != _user_ymd(u):
             log.debug("mode2 live skip user=%s (no morning send yet)", u["telegram_id"])
+            _jobs.cancel(("live", u["telegram_id"]))
             continue
-        msg_id = get_autosend_message_id(u["telegram_id"])
+        msg_id = u.get("autosend_msg_id")
         if not msg_id:
             log.debug("mode2 live skip user=%s (no msg_id)", u["telegram_id"])
+            _jobs.cancel(("live", u["telegram_id"]))
             continue
-        dt_now, parity, day_upper, day_lessons = await _load_todays_lessons_for_user(u)
-        now_minutes = dt_now.hour * 60 + dt_now.minute
-        next_lesson = _pick_current_or_next(day_lessons, now_minutes)
-        new_key = _make_key(ymd, next_lesson)
-        old_key = get_autosend_cur_key(u["telegram_id"]) or ""
-        if new_key == old_key:
-            continue
-        log.info("mode2 edit user=%s msg=%s old=%s new=%s", u["telegram_id"], msg_id, old_key, new_key)
-        text = _format_next_text(u, parity, day_upper, next_lesson)
+        msg_ids[u["telegram_id"]] = msg_id
+        pending.append(u)
+
+    batch: List[Tuple[dict, int, str]] = []  # (user, msg_id, new_key)
+    edits = []
+    for g in await _group_users_by_day(pending):
+        rendered: Dict[str, str] = {}
+        for u in g.users:
+            next_lesson = _pick_current_or_next(g.lessons, g.now_minutes[u["telegram_id"]])
+            _schedule_live(u, next_lesson)
+            new_key = _make_key(g.ymd, next_lesson)
+            old_key = u.get("autosend_cur_key") or ""
+            if new_key == old_key:
+                continue
+            msg_id = msg_ids[u["telegram_id"]]
+            log.info("mode2 edit user=%s msg=%s old=%s new=%s", u["telegram_id"], msg_id, old_key, new_key)
+            if new_key not in rendered:
+                rendered[new_key] = _format_next_text(u, g.parity, g.day_upper, next_lesson)
+            batch.append((u, msg_id, new_key))
+            edits.append((u["telegram_id"], partial(
+                bot.edit_message_text, chat_id=u["telegram_id"], message_id=msg_id, text=rendered[new_key],
+            )))
+
+    results = await deliver(edits, label="mode2-edit")
+    for (u, msg_id, new_key), res in zip(batch, results):
+        if isinstance(res, BaseException):
+            log.warning("mode2 edit failed user=%s msg=%s: %s (reset msg id)", u["telegram_id"], msg_id, res)
+            state[u["telegram_id"]]["autosend_msg_id"] = None
+            _jobs.cancel(("live", u["telegram_id"]))
+        else:
+            state[u["telegram_id"]]["autosend_cur_key"] = new_key
+
+
+# ── планировщик ─────────────────────────────────────────────────────────────
+#
+# Вместо сканирования БД раз в 30 с: у каждого пользователя задачи в куче
+# по времени срабатывания в его таймзоне —
+#   ("send", uid)    утренняя автоотправка (режимы 1 и 2),
+#   ("prewarm", uid) прогрев листов и my.itmo перед отправкой (app/autosend/prefetch.py),
+#   ("gcal", uid)    автосинк Google Calendar,
+#   ("live", uid)    правка сообщения режима 2 — в момент окончания текущей
+#                    пары (раньше «ближайшая пара» смениться не может),
+#   ("exams", 0)     экзаменационные алерты (режим exams).
+# Цикл спит до ближайшей задачи; просроченные (долгая итерация, рестарт в
+# пределах AUTOSEND_CATCHUP_SEC) выполняются сразу. Изменения настроек через
+# services/db.py перепланируют только этого пользователя.
+
+# Поля users, от которых зависит расписание задач пользователя.
+_SCHEDULE_FIELDS = frozenset({
+    "timezone", "group_code", "schedule_source_mode", "myitmo_username",
+    "autosend_enabled", "autosend_mode", "autosend_time",
+    "gcal_autosync_enabled", "gcal_connected", "gcal_autosync_time",
+})
+# Экзаменационные алерты: одна общая задача _EXAMS_JOB на время ближайшего
+# алерта, но не реже раза в _EXAMS_RECHECK_SEC (смена режима бота, правки таблицы).
+_EXAMS_JOB = ("exams", 0)
+_EXAMS_RECHECK_SEC = 600
+# Верхняя граница сна цикла (страховка от скачков системных часов).
+_MAX_SLEEP_SEC = 300
+# Повтор live-правки, если она упала (например, не загрузилось расписание).
+_LIVE_RETRY_SEC = 60
+
+_jobs = JobHeap()
+_dirty: Set[Optional[int]] = set()  # None — перестроить всё
+_wake: Optional[asyncio.Event] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_bg_tasks: Set[asyncio.Task] = set()
+
+
+def _on_user_written(telegram_id: Optional[int], fields: Dict) -> None:
+    # вызывается из потока, который писал в БД
+    if fields and not (fields.keys() & _SCHEDULE_FIELDS):
+        return
+    loop = _loop
+    if loop is None or loop.is_closed():
+        return
+    loop.call_soon_threadsafe(_mark_dirty, telegram_id)
+
+
+def _mark_dirty(telegram_id: Optional[int]) -> None:
+    _dirty.add(telegram_id)
+    if _wake is not None:
+        _wake.set()
+
+
+def _cancel_user(uid: int) -> None:
+    for kind in ("send", "prewarm", "gcal", "live"):
+        _jobs.cancel((kind, uid))
+
+
+def _schedule_live(u: dict, lesson: Optional[dict]) -> None:
+    """Следующая правка режима 2 — конец пары lesson (текущей или ближайшей); нет пары — правок до завтра."""
+    uid = int(u["telegram_id"])
+    end = _parse_interval_minutes(lesson["time"])[1] if lesson else None
+    if end is None or end >= 24 * 60:
+        _jobs.cancel(("live", uid))
+        return
+    now_local = local_now(u.get("timezone") or settings.timezone, time.time())
+    _jobs.schedule(("live", uid), fire_today(divmod(end, 60), now_local).timestamp())
+
+
+def _plan_live(u: dict, now_ts: float) -> None:
+    """После рестарта/смены настроек: пересчитать сообщение режима 2 сразу, дальше — по концам пар."""
+    uid = int(u["telegram_id"])
+    ymd = local_now(u.get("timezone") or settings.timezone, now_ts).strftime("%Y-%m-%d")
+    if (u.get("autosend_enabled") and u.get("autosend_mode") == 2
+            and u.get("autosend_last_date") == ymd and u.get("autosend_msg_id")):
+        _jobs.schedule(("live", uid), now_ts)
+    else:
+        _jobs.cancel(("live", uid))
+
+
+def _keep_overdue(key: Hashable, now_ts: float, at: float) -> float:
+    """Задача уже наступила, но ещё не снята из кучи — перепланирование её не переносит."""
+    cur = _jobs.when(key)
+    return cur if cur is not None and cur <= now_ts else at
+
+
+def _plan_user(u: dict, now_ts: float, catch_up: bool = False) -> None:
+    """(Пере)планировать задачи пользователя. catch_up — отправить сразу, если сегодняшнее время пропущено."""
+    uid = int(u["telegram_id"])
+    tz = u.get("timezone") or settings.timezone
+    now_local = local_now(tz, now_ts)
+    ymd = now_local.strftime("%Y-%m-%d")
+    window = max(0, int(settings.autosend_catchup_sec))
+
+    hm = parse_hhmm(u.get("autosend_time"))
+    if u.get("autosend_enabled") and u.get("autosend_mode") in (1, 2) and hm and u.get("group_code"):
+        at = next_fire(hm, now_local).timestamp()
+        missed = fire_today(hm, now_local).timestamp()
+        if u.get("autosend_last_date") != ymd:
+            if catch_up and missed <= now_ts <= missed + window:
+                at = now_ts
+            at = _keep_overdue(("send", uid), now_ts, at)
+        _jobs.schedule(("send", uid), at)
+        if at - prefetch_lead_sec() > now_ts:
+            _jobs.schedule(("prewarm", uid), at - prefetch_lead_sec())
+        else:
+            _jobs.cancel(("prewarm", uid))
+    else:
+        _jobs.cancel(("send", uid))
+        _jobs.cancel(("prewarm", uid))
+
+    hm = parse_hhmm(u.get("gcal_autosync_time"))
+    if u.get("gcal_autosync_enabled") and u.get("gcal_connected") and hm:
+        at = next_fire(hm, now_local).timestamp()
+        missed = fire_today(hm, now_local).timestamp()
+        done_today = str(u.get("gcal_autosync_last_key") or "").endswith(":" + ymd)
+        if not done_today:
+            if catch_up and missed <= now_ts <= missed + window:
+                at = now_ts
+            at = _keep_overdue(("gcal", uid), now_ts, at)
+        _jobs.schedule(("gcal", uid), at)
+    else:
+        _jobs.cancel(("gcal", uid))
+
+
+async def _rebuild(catch_up: bool) -> None:
+    global _jobs
+    rows = await adb.list_users_for_scheduler()
+    _jobs = JobHeap()
+    now_ts = time.time()
+    for u in rows:
+        _plan_user(u, now_ts, catch_up=catch_up)
+        _plan_live(u, now_ts)
+    _jobs.schedule(_EXAMS_JOB, now_ts)
+    log.info("autosend schedule rebuilt: %d users, %d jobs", len(rows), len(_jobs))
+
+
+async def _apply_dirty() -> None:
+    dirty = set(_dirty)
+    _dirty.clear()
+    if None in dirty:
+        await _rebuild(catch_up=False)
+        return
+    users = await adb.get_users(list(dirty))
+    now_ts = time.time()
+    for uid in dirty:
+        u = users.get(uid)
+        if u is None:
+            _cancel_user(uid)
+        else:
+            _plan_user(u, now_ts)
+            _plan_live(u, now_ts)
+    log.debug("autosend schedule updated for %d users", len(dirty))
+
+
+def _spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    _bg_tasks.add(task)
+    task.add_done_callback(_bg_tasks.discard)
+
+
+async def _gcal_autosync_many(users: List[dict]) -> None:
+    for u in users:
+        await gcal_autosync_user(u)
+
+
+async def _dispatch(bot: Bot, due: List[Hashable]) -> None:
+    by_kind: Dict[str, List[int]] = defaultdict(list)
+    for kind, uid in due:
+        by_kind[kind].append(uid)
+    users = await adb.get_users([uid for kind, uids in by_kind.items() if kind != "exams" for uid in uids])
+
+    # pop_due уже снял задачи send/gcal: следующие ставим сразу, до любых
+    # других обращений к БД и сети, чтобы сбой ниже не оставил пользователей
+    # без автоотправки и синка до перезапуска
+    # (holidays/exams: утреннюю рассылку пропускаем, но завтрашнюю планируем)
+    now_ts = time.time()
+    for uid in dict.fromkeys(by_kind["send"] + by_kind["gcal"]):
+        if uid in users:
+            _plan_user(users[uid], now_ts)
+
+    bot_mode = await adb.get_bot_mode()
+
+    if by_kind["exams"]:
+        # сразу ставим перепроверку: сбой алертов не должен снять задачу насовсем
+        _jobs.schedule(_EXAMS_JOB, time.time() + _EXAMS_RECHECK_SEC)
         try:
-            await bot.edit_message_text(chat_id=u["telegram_id"], message_id=msg_id, text=text)
-            set_autosend_cur_key(u["telegram_id"], new_key)
-        except Exception as e:
-            log.warning("mode2 edit failed user=%s msg=%s: %s (reset msg id)", u["telegram_id"], msg_id, e)
-            set_autosend_message_id(u["telegram_id"], None)
+            next_alert = await exam_alerts_tick(bot)
+        except Exception:
+            log.exception("exam alerts tick failed")
+        else:
+            if next_alert is not None and next_alert < time.time() + _EXAMS_RECHECK_SEC:
+                _jobs.schedule(_EXAMS_JOB, next_alert)
 
-async def _tick(bot: Bot):
-    tz = getattr(settings, "timezone", "Europe/Moscow")
-    log.info("autosend runner started, timezone=%s", tz)
+    if by_kind["prewarm"] and bot_mode == "normal":
+        prewarm_users([users[uid] for uid in by_kind["prewarm"] if uid in users])
+
+    if by_kind["gcal"]:
+        # синк ходит в Google по сети — не задерживаем им утреннюю рассылку
+        _spawn(_gcal_autosync_many([users[uid] for uid in by_kind["gcal"] if uid in users]))
+
+    if by_kind["send"] and bot_mode == "normal":
+        send_users = [users[uid] for uid in by_kind["send"] if uid in users]
+        state = _new_state()
+        try:
+            await _morning_send_mode1(bot, [u for u in send_users if u.get("autosend_mode") == 1], state)
+            await _morning_send_mode2(bot, [u for u in send_users if u.get("autosend_mode") == 2], state)
+        finally:
+            # уже отправленное фиксируем, даже если дальше что-то упало
+            await _flush_state(state)
+
+    if by_kind["live"] and bot_mode == "normal":
+        # страховка на случай сбоя: _live_update_mode2 перезапишет её
+        # временем следующей смены пары или снимет
+        retry_at = time.time() + _LIVE_RETRY_SEC
+        for uid in by_kind["live"]:
+            if uid in users:
+                _jobs.schedule(("live", uid), retry_at)
+        state = _new_state()
+        try:
+            await _live_update_mode2(bot, [users[uid] for uid in by_kind["live"] if uid in users], state)
+        finally:
+            await _flush_state(state)
+
+
+async def _run(bot: Bot):
+    global _wake, _loop
+    _wake = asyncio.Event()
+    _loop = asyncio.get_running_loop()
+    add_user_listener(_on_user_written)
+    log.info("autosend scheduler started, default timezone=%s", settings.timezone)
+    await _rebuild(catch_up=True)
     while True:
         try:
-            now = now_tz(tz)
-            hhmm = now.strftime("%H:%M")
-            ymd = now.strftime("%Y-%m-%d")
-            log.debug("tick now=%s hhmm=%s", now.isoformat(), hhmm)
-
-            mode = get_bot_mode()
-            if mode == "normal":
-                await _morning_send_mode1(bot, hhmm, ymd)
-                await _morning_send_mode2(bot, hhmm, ymd)
-                await _live_update_mode2(bot, ymd)
-            elif mode == "exams":
-                await exam_alerts_tick(bot)
-            # holidays: ничего не отправляем
-            await gcal_autosync_tick(bot)
-
-            await asyncio.sleep(30)
+            _wake.clear()
+            if _dirty:
+                await _apply_dirty()
+            due = _jobs.pop_due(time.time())
+            if due:
+                started = time.monotonic()
+                await _dispatch(bot, due)
+                log.info("autosend dispatched %d jobs in %.1fs", len(due), time.monotonic() - started)
+
+            timeout = _MAX_SLEEP_SEC
+            next_at = _jobs.next_at()
+            if next_at is not None:
+                timeout = min(timeout, next_at - time.time())
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(_wake.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
         except asyncio.CancelledError:
             log.info("autosend runner cancelled")
             break
@@ -210,7 +483,7 @@ def start_autosend(bot: Bot):
     global _task
     if _task is None or _task.done():
         loop = asyncio.get_event_loop()
-        _task = loop.create_task(_tick(bot))
+        _task = loop.create_task(_run(bot))
         log.info("autosend task scheduled")
 
 def _parse_start_minutes(time_range: str) -> int:
@@ -222,18 +495,56 @@ def _parse_start_minutes(time_range: str) -> int:
     except Exception:
         return 10**9  # в конец
 
-async def _load_todays_lessons_for_user(user: dict):
-    tz = getattr(settings, "timezone", "Europe/Moscow")
-    dt_now = now_tz(tz)
-    parity = week_parity_for_date(dt_now, tz)
-    day_upper = DAY_NAMES_UPPER[dt_now.weekday()]
+@dataclass
+class _DayGroup:
+    """Пользователи с одним расписанием на один и тот же день."""
+    group_code: str
+    ymd: str
+    parity: str
+    day_upper: str
+    users: List[dict] = field(default_factory=list)
+    now_minutes: Dict[int, int] = field(default_factory=dict)  # telegram_id -> минуты по его часам
+    lessons: list = field(default_factory=list)
+
 
-    lessons = await load_lessons_for_user_group(user)
-    day_lessons = [
-        it for it in lessons
-        if _norm_parity(it.get("parity")) == _norm_parity(parity) and str(it["day"]).strip().upper() == day_upper
-    ]
-    return dt_now, parity, day_upper, day_lessons
+async def _group_users_by_day(users: List[dict]) -> List[_DayGroup]:
+    """
+    Группирует по (scope расписания, дата, чётность, день): расписание
+    загружается и пары дня отбираются один раз на группу. Группы, чьё
+    расписание не загрузилось, пропускаются.
+    """
+    now_by_tz: Dict[str, Tuple[datetime, str]] = {}
+    groups: Dict[tuple, _DayGroup] = {}
+    for u in users:
+        tz = u.get("timezone") or settings.timezone
+        if tz not in now_by_tz:
+            dt = now_tz(tz)
+            now_by_tz[tz] = (dt, week_parity_for_date(dt, tz))
+        dt_now, parity = now_by_tz[tz]
+        day_upper = DAY_NAMES_UPPER[dt_now.weekday()]
+        ymd = dt_now.strftime("%Y-%m-%d")
+        key = (schedule_scope(u), ymd, parity, day_upper)
+        g = groups.get(key)
+        if g is None:
+            g = groups[key] = _DayGroup(str(u.get("group_code") or ""), ymd, parity, day_upper)
+        g.users.append(u)
+        g.now_minutes[u["telegram_id"]] = dt_now.hour * 60 + dt_now.minute
+
+    loaded: List[_DayGroup] = []
+    for g in groups.values():
+        # сбой одной группы (недоступная персональная таблица и т.п.) не должен
+        # оставить без рассылки остальных
+        try:
+            schedule = await load_schedule_for_user(g.users[0])
+        except Exception as e:
+            log.error("schedule load failed for group=%s (%d users): %s",
+                      g.group_code, len(g.users), e)
+            continue
+        g.lessons = schedule.day(g.parity, g.day_upper)
+        loaded.append(g)
+    if users:
+        log.debug("grouped %d users into %d schedule groups", len(users), len(groups))
+    return loaded
 
 
 def _parse_interval_minutes(time_range: str) -> tuple[int, int]:
@@ -248,7 +559,7 @@ def _parse_interval_minutes(time_range: str) -> tuple[int, int]:
 
 def _pick_current_or_next(day_lessons: list, now_minutes: int):
     # вернёт текущую (если идёт) или ближайшую будущую; сменится только ПОСЛЕ конца
-    for it in sorted(day_lessons, key=lambda x: _parse_interval_minutes(x["time"])[0]):
+    for it in day_lessons:  # уже по возрастанию начала (LessonIndex)
         s, e = _parse_interval_minutes(it["time"])
         if e > now_minutes:   # пока не закончилась — держим её
             return it
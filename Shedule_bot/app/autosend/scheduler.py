@@ -0,0 +1,97 @@
+# app/autosend/scheduler.py
+"""
+Очередь отложенных задач автоотправки: min-heap по времени срабатывания.
+
+Ключ задачи — любой hashable (например, ("send", telegram_id)); у ключа
+не больше одной запланированной задачи. Перепланирование и отмена — O(log n)
+(старые записи в куче помечаются устаревшими и пропускаются при извлечении).
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from app.utils.dt import get_tz
+
+
+class JobHeap:
+    def __init__(self) -> None:
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._jobs: Dict[Hashable, Tuple[float, int]] = {}
+        self._seq = itertools.count()
+
+    def schedule(self, key: Hashable, at: float) -> None:
+        """Запланировать (или перенести) задачу key на момент at (epoch seconds)."""
+        seq = next(self._seq)
+        self._jobs[key] = (at, seq)
+        heapq.heappush(self._heap, (at, seq, key))
+        if len(self._heap) > 2 * len(self._jobs) + 64:
+            self._compact()
+
+    def cancel(self, key: Hashable) -> None:
+        self._jobs.pop(key, None)
+
+    def when(self, key: Hashable) -> Optional[float]:
+        job = self._jobs.get(key)
+        return job[0] if job else None
+
+    def _drop_stale(self) -> None:
+        heap = self._heap
+        while heap:
+            at, seq, key = heap[0]
+            if self._jobs.get(key) == (at, seq):
+                return
+            heapq.heappop(heap)
+
+    def next_at(self) -> Optional[float]:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[Hashable]:
+        """Все задачи со временем <= now (включая просроченные), по порядку."""
+        due: List[Hashable] = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            _, _, key = heapq.heappop(self._heap)
+            del self._jobs[key]
+            due.append(key)
+
+    def _compact(self) -> None:
+        self._heap = [(at, seq, key) for key, (at, seq) in self._jobs.items()]
+        heapq.heapify(self._heap)
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+
+def parse_hhmm(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    try:
+        hh, mm = (value or "").strip().split(":")[:2]
+        h, m = int(hh), int(mm)
+    except ValueError:
+        return None
+    if 0 <= h < 24 and 0 <= m < 60:
+        return h, m
+    return None
+
+
+def local_now(tz_name: Optional[str], now_ts: float) -> datetime:
+    tz = get_tz(tz_name)
+    return datetime.fromtimestamp(now_ts, tz) if tz else datetime.fromtimestamp(now_ts)
+
+
+def fire_today(hm: Tuple[int, int], now_local: datetime) -> datetime:
+    """Сегодняшнее (по часам пользователя) HH:MM."""
+    return now_local.replace(hour=hm[0], minute=hm[1], second=0, microsecond=0)
+
+
+def next_fire(hm: Tuple[int, int], now_local: datetime) -> datetime:
+    """Ближайшее HH:MM строго после now_local в той же таймзоне (с учётом перехода на летнее время)."""
+    at = fire_today(hm, now_local)
+    if at <= now_local:
+        at = fire_today(hm, now_local + timedelta(days=1))
+    return at
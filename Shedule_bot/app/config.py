@@ -31,6 +31,15 @@ class Settings(BaseSettings):
     spreadsheet_id: str = Field(alias="SPREADSHEET_ID")
     sheet_gid: int = Field(alias="SHEET_GID")
     google_credentials: str = Field("google-credentials.json", alias="GOOGLE_CREDENTIALS")
+    # Кэш листа: после TTL отдаём старый снимок и обновляем его в фоне,
+    # но не дольше MAX_STALE с последней успешной проверки — дальше ждём загрузку.
+    sheet_cache_ttl_sec: int = Field(60, alias="SHEET_CACHE_TTL_SEC")
+    sheet_cache_max_stale_sec: int = Field(6 * 3600, alias="SHEET_CACHE_MAX_STALE_SEC")
+    # Фоновое обновление общего листа: раз в интервал и заранее перед временем автоотправки
+    sheet_refresh_interval_sec: int = Field(300, alias="SHEET_REFRESH_INTERVAL_SEC")
+    sheet_prefetch_lead_sec: int = Field(120, alias="SHEET_PREFETCH_LEAD_SEC")
+    # Сколько разных персональных таблиц пользователей держать в памяти
+    custom_sheet_cache_size: int = Field(32, alias="CUSTOM_SHEET_CACHE_SIZE")
 
     # База данных
     db_path: str = Field(str(ROOT_DIR / "app" / "data" / "bot.db"), alias="DB_PATH")
@@ -45,6 +54,29 @@ class Settings(BaseSettings):
     # my.itmo (опционально, для обогащения данных расписания)
     myitmo_enabled: bool = Field(False, alias="MYITMO_ENABLED")
     myitmo_timeout_sec: int = Field(20, alias="MYITMO_TIMEOUT_SEC")
+    # Пул keep-alive соединений к my.itmo: всего и на один хост
+    myitmo_http_pool_size: int = Field(100, alias="MYITMO_HTTP_POOL_SIZE")
+    myitmo_http_per_host: int = Field(20, alias="MYITMO_HTTP_PER_HOST")
+    # Прогрев my.itmo перед автоотправкой: за сколько секунд и сколько запросов параллельно
+    myitmo_prefetch_lead_sec: int = Field(180, alias="MYITMO_PREFETCH_LEAD_SEC")
+    myitmo_prefetch_concurrency: int = Field(8, alias="MYITMO_PREFETCH_CONCURRENCY")
+    # Автоотправка, пропущенная из-за рестарта/простоя, догоняется, если опоздали не больше чем на столько
+    autosend_catchup_sec: int = Field(3600, alias="AUTOSEND_CATCHUP_SEC")
+    # Рассылка в Telegram: сообщений в секунду на бота, параллельных запросов,
+    # минимальный интервал между сообщениями в один чат
+    tg_send_rate: float = Field(25.0, alias="TG_SEND_RATE")
+    tg_send_concurrency: int = Field(16, alias="TG_SEND_CONCURRENCY")
+    tg_chat_interval_sec: float = Field(1.0, alias="TG_CHAT_INTERVAL_SEC")
+    # Персистентный кэш my.itmo (cache.db): сколько копия считается свежей и
+    # насколько старую копию ещё можно отдать, если my.itmo недоступен
+    myitmo_cache_fresh_sec: int = Field(900, alias="MYITMO_CACHE_FRESH_SEC")
+    myitmo_cache_max_stale_sec: int = Field(7 * 24 * 3600, alias="MYITMO_CACHE_MAX_STALE_SEC")
+    # Фоновое обновление OAuth-токенов (my.itmo, Google Calendar): раз в
+    # TOKEN_REFRESH_INTERVAL_SEC обновляем те, что истекут в ближайшие TOKEN_REFRESH_LEAD_SEC
+    token_refresh_interval_sec: int = Field(60, alias="TOKEN_REFRESH_INTERVAL_SEC")
+    token_refresh_lead_sec: int = Field(600, alias="TOKEN_REFRESH_LEAD_SEC")
+    token_refresh_concurrency: int = Field(4, alias="TOKEN_REFRESH_CONCURRENCY")
+    token_refresh_batch: int = Field(200, alias="TOKEN_REFRESH_BATCH")
 
     # ISU schedule lookup: один сервисный аккаунт ИСУ для индексации и загрузки HTML
     isu_index_login: Optional[str] = Field(None, alias="ISU_INDEX_LOGIN")
@@ -65,9 +97,16 @@ class Settings(BaseSettings):
     isu_cache_db: str = Field(
         str(ROOT_DIR / "app" / "data" / "isu_cache.db"), alias="ISU_CACHE_DB"
     )
+    # Снимки расписания/ответов внешних API для тёплого старта (по умолчанию — cache.db рядом с bot.db)
+    cache_db: Optional[str] = Field(None, alias="CACHE_DB")
+    # Вызовы БД через асинхронный фасад дольше этого порога пишутся в лог
+    db_slow_query_ms: int = Field(100, alias="DB_SLOW_QUERY_MS")
+    # Кэш профилей пользователей в памяти (write-through из services/db.py)
+    user_cache_size: int = Field(5000, alias="USER_CACHE_SIZE")
+    user_cache_ttl_sec: int = Field(300, alias="USER_CACHE_TTL_SEC")
 
     # --- нормализация путей относительно корня проекта ---
-    @field_validator("google_credentials", "db_path", "log_file", "isu_cache_db", mode="before")
+    @field_validator("google_credentials", "db_path", "log_file", "isu_cache_db", "cache_db", mode="before")
     @classmethod
     def _expand_path(cls, v: Optional[str]) -> Optional[str]:
         if not v:
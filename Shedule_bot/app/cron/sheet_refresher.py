@@ -0,0 +1,43 @@
+# app/cron/sheet_refresher.py
+"""
+Держит общий снимок листа тёплым: перепроверка раз в SHEET_REFRESH_INTERVAL_SEC,
+чтобы кнопки расписания не ждали Google. Перед утренней рассылкой листы
+дополнительно прогревает планировщик автоотправки (app/autosend/prefetch.py)
+— по времени рассылки в таймзоне каждого пользователя.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from app.config import settings
+from app.services.sheet_cache import refresh_sheet_snapshot
+
+log = logging.getLogger("schedule.refresher")
+
+_task: Optional[asyncio.Task] = None
+
+
+async def _loop() -> None:
+    interval = max(30, int(settings.sheet_refresh_interval_sec))
+    log.info("sheet refresher started: interval=%ss", interval)
+    while True:
+        try:
+            started = time.monotonic()
+            snapshot = await refresh_sheet_snapshot(settings.spreadsheet_id, settings.sheet_gid)
+            log.debug("sheet refreshed (interval) in %.0fms, version=%s",
+                      (time.monotonic() - started) * 1000, snapshot.version[:24])
+            await asyncio.sleep(interval)
+        except asyncio.CancelledError:
+            break
+        except Exception:
+            log.exception("sheet refresh failed")
+            await asyncio.sleep(interval)
+
+
+def start_sheet_refresher() -> None:
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.ensure_future(_loop())
@@ -0,0 +1,123 @@
+# app/cron/token_refresher.py
+"""
+Фоновое обновление OAuth-токенов my.itmo и Google Calendar.
+
+Раз в TOKEN_REFRESH_INTERVAL_SEC выбираем токены, которые истекут в ближайшие
+TOKEN_REFRESH_LEAD_SEC, и обновляем их пачкой с ограниченным параллелизмом.
+Запросы пользователей и автоотправка после этого почти никогда не упираются
+в лишний OAuth-запрос и запись в БД.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from app.config import settings
+from app.services.db_async import adb
+from app.services.gcal_client import ensure_token as gcal_ensure_token
+from app.services.myitmo_client import refresh_tokens as myitmo_refresh_tokens
+from app.utils.ttl_cache import TTLCache
+
+log = logging.getLogger("tokens.refresher")
+
+# Неудачные обновления (отозванный refresh_token и т.п.) не повторяем каждую минуту.
+_FAIL_BACKOFF_SEC = 1800
+_BACKOFF: TTLCache[Tuple[str, int], bool] = TTLCache("token_refresh_backoff", maxsize=4096, ttl=_FAIL_BACKOFF_SEC)
+
+_task: Optional[asyncio.Task] = None
+
+
+def _cutoff_utc(lead_sec: int) -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds=lead_sec)).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+async def _refresh_myitmo(u: Dict) -> None:
+    bundle = await myitmo_refresh_tokens(
+        username=u["myitmo_username"],
+        refresh_token=u["myitmo_refresh_token"],
+        timeout=settings.myitmo_timeout_sec,
+    )
+    await adb.set_myitmo_tokens(
+        int(u["telegram_id"]),
+        bundle["access_token"],
+        bundle["refresh_token"],
+        bundle["token_expiry"],
+    )
+
+
+async def _refresh_gcal(uid: int, lead_sec: int) -> None:
+    # ensure_token сам решает, пора ли, и пишет новый токен в БД
+    await asyncio.to_thread(gcal_ensure_token, uid, lead_sec)
+
+
+async def _run_batch(
+    kind: str,
+    items: Iterable[Tuple[int, Callable[[], Awaitable[None]]]],
+    sem: asyncio.Semaphore,
+) -> Tuple[int, int]:
+    ok = fail = 0
+
+    async def _one(uid: int, fn: Callable[[], Awaitable[None]]) -> None:
+        nonlocal ok, fail
+        async with sem:
+            try:
+                await fn()
+                ok += 1
+            except Exception as e:
+                fail += 1
+                _BACKOFF.set((kind, uid), True)
+                log.warning("%s token refresh failed user=%s: %s", kind, uid, e)
+
+    jobs = [_one(uid, fn) for uid, fn in items if _BACKOFF.get((kind, uid)) is None]
+    if jobs:
+        await asyncio.gather(*jobs)
+    return ok, fail
+
+
+async def refresh_due_tokens() -> None:
+    lead = max(60, int(settings.token_refresh_lead_sec))
+    batch = max(1, int(settings.token_refresh_batch))
+    cutoff = _cutoff_utc(lead)
+    sem = asyncio.Semaphore(max(1, int(settings.token_refresh_concurrency)))
+
+    started = time.monotonic()
+    myitmo_users = await adb.list_myitmo_tokens_expiring(cutoff, batch)
+    gcal_ids = await adb.list_gcal_tokens_expiring(cutoff, batch)
+    m_ok, m_fail = await _run_batch(
+        "myitmo",
+        ((int(u["telegram_id"]), lambda u=u: _refresh_myitmo(u)) for u in myitmo_users),
+        sem,
+    )
+    g_ok, g_fail = await _run_batch(
+        "gcal",
+        ((uid, lambda uid=uid: _refresh_gcal(uid, lead)) for uid in gcal_ids),
+        sem,
+    )
+    if m_ok or m_fail or g_ok or g_fail:
+        log.info(
+            "tokens refreshed: myitmo ok=%d fail=%d, gcal ok=%d fail=%d in %.1fs",
+            m_ok, m_fail, g_ok, g_fail, time.monotonic() - started,
+        )
+
+
+async def _loop() -> None:
+    interval = max(15, int(settings.token_refresh_interval_sec))
+    log.info("token refresher started: interval=%ss lead=%ss", interval, settings.token_refresh_lead_sec)
+    while True:
+        try:
+            await refresh_due_tokens()
+            await asyncio.sleep(interval)
+        except asyncio.CancelledError:
+            break
+        except Exception:
+            log.exception("token refresh tick failed")
+            await asyncio.sleep(interval)
+
+
+def start_token_refresher() -> None:
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.ensure_future(_loop())
@@ -9,14 +9,14 @@ from aiogram.types import CallbackQuery, Message
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from app.config import settings
-from app.services.db import (
-    list_user_ids_for_broadcast,
-    get_bot_mode,
-    set_bot_mode,
-    get_bot_setting,
-    set_bot_setting,
-)
 from app.bot import bot
+from app.utils.loop_lag import get_loop_lag_stats
+from app.services.sheets_client import get_fetch_stats
+from app.services.sheet_cache import sheet_snapshot_age
+from app.utils.ttl_cache import get_cache_stats
+from app.utils.single_flight import get_flight_stats
+from app.services.db_async import adb, aisu
+from app.autosend.delivery import get_delivery_stats
 
 router = Router()
 
@@ -41,8 +41,8 @@ def _is_admin(user_id: int) -> bool:
 
 # ─── клавиатуры ───────────────────────────────────────────────────────────────
 
-def _kb_admin_root():
-    mode = get_bot_mode()
+async def _kb_admin_root():
+    mode = await adb.get_bot_mode()
     mode_label = {"normal": "🟢 Обычный", "exams": "📋 Экзамены", "holidays": "🏖 Каникулы"}.get(mode, mode)
     kb = InlineKeyboardBuilder()
     kb.button(text="📢 Рассылка",               callback_data="admin:broadcast:start")
@@ -53,8 +53,8 @@ def _kb_admin_root():
     return kb.as_markup()
 
 
-def _kb_mode_menu():
-    current = get_bot_mode()
+async def _kb_mode_menu():
+    current = await adb.get_bot_mode()
     kb = InlineKeyboardBuilder()
     for key, label in [("normal", "🟢 Обычный"), ("exams", "📋 Экзамены"), ("holidays", "🏖 Каникулы")]:
         text = f"✅ {label}" if current == key else label
@@ -89,7 +89,7 @@ async def admin_cmd(msg: Message):
     if not settings.admin_telegram_id:
         await msg.answer("ADMIN_TELEGRAM_ID не задан в .env.")
         return
-    await msg.answer("🔧 <b>Админ-панель</b>\nВыберите действие:", reply_markup=_kb_admin_root())
+    await msg.answer("🔧 <b>Админ-панель</b>\nВыберите действие:", reply_markup=await _kb_admin_root())
 
 
 @router.callback_query(F.data == "admin:root")
@@ -98,7 +98,7 @@ async def admin_root(q: CallbackQuery, state: FSMContext):
         await q.answer("Нет доступа.", show_alert=True)
         return
     await state.clear()
-    await q.message.edit_text("🔧 <b>Админ-панель</b>\nВыберите действие:", reply_markup=_kb_admin_root())
+    await q.message.edit_text("🔧 <b>Админ-панель</b>\nВыберите действие:", reply_markup=await _kb_admin_root())
     await q.answer()
 
 
@@ -109,17 +109,58 @@ async def admin_stats(q: CallbackQuery):
     if not _is_admin(q.from_user.id):
         await q.answer("Нет доступа.", show_alert=True)
         return
-    user_ids = list_user_ids_for_broadcast()
-    mode = get_bot_mode()
-    sid  = get_bot_setting("exam_spreadsheet_id") or "не задан"
-    gid  = get_bot_setting("exam_sheet_gid") or "не задан"
+    user_ids = await adb.list_user_ids_for_broadcast()
+    mode = await adb.get_bot_mode()
+    schema = await adb.get_schema_version()
+    sid  = await adb.get_bot_setting("exam_spreadsheet_id") or "не задан"
+    gid  = await adb.get_bot_setting("exam_sheet_gid") or "не задан"
     mode_label = {"normal": "🟢 Обычный", "exams": "📋 Экзамены", "holidays": "🏖 Каникулы"}.get(mode, mode)
+    lag = get_loop_lag_stats()
+    fetch = get_fetch_stats().get((settings.spreadsheet_id, int(settings.sheet_gid)))
+    fetch_line = (
+        f"📥 Последняя загрузка таблицы: <b>{fetch['bytes'] / 1024:.1f}</b> КБ, "
+        f"{fetch['fetch_ms']:.0f} мс + разбор {fetch['parse_ms']:.0f} мс"
+        if fetch else "📥 Таблица ещё не загружалась"
+    )
+    age = sheet_snapshot_age(settings.spreadsheet_id, settings.sheet_gid)
+    if age is not None:
+        fetch_line += f", снимок подтверждён {age / 60:.0f} мин назад"
+    cache_lines = "\n".join(
+        f"• <code>{c['name']}</code>: {c['size']}/{c['maxsize']}, "
+        f"hit {c['hit_rate'] * 100:.0f}% ({c['hits']}/{c['hits'] + c['misses']}), "
+        f"вытеснено {c['evictions']}"
+        for c in get_cache_stats()
+    )
+    flight_lines = "\n".join(
+        f"• <code>{f['name']}</code>: загрузок {f['started']}, склеено {f['coalesced']}, в полёте {f['inflight']}"
+        for f in get_flight_stats()
+    )
+    db_lines = "\n".join(
+        f"• <code>{d['name']}</code>: вызовов {d['calls']}, медленных {d['slow']}, макс. {d['max_ms']:.0f} мс"
+        for d in (adb.stats(), aisu.stats())
+    )
+    dlv = get_delivery_stats()
+    delivery_line = (
+        f"📤 Последняя рассылка ({dlv['label']}): <b>{dlv['ok']}</b>/{dlv['total']} "
+        f"за {dlv['elapsed_sec']:.1f} с, {dlv['per_sec']:.1f} сообщ./с, "
+        f"повторов {dlv['retried']}, ошибок {dlv['failed']}"
+        if dlv else "📤 Рассылок ещё не было"
+    )
     text = (
         f"📊 <b>Статистика</b>\n\n"
         f"👥 Пользователей: <b>{len(user_ids)}</b>\n"
         f"🔄 Режим: <b>{mode_label}</b>\n"
         f"📋 Spreadsheet ID: <code>{sid}</code>\n"
-        f"📋 Sheet GID: <code>{gid}</code>"
+        f"📋 Sheet GID: <code>{gid}</code>\n\n"
+        f"⏱ Лаг event loop: сейчас <b>{lag['last_ms']:.0f}</b> мс, "
+        f"макс. за минуту <b>{lag['max_ms']:.0f}</b> мс, "
+        f"за всё время <b>{lag['max_total_ms']:.0f}</b> мс "
+        f"(зависаний: {lag['stalls_total']})\n"
+        f"{fetch_line}\n"
+        f"{delivery_line}\n\n"
+        f"🗃 <b>Кэши</b>\n{cache_lines}\n\n"
+        f"🔗 <b>Single-flight</b>\n{flight_lines}\n\n"
+        f"💾 <b>БД</b> (схема v{schema})\n{db_lines}"
     )
     await q.message.edit_text(text, reply_markup=_kb_back())
     await q.answer()
@@ -132,7 +173,7 @@ async def admin_mode_menu(q: CallbackQuery):
     if not _is_admin(q.from_user.id):
         await q.answer("Нет доступа.", show_alert=True)
         return
-    await q.message.edit_text("🔄 Выберите режим работы бота:", reply_markup=_kb_mode_menu())
+    await q.message.edit_text("🔄 Выберите режим работы бота:", reply_markup=await _kb_mode_menu())
     await q.answer()
 
 
@@ -143,13 +184,13 @@ async def admin_mode_set(q: CallbackQuery):
         return
     mode = q.data.split(":")[-1]
     try:
-        set_bot_mode(mode)
+        await adb.set_bot_mode(mode)
     except ValueError as e:
         await q.answer(str(e), show_alert=True)
         return
     label = {"normal": "Обычный", "exams": "Экзамены", "holidays": "Каникулы"}.get(mode, mode)
     await q.answer(f"Режим изменён: {label}", show_alert=True)
-    await q.message.edit_text("🔄 Выберите режим работы бота:", reply_markup=_kb_mode_menu())
+    await q.message.edit_text("🔄 Выберите режим работы бота:", reply_markup=await _kb_mode_menu())
 
 
 # ─── Расписание экзаменов ─────────────────────────────────────────────────────
@@ -159,8 +200,8 @@ async def admin_exam_set(q: CallbackQuery, state: FSMContext):
     if not _is_admin(q.from_user.id):
         await q.answer("Нет доступа.", show_alert=True)
         return
-    sid = get_bot_setting("exam_spreadsheet_id") or "—"
-    gid = get_bot_setting("exam_sheet_gid") or "—"
+    sid = await adb.get_bot_setting("exam_spreadsheet_id") or "—"
+    gid = await adb.get_bot_setting("exam_sheet_gid") or "—"
     await state.set_state(AdminExamSheet.waiting_url)
     await q.message.answer(
         f"📋 <b>Расписание экзаменов</b>\n\n"
@@ -182,7 +223,7 @@ async def admin_exam_url(msg: Message, state: FSMContext):
     text = (msg.text or "").strip()
     if text.lower() in ("/cancel", "отмена"):
         await state.clear()
-        await msg.answer("Отменено.", reply_markup=_kb_admin_root())
+        await msg.answer("Отменено.", reply_markup=await _kb_admin_root())
         return
 
     spreadsheet_id: str | None = None
@@ -211,14 +252,14 @@ async def admin_exam_url(msg: Message, state: FSMContext):
         await msg.answer("Не удалось разобрать ссылку. Попробуйте ещё раз.")
         return
 
-    set_bot_setting("exam_spreadsheet_id", spreadsheet_id)
-    set_bot_setting("exam_sheet_gid", str(sheet_gid))
+    await adb.set_bot_setting("exam_spreadsheet_id", spreadsheet_id)
+    await adb.set_bot_setting("exam_sheet_gid", str(sheet_gid))
     await state.clear()
     await msg.answer(
         f"✅ Расписание экзаменов обновлено!\n\n"
         f"Spreadsheet ID: <code>{spreadsheet_id}</code>\n"
         f"Sheet GID: <code>{sheet_gid}</code>",
-        reply_markup=_kb_admin_root(),
+        reply_markup=await _kb_admin_root(),
     )
 
 
@@ -241,7 +282,7 @@ async def admin_broadcast_text(msg: Message, state: FSMContext):
         return
     if (msg.text or "").strip().lower() in ("/cancel", "отмена"):
         await state.clear()
-        await msg.answer("Отменено.", reply_markup=_kb_admin_root())
+        await msg.answer("Отменено.", reply_markup=await _kb_admin_root())
         return
     text = (msg.html_text or msg.text or "").strip()
     if not text:
@@ -249,7 +290,7 @@ async def admin_broadcast_text(msg: Message, state: FSMContext):
         return
     await state.update_data(broadcast_text=text)
     await state.set_state(AdminBroadcast.waiting_confirm)
-    user_count = len(list_user_ids_for_broadcast())
+    user_count = len(await adb.list_user_ids_for_broadcast())
     await msg.answer(
         f"Подтвердите рассылку ({user_count} получателей):\n\n{text}",
         reply_markup=_kb_broadcast_confirm(),
@@ -262,7 +303,7 @@ async def admin_broadcast_cancel(q: CallbackQuery, state: FSMContext):
         await q.answer("Нет доступа.", show_alert=True)
         return
     await state.clear()
-    await q.message.answer("Рассылка отменена.", reply_markup=_kb_admin_root())
+    await q.message.answer("Рассылка отменена.", reply_markup=await _kb_admin_root())
     await q.answer()
 
 
@@ -279,7 +320,7 @@ async def admin_broadcast_send(q: CallbackQuery, state: FSMContext):
         await q.answer()
         return
 
-    user_ids = list_user_ids_for_broadcast()
+    user_ids = await adb.list_user_ids_for_broadcast()
     ok = 0
     fail = 0
     for uid in user_ids:
@@ -294,6 +335,6 @@ async def admin_broadcast_send(q: CallbackQuery, state: FSMContext):
         "Рассылка завершена.\n"
         f"✅ Отправлено: <b>{ok}</b>\n"
         f"❌ Ошибок: <b>{fail}</b>",
-        reply_markup=_kb_admin_root(),
+        reply_markup=await _kb_admin_root(),
     )
     await q.answer("Готово")
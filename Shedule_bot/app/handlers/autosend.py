@@ -8,12 +8,7 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 
-from app.services.db import (
-    get_user,
-    set_autosend_enabled,
-    set_autosend_mode,
-    set_autosend_time,
-)
+from app.services.db_async import adb
 from app.config import settings
 
 router = Router()
@@ -74,20 +69,20 @@ def _normalize_hhmm(s: str) -> str:
 
 @router.callback_query(F.data == "autosend:open")
 async def autosend_open(q: CallbackQuery):
-    user = get_user(q.from_user.id)
+    user = await adb.get_user(q.from_user.id)
     if not user or not user.get("group_code"):
         await q.answer("Сначала выберите группу.", show_alert=True); return
 
     # автovключаем + дефолтный режим 1
     if not user.get("autosend_enabled"):
-        set_autosend_enabled(q.from_user.id, True)
+        await adb.set_autosend_enabled(q.from_user.id, True)
     if not user.get("autosend_mode"):
-        set_autosend_mode(q.from_user.id, 1)
+        await adb.set_autosend_mode(q.from_user.id, 1)
     # ВАЖНО: не трогаем уже заданное время, даже если оно вне быстрых вариантов
     if not user.get("autosend_time"):
-        set_autosend_time(q.from_user.id, _safe_default_time())
+        await adb.set_autosend_time(q.from_user.id, _safe_default_time())
 
-    user = get_user(q.from_user.id)
+    user = await adb.get_user(q.from_user.id)
     await q.message.edit_text(
         _text_root(user),
         reply_markup=_kb_root(user.get("autosend_mode"), user.get("autosend_time") or _safe_default_time())
@@ -104,7 +99,7 @@ async def autosend_back(q: CallbackQuery):
 
 @router.callback_query(F.data == "autosend:disable")
 async def autosend_disable(q: CallbackQuery):
-    set_autosend_enabled(q.from_user.id, False)
+    await adb.set_autosend_enabled(q.from_user.id, False)
     # Покажем короткое подтверждение и вернёмся в меню
     await q.answer("Автоотправка выключена.")
     from app.handlers.start import _kb_main_menu
@@ -122,14 +117,14 @@ async def autosend_set_mode(q: CallbackQuery):
     mode = int(q.data.split(":")[-1])
     if mode not in (1, 2):
         await q.answer("Неверный режим", show_alert=True); return
-    set_autosend_mode(q.from_user.id, mode)
+    await adb.set_autosend_mode(q.from_user.id, mode)
     await autosend_open(q)
 
 # ===== выбор времени (только 06:00–08:00) =====
 
 @router.callback_query(F.data == "autosend:choose_time")
 async def autosend_choose_time(q: CallbackQuery):
-    user = get_user(q.from_user.id)
+    user = await adb.get_user(q.from_user.id)
     hhmm = user.get("autosend_time") or _safe_default_time()
     await q.message.edit_text("Выберите время отправки:", reply_markup=_kb_times(hhmm))
     await q.answer()
@@ -142,7 +137,7 @@ async def autosend_set_time(q: CallbackQuery, state: FSMContext):
         return await autosend_time_manual_prompt(q, state)
     if val not in ALLOWED_TIMES:
         await q.answer("Выберите время.", show_alert=True); return
-    set_autosend_time(q.from_user.id, val)
+    await adb.set_autosend_time(q.from_user.id, val)
     await state.clear()
     await autosend_open(q)
 
@@ -156,9 +151,8 @@ async def autosend_time_manual_prompt(q: CallbackQuery, state: FSMContext):
 
 @router.message(AutoSendTime.waiting_time, F.text.regexp(TIME_RE))
 async def autosend_time_manual_set(msg: Message, state: FSMContext):
-    from app.services.db import set_autosend_time, get_user
     hhmm = _normalize_hhmm(msg.text)
-    set_autosend_time(msg.from_user.id, hhmm)
+    await adb.set_autosend_time(msg.from_user.id, hhmm)
     await state.clear()
-    u = get_user(msg.from_user.id)
+    u = await adb.get_user(msg.from_user.id)
     await msg.answer(f"⏰ Время обновлено: <b>{hhmm}</b>.\nОткройте меню автоотправки для проверки.")
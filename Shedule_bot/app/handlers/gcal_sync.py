@@ -3,11 +3,9 @@ from __future__ import annotations
 import os
 import re
 import asyncio
-import time
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from app.services.gcal_client import list_calendars, create_calendar
-from app.services.db import get_user, set_gcal_calendar_id
 from contextlib import suppress
 from aiogram.types import Message
 from aiogram.exceptions import TelegramBadRequest
@@ -19,28 +17,20 @@ from aiogram import Router, F
 from datetime import timedelta
 from aiogram.types import CallbackQuery
 from app.services.gcal_client import upsert_event
-from app.handlers.schedule_view import _load_lessons_for_user_group
+from app.handlers.schedule_view import _load_schedule_for_user
+from app.services.lesson_index import LessonIndex
+from app.utils.ttl_cache import TTLCache
 from app.services.gcal_mapper import lesson_to_event
 from app.utils.dt import now_tz
-from app.services.db import set_gcal_last_sync
 from app.utils.week_parity import week_parity_for_date
-from app.services.db import set_gcal_autosync_weekday, set_gcal_autosync_time, get_gcal_autosync, set_gcal_autosync_mode, set_gcal_autosync_enabled
-
-from app.services.db import (
-    get_user,
-    # ожидаем, что есть эти функции (добавь в db.py при необходимости):
-    # set_gcal_connected(telegram_id: int, connected: bool) -> None
-    # set_gcal_tokens(telegram_id: int, access: str, refresh: str|None, expiry_iso: str) -> None
-    # set_gcal_calendar_id(telegram_id: int, cal_id: str) -> None
-    # set_gcal_last_sync(telegram_id: int, iso: str) -> None
-)
+from app.services.db_async import adb
 from app.config import settings
 
 import logging
 log = logging.getLogger("gcal")
 
 router = Router()
-_GCAL_NAME_CACHE: dict[tuple[int, str], tuple[float, str]] = {}
+_GCAL_NAME_CACHE: TTLCache[tuple[int, str], str] = TTLCache("gcal_calendar_names", maxsize=1024, ttl=300)
 
 class AutoSyncTime(StatesGroup):
     waiting_time = State()
@@ -64,22 +54,14 @@ def _normalize_hhmm(raw: str) -> str | None:
     return f"{hh:02d}:{mm:02d}"
 
 
-def _norm_parity(p: str) -> str:
-    x = str(p or "").strip().lower().replace("ё", "е")
-    if "неч" in x:
-        return "нечёт"
-    if "чет" in x:
-        return "чёт"
-    return x
-
 async def _sync_next_days_for_user(user_id: int, days: int = 7) -> tuple[int, int]:
-    u = get_user(user_id)
+    u = await adb.get_user(user_id)
     if not u or not u.get("gcal_connected"):
         return (0, 0)
 
     tz = u.get("timezone") or settings.timezone
     base = now_tz(tz)
-    lessons = await _load_lessons_for_user_group(u)
+    schedule = await _load_schedule_for_user(u)
     cal_id = u.get("gcal_calendar_id")
     if not cal_id:
         return (0, 0)
@@ -94,11 +76,7 @@ async def _sync_next_days_for_user(user_id: int, days: int = 7) -> tuple[int, in
         day_upper = _weekday_upper(dt_day)
         parity = week_parity_for_date(dt_day, tz)  # чётность конкретного дня!
 
-        day_lessons = [
-            it for it in lessons
-            if _norm_parity(it.get("parity", "")) == _norm_parity(parity)
-            and str(it.get("day","")).strip().upper() == day_upper
-        ]
+        day_lessons = schedule.day(parity, day_upper)
 
         for lesson in day_lessons:
             try:
@@ -111,7 +89,7 @@ async def _sync_next_days_for_user(user_id: int, days: int = 7) -> tuple[int, in
 
     try:
         from datetime import datetime, timezone
-        set_gcal_last_sync(user_id, datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
+        await adb.set_gcal_last_sync(user_id, datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
     except Exception:
         pass
 
@@ -166,16 +144,15 @@ async def _inject_calendar_title(u: dict, user_id: int) -> dict:
 
     cache_key = (int(user_id), cal_id)
     cached = _GCAL_NAME_CACHE.get(cache_key)
-    now = time.monotonic()
-    if cached and cached[0] > now:
-        out["gcal_calendar_title"] = cached[1]
+    if cached:
+        out["gcal_calendar_title"] = cached
         return out
 
     try:
         cals = await asyncio.to_thread(list_calendars, user_id)
         title = next((str(it.get("summary") or "").strip() for it in cals if it.get("id") == cal_id), "")
         if title:
-            _GCAL_NAME_CACHE[cache_key] = (now + 300, title)
+            _GCAL_NAME_CACHE.set(cache_key, title)
             out["gcal_calendar_title"] = title
         else:
             out["gcal_calendar_title"] = _calendar_label(cal_id)
@@ -320,7 +297,9 @@ def _status_text(u: dict) -> str:
 
 @router.callback_query(F.data.in_({"main:gcal", "gcal:open"}))
 async def gcal_open(q: CallbackQuery):
-    u = get_user(q.from_user.id)
+    # OAuth-колбэк пишет токены из отдельного процесса (oauth_server) — перечитываем профиль
+    await adb.invalidate_user(q.from_user.id)
+    u = await adb.get_user(q.from_user.id)
     if not u:
         await q.answer("Сначала /start", show_alert=True); return
     # добавим в объект user поле telegram_id, чтобы собрать URL с state
@@ -341,7 +320,7 @@ async def gcal_choose_calendar(q: CallbackQuery, state: FSMContext):
     with suppress(TelegramBadRequest):
         await q.answer()
 
-    u = get_user(q.from_user.id)
+    u = await adb.get_user(q.from_user.id)
     if not u or not u.get("gcal_connected"):
         if q.message:
             await q.message.answer("Сначала подключите Google Calendar.")
@@ -375,7 +354,7 @@ async def gcal_cal_refresh(q: CallbackQuery, state: FSMContext):
     with suppress(TelegramBadRequest):
         await q.answer("Обновляю…")
 
-    u = get_user(q.from_user.id) or {}
+    u = await adb.get_user(q.from_user.id) or {}
     try:
         cals = await asyncio.to_thread(list_calendars, q.from_user.id)
     except Exception:
@@ -409,7 +388,7 @@ async def gcal_cal_select(q: CallbackQuery, state: FSMContext):
         return await gcal_choose_calendar(q, state)
 
     try:
-        set_gcal_calendar_id(q.from_user.id, cal_id)
+        await adb.set_gcal_calendar_id(q.from_user.id, cal_id)
     except Exception:
         log.exception("set_gcal_calendar_id failed user=%s id=%s", q.from_user.id, cal_id)
     await gcal_open(q)
@@ -419,13 +398,13 @@ async def gcal_create_separate(q: CallbackQuery):
     with suppress(TelegramBadRequest):
         await q.answer("Создаю календарь…")
 
-    u = get_user(q.from_user.id) or {}
+    u = await adb.get_user(q.from_user.id) or {}
     title = f"Расписание ({u.get('group_code') or 'бот'})"
     tz = u.get("timezone") or settings.timezone
 
     try:
         new_id = await asyncio.to_thread(create_calendar, q.from_user.id, title, tz)
-        set_gcal_calendar_id(q.from_user.id, new_id)
+        await adb.set_gcal_calendar_id(q.from_user.id, new_id)
         msg = f"✅ Календарь «{title}» создан и выбран."
     except Exception:
         log.exception("create_calendar failed user=%s", q.from_user.id)
@@ -443,11 +422,7 @@ async def gcal_create_separate(q: CallbackQuery):
 
 @router.callback_query(F.data == "gcal:cal:primary")
 async def gcal_set_primary(q: CallbackQuery):
-    try:
-        from app.services.db import set_gcal_calendar_id  # type: ignore
-    except Exception:
-        await q.answer("Не найдена функция set_gcal_calendar_id в БД.", show_alert=True); return
-    set_gcal_calendar_id(q.from_user.id, "primary")
+    await adb.set_gcal_calendar_id(q.from_user.id, "primary")
     await gcal_open(q)
 
 # ---------- sync actions (stubs for now) ----------
@@ -456,7 +431,7 @@ async def gcal_set_primary(q: CallbackQuery):
 async def gcal_sync_today(q: CallbackQuery):
     with suppress(TelegramBadRequest):
         await q.answer("Синхронизация на сегодня…")
-    u = get_user(q.from_user.id)
+    u = await adb.get_user(q.from_user.id)
     if not u or not u.get("gcal_connected"):
         await q.answer("Сначала подключите Google Calendar.", show_alert=True); return
     if not u.get("gcal_calendar_id"):
@@ -474,8 +449,8 @@ async def gcal_sync_today(q: CallbackQuery):
         pass
 
     # пары пользователя
-    lessons = await _load_lessons_for_user_group(u)
-    day_lessons = [it for it in lessons if _norm_parity(it.get("parity")) == _norm_parity(parity) and it["day"] == day_upper]
+    schedule = await _load_schedule_for_user(u)
+    day_lessons = schedule.day(parity, day_upper)
 
     cal_id = u.get("gcal_calendar_id")
     ok, fail = 0, 0
@@ -493,7 +468,7 @@ async def gcal_sync_today(q: CallbackQuery):
     # отметка о синхронизации
     try:
         from datetime import datetime, timezone
-        set_gcal_last_sync(
+        await adb.set_gcal_last_sync(
             q.from_user.id,
             datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
         )
@@ -503,7 +478,7 @@ async def gcal_sync_today(q: CallbackQuery):
     log.info("sync_today done user=%s ok=%d fail=%d", q.from_user.id, ok, fail)
 
     # Перерисовываем экран статуса
-    u_ref = {**(get_user(q.from_user.id) or u), "telegram_id": q.from_user.id}
+    u_ref = {**(await adb.get_user(q.from_user.id) or u), "telegram_id": q.from_user.id}
     msg = _status_text(u_ref)
     msg += f"\n\nГотово: добавлено/обновлено {ok}, ошибок {fail}."
     await q.message.edit_text(
@@ -513,18 +488,16 @@ async def gcal_sync_today(q: CallbackQuery):
     )
 
 async def _sync_today_for_user(user_id: int) -> tuple[int,int]:
-    u = get_user(user_id)
+    u = await adb.get_user(user_id)
     if not u or not u.get("gcal_connected"):
         return (0, 0)
     tz = u.get("timezone") or settings.timezone
     now = now_tz(tz)
     parity = week_parity_for_date(now, tz)
     day_upper = _weekday_upper(now)
-    lessons = await _load_lessons_for_user_group(u)
-    unknown_hushed = [it for it in lessons if _is_hushed_unknown(it)]
-    today = [it for it in lessons
-             if _norm_parity(it.get("parity","")) == _norm_parity(parity)
-             and str(it.get("day","")).strip().upper() == day_upper]
+    schedule = await _load_schedule_for_user(u)
+    unknown_hushed = [it for it in schedule.all() if _is_hushed_unknown(it)]
+    today = schedule.day(parity, day_upper)
     if unknown_hushed:
         subj_names = sorted(
             {(it.get("subject") or it.get("text") or "Предмет").split(" —")[0] for it in unknown_hushed})
@@ -545,12 +518,12 @@ async def _sync_today_for_user(user_id: int) -> tuple[int,int]:
             log.exception("sync_today core failed user=%s lesson=%r", user_id, lesson)
     try:
         from datetime import datetime, timezone
-        set_gcal_last_sync(user_id, datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
+        await adb.set_gcal_last_sync(user_id, datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
     except Exception:
         pass
     return ok, fail
 
-async def _sync_week_for_user(u: dict, lessons: list[dict], weeks_ahead: int) -> tuple[int, int]:
+async def _sync_week_for_user(u: dict, schedule: LessonIndex, weeks_ahead: int) -> tuple[int, int]:
     """
     Синхронизирует одну неделю пользователя.
     weeks_ahead=0 — текущая, 1 — следующая.
@@ -561,9 +534,8 @@ async def _sync_week_for_user(u: dict, lessons: list[dict], weeks_ahead: int) ->
     monday = base - timedelta(days=base.weekday()) + timedelta(days=7 * weeks_ahead)
     parity = week_parity_for_date(monday, tz)
 
-    # фильтр по чётности
-    def _norm(x): return _norm_parity(x)
-    week_lessons = [it for it in lessons if _norm(it.get("parity")) == _norm(parity)]
+    # пары нужной чётности — готовый срез индекса
+    week_lessons = list(schedule.week(parity))
 
     # (если у тебя есть фильтр «история/см. прилож.» — применим)
     try:
@@ -607,7 +579,7 @@ async def gcal_sync_week(q: CallbackQuery):
     with suppress(TelegramBadRequest):
         await q.answer("Синхронизирую 2 недели…")
 
-    u = get_user(q.from_user.id)
+    u = await adb.get_user(q.from_user.id)
     if not u or not u.get("gcal_connected"):
         if q.message:
             await q.message.answer("Сначала подключите Google Calendar.")
@@ -622,21 +594,21 @@ async def gcal_sync_week(q: CallbackQuery):
         await q.message.edit_text("⏳ Синхронизирую текущую и следующую недели…")
 
     # подгрузим все пары один раз
-    lessons = await _load_lessons_for_user_group(u)
+    schedule = await _load_schedule_for_user(u)
 
     # синхронизируем текущую и следующую недели
-    ok1, fail1 = await _sync_week_for_user({**u, "telegram_id": q.from_user.id}, lessons, weeks_ahead=0)
-    ok2, fail2 = await _sync_week_for_user({**u, "telegram_id": q.from_user.id}, lessons, weeks_ahead=1)
+    ok1, fail1 = await _sync_week_for_user({**u, "telegram_id": q.from_user.id}, schedule, weeks_ahead=0)
+    ok2, fail2 = await _sync_week_for_user({**u, "telegram_id": q.from_user.id}, schedule, weeks_ahead=1)
 
     # отметим время
     try:
         from datetime import datetime, timezone
-        set_gcal_last_sync(q.from_user.id, datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
+        await adb.set_gcal_last_sync(q.from_user.id, datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
     except Exception:
         log.exception("set_gcal_last_sync failed user=%s", q.from_user.id)
 
     # итоговый статус
-    u = get_user(q.from_user.id) or {}
+    u = await adb.get_user(q.from_user.id) or {}
     u = {**u, "telegram_id": q.from_user.id}
     msg = _status_text(u)
     msg += (
@@ -651,13 +623,13 @@ async def gcal_sync_week(q: CallbackQuery):
         )
 
 async def _sync_two_weeks_for_user(user_id: int) -> tuple[int,int]:
-    u = get_user(user_id)
+    u = await adb.get_user(user_id)
     if not u or not u.get("gcal_connected"):
         return (0, 0)
-    lessons = await _load_lessons_for_user_group(u)
+    schedule = await _load_schedule_for_user(u)
     payload = {**u, "telegram_id": user_id}
-    ok1, fail1 = await _sync_week_for_user(payload, lessons, weeks_ahead=0)  # текущая
-    ok2, fail2 = await _sync_week_for_user(payload, lessons, weeks_ahead=1)  # следующая
+    ok1, fail1 = await _sync_week_for_user(payload, schedule, weeks_ahead=0)  # текущая
+    ok2, fail2 = await _sync_week_for_user(payload, schedule, weeks_ahead=1)  # следующая
     return ok1+ok2, fail1+fail2
 
 # ---------- disconnect ----------
@@ -668,7 +640,7 @@ async def gcal_disconnect_open(q: CallbackQuery):
     with suppress(TelegramBadRequest):
         await q.answer()
 
-    u = get_user(q.from_user.id)
+    u = await adb.get_user(q.from_user.id)
     if not u or not u.get("gcal_connected"):
         await q.message.edit_text("Google Calendar уже не подключён.", reply_markup=_kb_root({**(u or {}), "telegram_id": q.from_user.id}))
         return
@@ -686,7 +658,7 @@ async def gcal_disconnect_confirm(q: CallbackQuery):
         await q.answer("Отключаю…")
 
     action = q.data.rsplit(":", 1)[-1]  # keep|purge
-    u = get_user(q.from_user.id) or {}
+    u = await adb.get_user(q.from_user.id) or {}
     cal_id = u.get("gcal_calendar_id")
 
     ok_deleted = 0
@@ -709,15 +681,14 @@ async def gcal_disconnect_confirm(q: CallbackQuery):
 
     # чистим БД-флаги
     try:
-        from app.services.db import set_gcal_connected, set_gcal_tokens, set_gcal_calendar_id  # type: ignore
-        set_gcal_connected(q.from_user.id, False)
-        set_gcal_tokens(q.from_user.id, "", "", "")
-        set_gcal_calendar_id(q.from_user.id, None)
+        await adb.set_gcal_connected(q.from_user.id, False)
+        await adb.set_gcal_tokens(q.from_user.id, "", "", "")
+        await adb.set_gcal_calendar_id(q.from_user.id, None)
     except Exception:
         log.exception("gcal DB cleanup failed user=%s", q.from_user.id)
 
     # перерисовываем экран
-    u2 = get_user(q.from_user.id) or {}
+    u2 = await adb.get_user(q.from_user.id) or {}
     u2 = {**u2, "telegram_id": q.from_user.id}
     msg = _status_text(u2)
     if action == "purge":
@@ -739,8 +710,8 @@ def _mode_label(mode: str) -> str:
         "weekly2": "2 недели вперёд",
     }.get(mode, "Ежедневно")
 
-def _kb_auto_settings(u: dict):
-    a = get_gcal_autosync(u["telegram_id"])
+async def _kb_auto_settings(u: dict):
+    a = await adb.get_gcal_autosync(u["telegram_id"])
     mode = (a.get("gcal_autosync_mode") or "weekly")  # weekly по умолчанию ок
     kb = InlineKeyboardBuilder()
     kb.button(text=("🟢 Вкл" if a.get("gcal_autosync_enabled") else "⚪️ Выкл"), callback_data="gcal:auto:toggle")
@@ -752,9 +723,9 @@ def _kb_auto_settings(u: dict):
 
 @router.callback_query(F.data == "gcal:auto:open")
 async def gcal_auto_open(q: CallbackQuery):
-    u = get_user(q.from_user.id) or {}
+    u = await adb.get_user(q.from_user.id) or {}
     u = {**u, "telegram_id": q.from_user.id}
-    a = get_gcal_autosync(q.from_user.id)
+    a = await adb.get_gcal_autosync(q.from_user.id)
     text = [
         "⚙️ <b>Автосинхронизация</b>",
         f"Статус: {'🟢 Включена' if a.get('gcal_autosync_enabled') else '⚪️ Выключена'}",
@@ -764,21 +735,21 @@ async def gcal_auto_open(q: CallbackQuery):
     if (a.get("gcal_autosync_mode") or "daily") == "weekly":
         wd = int(a.get("gcal_autosync_weekday") if a.get("gcal_autosync_weekday") is not None else 0)
         text.append(f"День: {_wd_name(wd)}")
-    await q.message.edit_text("\n".join(text), reply_markup=_kb_auto_settings(u))
+    await q.message.edit_text("\n".join(text), reply_markup=await _kb_auto_settings(u))
 
 @router.callback_query(F.data == "gcal:auto:toggle")
 async def gcal_auto_toggle(q: CallbackQuery):
-    a = get_gcal_autosync(q.from_user.id)
-    set_gcal_autosync_enabled(q.from_user.id, not bool(a.get("gcal_autosync_enabled")))
+    a = await adb.get_gcal_autosync(q.from_user.id)
+    await adb.set_gcal_autosync_enabled(q.from_user.id, not bool(a.get("gcal_autosync_enabled")))
     await gcal_auto_open(q)
 
 @router.callback_query(F.data == "gcal:auto:mode")
 async def gcal_auto_mode(q: CallbackQuery):
-    a = get_gcal_autosync(q.from_user.id)
+    a = await adb.get_gcal_autosync(q.from_user.id)
     mode = (a.get("gcal_autosync_mode") or "weekly")
     order = ["daily", "weekly"]
     new = order[(order.index(mode) + 1) % len(order)]
-    set_gcal_autosync_mode(q.from_user.id, new)
+    await adb.set_gcal_autosync_mode(q.from_user.id, new)
     await gcal_auto_open(q)
 
 # Простая сетка популярных времён
@@ -807,7 +778,7 @@ async def gcal_auto_time_custom_set(m: Message, state: FSMContext):
         return
     try:
         # это пройдёт _TIME_RE ('HH:MM') в set_gcal_autosync_time
-        set_gcal_autosync_time(m.from_user.id, hhmm)
+        await adb.set_gcal_autosync_time(m.from_user.id, hhmm)
     except Exception as e:
         await m.answer(f"⛔ {e}\nПопробуйте ещё раз, пример: <code>08:30</code>")
         return
@@ -816,10 +787,10 @@ async def gcal_auto_time_custom_set(m: Message, state: FSMContext):
     await m.answer(f"✅ Время автосинхронизации сохранено: <b>{hhmm}</b>")
 
     # ВАЖНО: перерисовать экран из СВЕЖЕЙ БД, чтобы ты увидел новое время
-    u = get_user(m.from_user.id) or {}
+    u = await adb.get_user(m.from_user.id) or {}
     try:
         # если есть функция, которая строит клавиатуру настроек
-        await m.answer("⚙️ Настройки автосинхронизации", reply_markup=_kb_auto_settings(u))
+        await m.answer("⚙️ Настройки автосинхронизации", reply_markup=await _kb_auto_settings(u))
     except NameError:
         pass
 
@@ -831,7 +802,7 @@ async def gcal_auto_time_set(q: CallbackQuery):
     prefix = "gcal:auto:time:set:"
     hhmm = q.data[len(prefix):]  # например '07:30'
     try:
-        set_gcal_autosync_time(q.from_user.id, hhmm)
+        await adb.set_gcal_autosync_time(q.from_user.id, hhmm)
     except Exception as e:
         await q.answer(str(e), show_alert=True)
         return
@@ -862,7 +833,7 @@ async def gcal_auto_weekday_open(q: CallbackQuery):
 async def gcal_auto_weekday_set(q: CallbackQuery):
     wd = int(q.data.split(":")[-1])
     try:
-        set_gcal_autosync_weekday(q.from_user.id, wd)
+        await adb.set_gcal_autosync_weekday(q.from_user.id, wd)
     except Exception as e:
         await q.answer(str(e), show_alert=True); return
     await gcal_auto_open(q)
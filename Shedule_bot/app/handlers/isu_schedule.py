@@ -12,27 +12,12 @@ from aiogram.types import CallbackQuery, Message
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from app.config import settings
-from app.services.db import get_user
 from app.services.isu_client import (
     IsuSession,
     IsuSessionError,
     fetch_potok_schedule_html,
 )
-from app.services.isu_db import (
-    get_cached_schedule,
-    get_cached_schedule_entries,
-    get_group_by_enc,
-    get_index_progress,
-    get_potok_name,
-    get_potoks_by_student,
-    get_stale_schedule_entries,
-    get_student_by_id,
-    save_schedule_html,
-    save_schedule_entries,
-    search_groups,
-    search_potoks_by_group,
-    search_students_by_fio,
-)
+from app.services.db_async import adb, aisu
 from app.services.isu_indexer import (
     get_last_service_isu_error,
     get_service_isu_session,
@@ -41,9 +26,13 @@ from app.services.isu_schedule_parser import parse_schedule_html
 from app.utils.dt import now_tz
 from app.utils.format_schedule import format_day, format_week_compact_mono
 from app.utils.week_parity import week_parity_for_date
+from app.utils.single_flight import SingleFlight
 
 log = logging.getLogger("isu.handler")
 
+# Один поток ИСУ одновременно открывают несколько человек — грузим его один раз.
+_POTOK_FLIGHT = SingleFlight("isu")
+
 router = Router()
 
 _ATTRIBUTION = (
@@ -145,7 +134,7 @@ def _kb_schedule_periods(kind: str, entity_id: str):
 async def isu_schedule_entry(q: CallbackQuery, state: FSMContext):
     await state.clear()
 
-    user = get_user(q.from_user.id)
+    user = await adb.get_user(q.from_user.id)
     if not user or not user.get("myitmo_refresh_token"):
         await q.message.edit_text(
             "🔍 <b>Просмотр чужого расписания</b>\n\n"
@@ -158,7 +147,7 @@ async def isu_schedule_entry(q: CallbackQuery, state: FSMContext):
         await q.answer()
         return
 
-    progress = get_index_progress()
+    progress = await aisu.get_index_progress()
     status_line = _format_index_status(progress)
 
     await q.message.edit_text(
@@ -189,7 +178,7 @@ async def isu_search_group_handler(msg: Message, state: FSMContext):
         return
     await state.clear()
 
-    groups = search_groups(query)
+    groups = await aisu.search_groups(query)
     if not groups:
         await msg.answer(
             f"Группы по запросу «{_esc(query)}» не найдены.\n"
@@ -214,7 +203,7 @@ async def isu_search_group_handler(msg: Message, state: FSMContext):
 
 @router.callback_query(F.data == "isu:search:fio")
 async def isu_search_fio_prompt(q: CallbackQuery, state: FSMContext):
-    progress = get_index_progress()
+    progress = await aisu.get_index_progress()
     total = progress.get("groups_total", 0)
     indexed = progress.get("groups_indexed", 0)
     if total > 0 and indexed < total:
@@ -237,7 +226,7 @@ async def isu_search_fio_handler(msg: Message, state: FSMContext):
         return
     await state.clear()
 
-    students = search_students_by_fio(query)
+    students = await aisu.search_students_by_fio(query)
     if not students:
         await msg.answer(
             f"Студенты по запросу «{_esc(query)}» не найдены.\n"
@@ -259,14 +248,14 @@ async def isu_search_fio_handler(msg: Message, state: FSMContext):
 @router.callback_query(F.data.startswith("isu:select:group:"))
 async def isu_select_group(q: CallbackQuery):
     group_enc = q.data.split(":", 3)[-1]
-    target = get_group_by_enc(group_enc) or {"group_enc": group_enc, "group_name": group_enc}
+    target = await aisu.get_group_by_enc(group_enc) or {"group_enc": group_enc, "group_name": group_enc}
     await _show_group_actions(q, target)
 
 
 async def _show_potoks_for_group(msg: Message, group: Dict) -> None:
     group_enc = group["group_enc"]
     group_name = group["group_name"]
-    potoks = search_potoks_by_group(group_enc)
+    potoks = await aisu.search_potoks_by_group(group_enc)
     if not potoks:
         await msg.answer(
             f"Для группы <b>{_esc(group_name)}</b> не найдены связанные потоки.\n"
@@ -288,7 +277,7 @@ async def _show_potoks_for_group(msg: Message, group: Dict) -> None:
 async def _show_group_actions(q: CallbackQuery, group: Dict) -> None:
     group_enc = group["group_enc"]
     group_name = group["group_name"]
-    potoks = search_potoks_by_group(group_enc)
+    potoks = await aisu.search_potoks_by_group(group_enc)
     if not potoks:
         await q.message.edit_text(
             f"Для группы <b>{_esc(group_name)}</b> не найдены связанные потоки.\n"
@@ -315,7 +304,7 @@ async def _show_group_actions(q: CallbackQuery, group: Dict) -> None:
 @router.callback_query(F.data.startswith("isu:select:student:"))
 async def isu_select_student(q: CallbackQuery):
     student_id = int(q.data.split(":")[-1])
-    potoks = get_potoks_by_student(student_id)
+    potoks = await aisu.get_potoks_by_student(student_id)
     if not potoks:
         await q.message.edit_text(
             "Для этого студента пока не найдены потоки.\n"
@@ -327,7 +316,7 @@ async def isu_select_student(q: CallbackQuery):
         await q.answer()
         return
 
-    student = get_student_by_id(student_id)
+    student = await aisu.get_student_by_id(student_id)
     student_label = student["student_name"] if student else str(student_id)
     if student and student.get("group_name"):
         student_label = f"{student_label} ({student['group_name']})"
@@ -422,9 +411,7 @@ async def _render_schedule_text(
 
     tz = None
     try:
-        from app.services.db import get_user as _get_user
-
-        user = _get_user(telegram_id) or {}
+        user = await adb.get_user(telegram_id) or {}
         tz = user.get("timezone")
     except Exception:
         tz = None
@@ -447,23 +434,23 @@ async def _resolve_lessons_for_entity(
 ) -> Tuple[List[Dict[str, Any]], str, Optional[str]]:
     if kind == "potok":
         potok_id = int(entity_id)
-        potok_name = get_potok_name(potok_id) or str(potok_id)
+        potok_name = await aisu.get_potok_name(potok_id) or str(potok_id)
         lessons, warn = await _get_potok_lessons(telegram_id, potok_id)
         return lessons, potok_name, warn
 
     if kind == "student":
         student_id = int(entity_id)
-        student = get_student_by_id(student_id)
+        student = await aisu.get_student_by_id(student_id)
         label = student["student_name"] if student else str(student_id)
-        potoks = get_potoks_by_student(student_id)
+        potoks = await aisu.get_potoks_by_student(student_id)
         lessons, warn = await _get_many_potok_lessons(
             telegram_id, potoks, include_source=len(potoks) > 1
         )
         return lessons, label, warn
 
     if kind == "group":
-        group = get_group_by_enc(entity_id) or {"group_name": entity_id}
-        potoks = search_potoks_by_group(entity_id)
+        group = await aisu.get_group_by_enc(entity_id) or {"group_name": entity_id}
+        potoks = await aisu.search_potoks_by_group(entity_id)
         lessons, warn = await _get_many_potok_lessons(
             telegram_id, potoks, include_source=len(potoks) > 1
         )
@@ -485,45 +472,50 @@ async def _get_potok_lessons(
     max_age = max(60, int(settings.isu_schedule_cache_max_age_sec))
 
     # Свежий кеш — мгновенный ответ, без обращения к ИСУ
-    cached = get_cached_schedule_entries(potok_id, max_age_sec=max_age)
+    cached = await aisu.get_cached_schedule_entries(potok_id, max_age_sec=max_age)
     if cached:
         return cached, None
 
     # Устаревший кеш — вернуть сразу, обновить в фоне
-    stale = get_stale_schedule_entries(potok_id)
+    stale = await aisu.get_stale_schedule_entries(potok_id)
     if stale:
         asyncio.create_task(_refresh_potok_background(telegram_id, potok_id))
         return stale, None
 
     # Кеша нет совсем — ждём ИСУ (неизбежно при первом запросе)
-    html_content = get_cached_schedule(potok_id, max_age_sec=max_age)
+    html_content = await aisu.get_cached_schedule(potok_id, max_age_sec=max_age)
     if not html_content:
         try:
-            isu = await _get_isu_session_for_user(telegram_id)
+            lessons = await _POTOK_FLIGHT.do(
+                potok_id, lambda: _fetch_and_store_potok(telegram_id, potok_id)
+            )
         except IsuSessionError as e:
             return [], str(e)
-        try:
-            html_content = await asyncio.to_thread(
-                fetch_potok_schedule_html, isu, potok_id
-            )
-            save_schedule_html(potok_id, html_content)
         except Exception as e:
             log.exception("Failed to fetch schedule for potok %d", potok_id)
             return [], str(e)
+        return lessons, None
 
     lessons = parse_schedule_html(html_content)
-    save_schedule_entries(potok_id, lessons)
+    await aisu.save_schedule_entries(potok_id, lessons)
     return lessons, None
 
 
+async def _fetch_and_store_potok(telegram_id: int, potok_id: int) -> List[Dict[str, Any]]:
+    isu = await _get_isu_session_for_user(telegram_id)
+    html_content = await asyncio.to_thread(fetch_potok_schedule_html, isu, potok_id)
+    await aisu.save_schedule_html(potok_id, html_content)
+    lessons = parse_schedule_html(html_content)
+    await aisu.save_schedule_entries(potok_id, lessons)
+    return lessons
+
+
 async def _refresh_potok_background(telegram_id: int, potok_id: int) -> None:
     """Фоновое обновление кеша потока без блокировки ответа пользователю."""
+    if _POTOK_FLIGHT.in_flight(potok_id):
+        return
     try:
-        isu = await _get_isu_session_for_user(telegram_id)
-        html_content = await asyncio.to_thread(fetch_potok_schedule_html, isu, potok_id)
-        save_schedule_html(potok_id, html_content)
-        lessons = parse_schedule_html(html_content)
-        save_schedule_entries(potok_id, lessons)
+        await _POTOK_FLIGHT.do(potok_id, lambda: _fetch_and_store_potok(telegram_id, potok_id))
         log.debug("background refresh done for potok=%d", potok_id)
     except Exception:
         pass  # тихо — пользователь уже получил устаревшие данные
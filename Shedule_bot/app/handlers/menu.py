@@ -10,17 +10,7 @@ import re
 from urllib.parse import urlparse, parse_qs
 
 from app.config import settings
-from app.services.db import (
-    get_user,
-    set_course,
-    set_group,
-    set_schedule_source_mode,
-    set_myitmo_login,
-    set_myitmo_tokens,
-    set_user_sheet_source,
-    clear_user_sheet_source,
-    set_exam_alerts_enabled,
-)
+from app.services.db_async import adb
 from app.services.myitmo_client import exchange_password_for_tokens, MyItmoError
 from app.services.groups import list_groups_for_course
 
@@ -60,8 +50,8 @@ def _kb_courses():
     kb.adjust(4, 1)
     return kb.as_markup()
 
-def _kb_groups(course: int):
-    groups = list_groups_for_course(course)
+async def _kb_groups(course: int):
+    groups = await list_groups_for_course(course)
     kb = InlineKeyboardBuilder()
     # выводим рядами по 3
     for g in groups:
@@ -175,7 +165,7 @@ def _settings_text(u) -> str:
 @router.callback_query(F.data == "main:settings")
 @router.callback_query(F.data == "settings:open")
 async def open_settings(q: CallbackQuery):
-    u = get_user(q.from_user.id)
+    u = await adb.get_user(q.from_user.id)
     if not u:
         await q.answer("Сначала /start", show_alert=True); return
     kb = _kb_settings(u).as_markup()
@@ -197,24 +187,24 @@ async def settings_change_course(q: CallbackQuery):
 @router.callback_query(F.data.startswith("settings:course:"))
 async def settings_set_course(q: CallbackQuery):
     course = int(q.data.split(":")[-1])
-    set_course(q.from_user.id, course)
+    await adb.set_course(q.from_user.id, course)
     # сразу предложим выбрать группу
     await q.message.edit_text(
         f"Курс: <b>{course}</b>\nТеперь выберите группу:",
-        reply_markup=_kb_groups(course)
+        reply_markup=await _kb_groups(course)
     )
     await q.answer()
 
 @router.callback_query(F.data == "settings:change_group")
 async def settings_change_group(q: CallbackQuery):
-    u = get_user(q.from_user.id)
+    u = await adb.get_user(q.from_user.id)
     if not u or not u.get("course"):
         await q.message.edit_text("Сначала выберите курс:", reply_markup=_kb_courses())
         await q.answer()
         return
     await q.message.edit_text(
         f"Курс: <b>{u['course']}</b>\nВыберите группу:",
-        reply_markup=_kb_groups(int(u["course"]))
+        reply_markup=await _kb_groups(int(u["course"]))
     )
     await q.answer()
 
@@ -233,7 +223,7 @@ async def settings_change_source(q: CallbackQuery):
 @router.callback_query(F.data.startswith("settings:source:"))
 async def settings_set_source(q: CallbackQuery):
     mode = q.data.split(":")[-1]
-    u = get_user(q.from_user.id) or {}
+    u = await adb.get_user(q.from_user.id) or {}
     if mode in ("myitmo_full", "hybrid"):
         if not (u.get("myitmo_username") and u.get("myitmo_refresh_token")):
             await q.answer(
@@ -241,8 +231,8 @@ async def settings_set_source(q: CallbackQuery):
                 show_alert=True,
             )
             return
-    set_schedule_source_mode(q.from_user.id, mode)
-    u = get_user(q.from_user.id)
+    await adb.set_schedule_source_mode(q.from_user.id, mode)
+    u = await adb.get_user(q.from_user.id)
     await q.message.edit_text(
         f"Источник расписания обновлён: <b>{_source_mode_label(mode)}</b>\n\n"
         "Можно продолжить настройку:",
@@ -253,7 +243,7 @@ async def settings_set_source(q: CallbackQuery):
 
 @router.callback_query(F.data == "settings:myitmo:open")
 async def settings_myitmo_open(q: CallbackQuery):
-    u = get_user(q.from_user.id)
+    u = await adb.get_user(q.from_user.id)
     if not u:
         await q.answer("Сначала /start", show_alert=True)
         return
@@ -275,7 +265,7 @@ async def settings_myitmo_open(q: CallbackQuery):
 
 @router.callback_query(F.data == "settings:sheet:open")
 async def settings_sheet_open(q: CallbackQuery):
-    u = get_user(q.from_user.id) or {}
+    u = await adb.get_user(q.from_user.id) or {}
     if u.get("user_spreadsheet_id"):
         text = (
             "📄 <b>Таблица Google Sheets</b>\n\n"
@@ -305,10 +295,10 @@ async def settings_sheet_set(q: CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data == "settings:sheet:clear")
 async def settings_sheet_clear(q: CallbackQuery):
-    clear_user_sheet_source(q.from_user.id)
+    await adb.clear_user_sheet_source(q.from_user.id)
     await q.message.edit_text(
         "Персональная таблица отключена. Используется таблица из .env.",
-        reply_markup=_kb_settings(get_user(q.from_user.id)).as_markup(),
+        reply_markup=_kb_settings(await adb.get_user(q.from_user.id)).as_markup(),
     )
     await q.answer("Сброшено")
 
@@ -328,7 +318,7 @@ async def settings_myitmo_login_msg(msg: Message, state: FSMContext):
     if not login:
         await msg.answer("Логин пустой, попробуйте ещё раз.")
         return
-    set_myitmo_login(msg.from_user.id, login)
+    await adb.set_myitmo_login(msg.from_user.id, login)
     await state.set_state(MyItmoSetup.waiting_password)
     await msg.answer(
         "Введите пароль my.itmo.\n"
@@ -342,7 +332,7 @@ async def settings_myitmo_password_msg(msg: Message, state: FSMContext):
     if not pwd:
         await msg.answer("Пароль пустой, попробуйте ещё раз.")
         return
-    u = get_user(msg.from_user.id) or {}
+    u = await adb.get_user(msg.from_user.id) or {}
     login = (u.get("myitmo_username") or "").strip()
     if not login:
         await state.clear()
@@ -361,7 +351,7 @@ async def settings_myitmo_password_msg(msg: Message, state: FSMContext):
     except Exception:
         await msg.answer("Не удалось подключить my.itmo из-за сетевой ошибки. Попробуйте ещё раз.")
         return
-    set_myitmo_tokens(
+    await adb.set_myitmo_tokens(
         msg.from_user.id,
         bundle["access_token"],
         bundle["refresh_token"],
@@ -378,7 +368,7 @@ async def settings_sheet_link_msg(msg: Message, state: FSMContext):
         await msg.answer("Не удалось распознать ссылку. Проверьте формат и отправьте снова.")
         return
     spreadsheet_id, gid = parsed
-    set_user_sheet_source(msg.from_user.id, spreadsheet_id, gid)
+    await adb.set_user_sheet_source(msg.from_user.id, spreadsheet_id, gid)
     await state.clear()
     await msg.answer(
         "Ссылка на таблицу сохранена ✅\n"
@@ -389,8 +379,8 @@ async def settings_sheet_link_msg(msg: Message, state: FSMContext):
 @router.callback_query(F.data.startswith("settings:group:"))
 async def settings_set_group(q: CallbackQuery):
     group = q.data.split(":", 2)[-1]
-    set_group(q.from_user.id, group)
-    u = get_user(q.from_user.id)
+    await adb.set_group(q.from_user.id, group)
+    u = await adb.get_user(q.from_user.id)
     await q.message.edit_text(
         f"Группа обновлена: <b>{group}</b>\n",
         reply_markup=_kb_settings(u).as_markup()
@@ -400,13 +390,13 @@ async def settings_set_group(q: CallbackQuery):
 
 @router.callback_query(F.data == "settings:exam_alerts:toggle")
 async def settings_exam_alerts_toggle(q: CallbackQuery):
-    u = get_user(q.from_user.id)
+    u = await adb.get_user(q.from_user.id)
     if not u:
         await q.answer("Сначала /start", show_alert=True)
         return
     current = bool(u.get("exam_alerts_enabled"))
-    set_exam_alerts_enabled(q.from_user.id, not current)
-    u = get_user(q.from_user.id)
+    await adb.set_exam_alerts_enabled(q.from_user.id, not current)
+    u = await adb.get_user(q.from_user.id)
     state_label = "включены ✅" if not current else "выключены ⛔️"
     await q.answer(f"Уведомления об экзаменах {state_label}", show_alert=True)
     await q.message.edit_text(_settings_text(u), reply_markup=_kb_settings(u).as_markup())
@@ -1,13 +1,13 @@
 from __future__ import annotations
 from datetime import timedelta
-from typing import List
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.exceptions import TelegramBadRequest
 
-from app.services.db import get_user, set_message_id, get_bot_mode, get_bot_setting
-from app.services.lessons_loader import load_lessons_for_user_group
+from app.services.db_async import adb
+from app.services.lessons_loader import load_schedule_for_user
+from app.services.lesson_index import LessonIndex
 from app.utils.week_parity import week_parity_for_date
 from app.utils.dt import now_tz
 from app.utils.format_schedule import format_day, format_week_compact_mono
@@ -22,14 +22,14 @@ _HOLIDAYS_MSG = (
 )
 
 
-def _exams_text_for_group(group: str) -> str:
-    spreadsheet_id = get_bot_setting("exam_spreadsheet_id")
-    sheet_gid_raw  = get_bot_setting("exam_sheet_gid")
+async def _exams_text_for_group(group: str) -> str:
+    spreadsheet_id = await adb.get_bot_setting("exam_spreadsheet_id")
+    sheet_gid_raw  = await adb.get_bot_setting("exam_sheet_gid")
     if not spreadsheet_id or sheet_gid_raw is None:
         return "📋 Режим экзаменов включён, но расписание экзаменов ещё не загружено."
     try:
         from app.services.exam_parser import get_exams_for_group
-        exams = get_exams_for_group(group, spreadsheet_id, int(sheet_gid_raw))
+        exams = await get_exams_for_group(group, spreadsheet_id, int(sheet_gid_raw))
     except Exception as e:
         return f"⚠️ Не удалось загрузить расписание экзаменов: {e}"
 
@@ -133,28 +133,11 @@ def _russian_day_name(dt) -> str:
     names = ["ПОНЕДЕЛЬНИК","ВТОРНИК","СРЕДА","ЧЕТВЕРГ","ПЯТНИЦА","СУББОТА","ВОСКРЕСЕНЬЕ"]
     return names[dt.weekday()]
 
-async def _load_lessons_for_user_group(user: dict):
-    return await load_lessons_for_user_group(user)
-
-
-def _norm_parity(p: str) -> str:
-    p = str(p or "").strip().lower().replace("ё", "е")
-    if "неч" in p:
-        return "нечёт"
-    if "чет" in p:
-        return "чёт"
-    return p
-
-def _filter_by_day_and_parity(lessons: List[dict], day_name: str, parity: str) -> List[dict]:
-    np = _norm_parity(parity)
-    return [it for it in lessons if str(it["day"]).strip().upper() == day_name and _norm_parity(it.get("parity")) == np]
-
-def _filter_by_parity(lessons: List[dict], parity: str) -> List[dict]:
-    np = _norm_parity(parity)
-    return [it for it in lessons if _norm_parity(it.get("parity")) == np]
+async def _load_schedule_for_user(user: dict) -> LessonIndex:
+    return await load_schedule_for_user(user)
 
 async def _send_or_edit(q: CallbackQuery, text: str, kb=None):
-    user = get_user(q.from_user.id)
+    user = await adb.get_user(q.from_user.id)
     # Режим 1 — редактируем одно сообщение
     if user and user.get("type") == 1 and user.get("message_id"):
         try:
@@ -175,7 +158,7 @@ async def _send_or_edit(q: CallbackQuery, text: str, kb=None):
 
     m = await q.message.answer(text, reply_markup=kb, disable_web_page_preview=True)
     if user and user.get("type") == 1:
-        set_message_id(q.from_user.id, m.message_id)
+        await adb.set_message_id(q.from_user.id, m.message_id)
     try:
         await q.answer()
     except TelegramBadRequest:
@@ -189,18 +172,18 @@ async def to_main(q: CallbackQuery):
 
 @router.callback_query(F.data == "main:schedule")
 async def schedule_entry(q: CallbackQuery):
-    user = get_user(q.from_user.id)
+    user = await adb.get_user(q.from_user.id)
     if not user or not user.get("group_code"):
         await q.answer("Сначала завершите онбординг: курс и группа.", show_alert=True)
         return
-    mode = get_bot_mode()
+    mode = await adb.get_bot_mode()
     if mode == "holidays":
         await _send_or_edit(q, _HOLIDAYS_MSG, None)
         return
     if mode == "exams":
         source = str(user.get("schedule_source_mode") or "sheets").strip().lower()
         if source == "sheets":
-            text = _exams_text_for_group(user["group_code"])
+            text = await _exams_text_for_group(user["group_code"])
             await _send_or_edit(q, text, None)
             return
         # myitmo_full / hybrid — показываем обычное расписание из my.itmo
@@ -214,7 +197,7 @@ async def sched_root(q: CallbackQuery):
 # ---------- сегодня / завтра ----------
 @router.callback_query(F.data.in_({"sched:day:today", "sched:day:tomorrow"}))
 async def sched_day_today_tomorrow(q: CallbackQuery):
-    user = get_user(q.from_user.id)
+    user = await adb.get_user(q.from_user.id)
     if not user or not user.get("group_code"):
         await q.answer("Сначала выберите группу.", show_alert=True)
         return
@@ -230,8 +213,8 @@ async def sched_day_today_tomorrow(q: CallbackQuery):
     day_upper = DAY_UP[target.weekday()]
 
     # пары для пользователя
-    lessons = await _load_lessons_for_user_group(user)
-    day_lessons = [it for it in lessons if _norm_parity(it.get("parity")) == _norm_parity(parity) and it["day"] == day_upper]
+    schedule = await _load_schedule_for_user(user)
+    day_lessons = schedule.day(parity, day_upper)
 
     text = format_day(user["group_code"], day_upper, parity, day_lessons)
 
@@ -246,25 +229,22 @@ async def sched_day_today_tomorrow(q: CallbackQuery):
 async def sched_day_same(q: CallbackQuery):
     # data: sched:day:same:{DAY}:{parity}
     _, _, _, day_name, parity = q.data.split(":")
-    user = get_user(q.from_user.id)
+    user = await adb.get_user(q.from_user.id)
     if not user or not user.get("group_code"):
         await q.answer("Сначала выберите группу.", show_alert=True)
         return
 
-    group_lessons = await _load_lessons_for_user_group(user)
+    schedule = await _load_schedule_for_user(user)
 
     day_upper = str(day_name).strip().upper()
-    day_lessons = [
-        it for it in group_lessons
-        if _norm_parity(it.get("parity")) == _norm_parity(parity) and it["day"] == day_upper
-    ]
+    day_lessons = schedule.day(parity, day_upper)
 
     text = format_day(user["group_code"], day_upper, parity, day_lessons)
     await _send_or_edit(q, text, kb_day_controls(day_upper, parity))
 
 @router.callback_query(F.data.startswith("sched:week"))
 async def sched_week(q: CallbackQuery):
-    user = get_user(q.from_user.id)
+    user = await adb.get_user(q.from_user.id)
     if not user or not user.get("group_code"):
         await q.answer("Сначала выберите группу.", show_alert=True)
         return
@@ -274,8 +254,8 @@ async def sched_week(q: CallbackQuery):
     if parity == "auto":
         parity = week_parity_for_date(None, tz)
 
-    lessons_grp = await _load_lessons_for_user_group(user)
-    week_lessons = [it for it in lessons_grp if _norm_parity(it.get("parity")) == _norm_parity(parity)]
+    schedule = await _load_schedule_for_user(user)
+    week_lessons = schedule.week(parity)
 
     text = format_week_compact_mono(user["group_code"], parity, week_lessons)
 
@@ -306,7 +286,7 @@ async def sched_week(q: CallbackQuery):
 
     m = await q.message.answer(text, reply_markup=kb.as_markup(), disable_web_page_preview=True)
     if user.get("type") == 1:
-        set_message_id(q.from_user.id, m.message_id)
+        await adb.set_message_id(q.from_user.id, m.message_id)
     try:
         await q.answer()
     except TelegramBadRequest:
@@ -7,9 +7,7 @@ from aiogram.filters import CommandStart
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from app.handlers.menu import open_settings as menu_open_settings
 
-from app.services.db import (
-    init_db, upsert_user, get_user, set_course, set_group, set_message_id, set_schedule_source_mode
-)
+from app.services.db_async import adb
 from app.services.groups import list_groups_for_course
 
 router = Router()
@@ -21,8 +19,8 @@ def _kb_courses():
     kb.adjust(4)
     return kb.as_markup()
 
-def _kb_groups(course: int):
-    groups = list_groups_for_course(course)
+async def _kb_groups(course: int):
+    groups = await list_groups_for_course(course)
     kb = InlineKeyboardBuilder()
     for g in groups:
         kb.button(text=g, callback_data=f"start:group:{g}")
@@ -67,10 +65,9 @@ def _source_mode_label(mode: str | None) -> str:
 
 @router.message(CommandStart())
 async def start_cmd(msg: Message):
-    # Инициализация и апдейт t.me/username
-    init_db()
-    upsert_user(msg.from_user.id, msg.from_user.username)
-    user = get_user(msg.from_user.id)
+    # Апдейт t.me/username (схему БД готовит init_db при старте бота)
+    await adb.upsert_user(msg.from_user.id, msg.from_user.username)
+    user = await adb.get_user(msg.from_user.id)
 
     # 0) Первый запуск — выбираем режим источника расписания
     if user and not user.get("schedule_source_mode"):
@@ -82,7 +79,7 @@ async def start_cmd(msg: Message):
             "а для пар типа англ./история дополняем аудиторию и преподавателя из my.itmo.",
             reply_markup=_kb_source_mode("start"),
         )
-        set_message_id(msg.from_user.id, m.message_id)
+        await adb.set_message_id(msg.from_user.id, m.message_id)
         return
 
     # 1) Есть группа → сразу главное меню
@@ -94,7 +91,7 @@ async def start_cmd(msg: Message):
             "Выберите действие:"
         )
         m = await msg.answer(text, reply_markup=_kb_main_menu())
-        set_message_id(msg.from_user.id, m.message_id)
+        await adb.set_message_id(msg.from_user.id, m.message_id)
         return
 
     # 2) Есть курс, но нет группы → сразу выбор группы
@@ -102,9 +99,9 @@ async def start_cmd(msg: Message):
         course = int(user["course"])
         m = await msg.answer(
             f"Курс: <b>{course}</b>\nТеперь выбери <b>группу</b>:",
-            reply_markup=_kb_groups(course)
+            reply_markup=await _kb_groups(course)
         )
-        set_message_id(msg.from_user.id, m.message_id)
+        await adb.set_message_id(msg.from_user.id, m.message_id)
         return
 
     # 3) Новичок → выбор курса
@@ -112,13 +109,13 @@ async def start_cmd(msg: Message):
         "Привет! Давай настроим профиль.\n\nВыбери <b>курс</b>:",
         reply_markup=_kb_courses()
     )
-    set_message_id(msg.from_user.id, m.message_id)
+    await adb.set_message_id(msg.from_user.id, m.message_id)
 
 @router.callback_query(F.data.startswith("start:source:"))
 async def choose_source_mode(q: CallbackQuery):
     mode = q.data.split(":")[-1]
-    set_schedule_source_mode(q.from_user.id, mode)
-    user = get_user(q.from_user.id) or {}
+    await adb.set_schedule_source_mode(q.from_user.id, mode)
+    user = await adb.get_user(q.from_user.id) or {}
 
     # Есть группа → сразу меню
     if user.get("group_code"):
@@ -135,7 +132,7 @@ async def choose_source_mode(q: CallbackQuery):
         await q.message.edit_text(
             f"Режим источника: <b>{_source_mode_label(mode)}</b>\n\n"
             f"Курс: <b>{course}</b>\nТеперь выбери <b>группу</b>:",
-            reply_markup=_kb_groups(course),
+            reply_markup=await _kb_groups(course),
         )
         await q.answer("Режим сохранён")
         return
@@ -149,18 +146,18 @@ async def choose_source_mode(q: CallbackQuery):
 @router.callback_query(F.data.startswith("start:course:"))
 async def choose_course(q: CallbackQuery):
     course = int(q.data.split(":")[-1])
-    set_course(q.from_user.id, course)
+    await adb.set_course(q.from_user.id, course)
 
     await q.message.edit_text(
         f"Курс: <b>{course}</b>\nТеперь выбери <b>группу</b>:",
-        reply_markup=_kb_groups(course)
+        reply_markup=await _kb_groups(course)
     )
     await q.answer()
 
 @router.callback_query(F.data.startswith("start:group:"))
 async def choose_group(q: CallbackQuery):
     group = q.data.split(":", 2)[-1]
-    set_group(q.from_user.id, group)
+    await adb.set_group(q.from_user.id, group)
 
     # сразу спросим про автоотправку
     kb = InlineKeyboardBuilder()
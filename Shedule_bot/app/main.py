@@ -6,11 +6,19 @@ import sys
 
 from app.bot import bot, dp
 from app.handlers import start, menu  # noqa: F401
-from app.services.db import init_db, migrate_gcal_autosync, init_bot_settings
+from app.services.db import init_db, check_query_plans
 from app.services.isu_db import init_isu_db
+from app.services.cache_db import init_cache_db
+from app.services.sheet_cache import warm_start_sheet_cache
+from app.services.myitmo_client import close_http_session
+from app.config import settings
 from app.services.isu_indexer import start_isu_indexer
 from app.autosend.runner import start_autosend
+from app.cron.sheet_refresher import start_sheet_refresher
+from app.cron.token_refresher import start_token_refresher
 from app.utils.logging import setup_logging
+from app.utils.loop_lag import start_loop_lag_monitor
+from app.utils.sqlite_conn import close_all as close_db_connections
 
 logging.basicConfig(
     level=getattr(logging, os.getenv("LOG_LEVEL", "DEBUG").upper(), logging.DEBUG),
@@ -26,13 +34,22 @@ logging.getLogger("gcal.mapper").setLevel(logging.DEBUG)
 
 async def main():
     setup_logging()
-    init_db()
-    init_bot_settings()
-    migrate_gcal_autosync()
+    start_loop_lag_monitor()
+    init_db()  # миграции схемы bot.db — только здесь, при старте
+    check_query_plans()
     init_isu_db()
+    init_cache_db()
+    # Расписание с диска — до polling, чтобы первые запросы не ждали Google Sheets.
+    await warm_start_sheet_cache(settings.spreadsheet_id, settings.sheet_gid)
+    start_sheet_refresher()
+    start_token_refresher()
     start_isu_indexer()
     start_autosend(bot)
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await close_http_session()
+        close_db_connections()
 
 if __name__ == "__main__":
     asyncio.run(main())
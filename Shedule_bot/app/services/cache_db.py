@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.utils.sqlite_conn import connect
+
+# Отдельный файл рядом с bot.db: кэш можно удалить без потери пользовательских данных.
+DB_PATH = settings.cache_db or os.path.join(os.path.dirname(settings.db_path), "cache.db")
+
+
+def _conn() -> sqlite3.Connection:
+    return connect(DB_PATH)
+
+
+def init_cache_db() -> None:
+    with _conn() as con:
+        con.executescript("""
+            CREATE TABLE IF NOT EXISTS sheet_snapshots (
+                spreadsheet_id TEXT NOT NULL,
+                sheet_gid INTEGER NOT NULL,
+                revision TEXT,
+                content_hash TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                payload BLOB NOT NULL,
+                PRIMARY KEY (spreadsheet_id, sheet_gid)
+            );
+            CREATE TABLE IF NOT EXISTS myitmo_schedules (
+                username TEXT NOT NULL,
+                date_start TEXT NOT NULL,
+                date_end TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                payload BLOB NOT NULL,
+                PRIMARY KEY (username, date_start, date_end)
+            );
+        """)
+
+
+def _pack(obj: Any) -> bytes:
+    return zlib.compress(json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack(blob: bytes) -> Any:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+# ── разобранный лист расписания ─────────────────────────────────────────
+
+def save_sheet_snapshot(
+    spreadsheet_id: str,
+    sheet_gid: int,
+    revision: Optional[str],
+    content_hash: str,
+    fetched_at: float,
+    payload: Dict[str, Any],
+) -> None:
+    with _conn() as con:
+        con.execute(
+            """
+            INSERT OR REPLACE INTO sheet_snapshots(
+                spreadsheet_id, sheet_gid, revision, content_hash, fetched_at, payload
+            ) VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (spreadsheet_id, int(sheet_gid), revision, content_hash, fetched_at, _pack(payload)),
+        )
+
+
+def load_sheet_snapshot(spreadsheet_id: str, sheet_gid: int) -> Optional[Dict[str, Any]]:
+    with _conn() as con:
+        row = con.execute(
+            """
+            SELECT revision, content_hash, fetched_at, payload
+            FROM sheet_snapshots
+            WHERE spreadsheet_id = ? AND sheet_gid = ?
+            """,
+            (spreadsheet_id, int(sheet_gid)),
+        ).fetchone()
+    if not row:
+        return None
+    return {
+        "revision": row["revision"],
+        "content_hash": row["content_hash"],
+        "fetched_at": float(row["fetched_at"]),
+        "payload": _unpack(row["payload"]),
+    }
+
+
+# ── личное расписание my.itmo (последняя удачная выгрузка) ───────────────
+
+def save_myitmo_schedule(
+    username: str,
+    date_start: str,
+    date_end: str,
+    fetched_at: float,
+    lessons: List[Dict[str, Any]],
+) -> None:
+    with _conn() as con:
+        # храним только актуальный диапазон: прошлые недели никому не нужны
+        con.execute(
+            "DELETE FROM myitmo_schedules WHERE username = ? AND (date_start <> ? OR date_end <> ?)",
+            (username, date_start, date_end),
+        )
+        con.execute(
+            """
+            INSERT OR REPLACE INTO myitmo_schedules(username, date_start, date_end, fetched_at, payload)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (username, date_start, date_end, fetched_at, _pack(lessons)),
+        )
+
+
+def load_myitmo_schedule(
+    username: str,
+    date_start: str,
+    date_end: str,
+) -> Optional[Tuple[float, List[Dict[str, Any]]]]:
+    """(fetched_at, пары) или None, если для этого диапазона ничего не сохранено."""
+    with _conn() as con:
+        row = con.execute(
+            """
+            SELECT fetched_at, payload
+            FROM myitmo_schedules
+            WHERE username = ? AND date_start = ? AND date_end = ?
+            """,
+            (username, date_start, date_end),
+        ).fetchone()
+    if not row:
+        return None
+    return float(row["fetched_at"]), _unpack(row["payload"])
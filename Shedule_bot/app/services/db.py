@@ -1,126 +1,325 @@
 # app/services/db.py
-import os
+import logging
 import sqlite3
+import threading
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Callable, Optional, Dict, Any, Set, Tuple
 import re
 
 from app.config import settings
+from app.utils.sqlite_conn import connect
+from app.utils.ttl_cache import TTLCache
 from typing import List
 
 DB_PATH = settings.db_path  # ./app/data/bot.db
 
-_TIME_RE = re.compile(r"^(?:[01]\d|2[0-3]):[0-5]\d$")
+log = logging.getLogger("db")
 
-def _get_conn() -> sqlite3.Connection:
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+_TIME_RE = re.compile(r"^(?:[01]\d|2[0-3]):[0-5]\d$")
 
-def _conn() -> sqlite3.Connection:
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    con = sqlite3.connect(DB_PATH, check_same_thread=False)
-    con.row_factory = sqlite3.Row
-    return con
+# Запросы планировщиков. Под каждый — индекс из миграций; check_query_plans()
+# при старте проверяет, что до полного скана не дошло.
+# group_code > '' — то же, что «не NULL и не пусто», но по индексу
+_SQL_WITH_GROUP = """
+    SELECT telegram_id, group_code, timezone, exam_alerts_enabled FROM users
+    WHERE group_code > ''
+"""
+# Стартовая загрузка планировщика автоотправки (app/autosend/runner.py)
+_SQL_SCHEDULER_USERS = """
+    SELECT telegram_id, timezone, group_code, schedule_source_mode, myitmo_username,
+           autosend_enabled, autosend_mode, autosend_time, autosend_last_date, autosend_msg_id,
+           gcal_autosync_enabled, gcal_connected, gcal_autosync_time, gcal_autosync_last_key
+    FROM users
+    WHERE autosend_enabled = 1 OR gcal_autosync_enabled = 1
+"""
 
-def init_db():
-    """Создать таблицу users (если её ещё нет)."""
-    with _get_conn() as conn:
-        # Актуальная схема users (без myitmo_password).
-        create_users_sql = """
-            CREATE TABLE IF NOT EXISTS users (
-                telegram_id INTEGER PRIMARY KEY,
-                telegram_tag TEXT,
-                message_id INTEGER,
-                type INTEGER DEFAULT 0,
-                timezone TEXT DEFAULT 'Europe/Moscow',
-                course INTEGER,
-                group_code TEXT,
-                schedule_source_mode TEXT DEFAULT 'sheets',
-                myitmo_username TEXT,
-                myitmo_access_token TEXT,
-                myitmo_refresh_token TEXT,
-                myitmo_token_expiry TEXT,
-                user_spreadsheet_id TEXT,
-                user_sheet_gid INTEGER,
-
-                autosend_enabled INTEGER NOT NULL DEFAULT 0,
-                autosend_mode INTEGER,
-                autosend_time TEXT,
-                autosend_last_date TEXT,
-
-                autosend_msg_id INTEGER,
-                autosend_cur_key TEXT,
-
-                gcal_connected INTEGER DEFAULT 0,
-                gcal_access_token TEXT,
-                gcal_refresh_token TEXT,
-                gcal_token_expiry TEXT,
-                gcal_calendar_id TEXT,
-                gcal_last_sync TEXT,
-
-                gcal_autosync_enabled INTEGER NOT NULL DEFAULT 0,
-                gcal_autosync_mode TEXT DEFAULT 'daily',
-                gcal_autosync_time TEXT,
-                gcal_autosync_weekday INTEGER,
-                gcal_autosync_last_key TEXT
-            )
-        """
-        conn.execute(
-            create_users_sql
+def _get_conn() -> sqlite3.Connection:
+    # Долгоживущее соединение потока (WAL, synchronous=NORMAL) — см. app/utils/sqlite_conn.py
+    return connect(DB_PATH)
+
+_conn = _get_conn
+
+# Профили пользователей (строки users) по telegram_id. set_*-функции ниже
+# обновляют кэш вместе с БД (write-through), поэтому get_user на горячем пути
+# не ходит в SQLite. TTL страхует от записей из других процессов (oauth_server).
+_USER_CACHE: TTLCache[int, Dict[str, Any]] = TTLCache(
+    "users", maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl_sec
+)
+# Счётчик записей: get_user не кладёт в кэш строку, прочитанную до чужой записи.
+# Пишут и поток БД (adb), и event loop, поэтому счётчик и сверка с ним — под локом.
+_user_writes = 0
+_user_lock = threading.Lock()
+
+# Подписчики на изменения users: fn(telegram_id, поля). Пустой dict — «изменилось
+# что-то, перечитай строку», telegram_id=None — «перечитай всех». Вызываются
+# из потока, который писал в БД.
+_USER_LISTENERS: List[Callable[[Optional[int], Dict[str, Any]], None]] = []
+
+
+def add_user_listener(fn: Callable[[Optional[int], Dict[str, Any]], None]) -> None:
+    _USER_LISTENERS.append(fn)
+
+
+def _notify_user_listeners(telegram_id: Optional[int], fields: Dict[str, Any]) -> None:
+    for fn in _USER_LISTENERS:
+        try:
+            fn(telegram_id, fields)
+        except Exception:
+            log.exception("user listener failed")
+
+
+def _user_written(telegram_id: int, **fields: Any) -> None:
+    """Синхронизировать кэш после записи: подставить новые значения или сбросить запись."""
+    global _user_writes
+    uid = int(telegram_id)
+    with _user_lock:
+        _user_writes += 1
+        if not fields:
+            _USER_CACHE.pop(uid)
+        else:
+            cached = _USER_CACHE.peek(uid)
+            if cached is not None:
+                _USER_CACHE.set(uid, {**cached, **fields})
+    _notify_user_listeners(uid, fields)
+
+
+def invalidate_user(telegram_id: Optional[int] = None) -> None:
+    """Сбросить кэш профиля (или всех профилей), если users изменили в обход этого модуля."""
+    global _user_writes
+    with _user_lock:
+        _user_writes += 1
+        if telegram_id is None:
+            _USER_CACHE.clear()
+        else:
+            _USER_CACHE.pop(int(telegram_id))
+    _notify_user_listeners(None if telegram_id is None else int(telegram_id), {})
+
+
+def _cache_users_read(writes_before: int, users: List[Dict[str, Any]]) -> None:
+    """Положить прочитанные строки в кэш, если с начала чтения не было записей."""
+    with _user_lock:
+        if writes_before == _user_writes:
+            for user in users:
+                _USER_CACHE.set(user["telegram_id"], user)
+
+# ── схема: версионированные миграции ─────────────────────────────────────
+#
+# Каждая миграция применяется один раз (в своей транзакции) и записывается в
+# schema_version. init_db() прогоняет недостающие при старте бота; повторные
+# вызовы в том же процессе сверяются с версией в памяти и в БД не ходят.
+
+def _m001_users(conn: sqlite3.Connection) -> None:
+    """Базовая схема users; заодно доводит старые БД (до миграций) до неё."""
+    # Актуальная схема users (без myitmo_password).
+    create_users_sql = """
+        CREATE TABLE IF NOT EXISTS users (
+            telegram_id INTEGER PRIMARY KEY,
+            telegram_tag TEXT,
+            message_id INTEGER,
+            type INTEGER DEFAULT 0,
+            timezone TEXT DEFAULT 'Europe/Moscow',
+            course INTEGER,
+            group_code TEXT,
+            schedule_source_mode TEXT DEFAULT 'sheets',
+            myitmo_username TEXT,
+            myitmo_access_token TEXT,
+            myitmo_refresh_token TEXT,
+            myitmo_token_expiry TEXT,
+            user_spreadsheet_id TEXT,
+            user_sheet_gid INTEGER,
+
+            autosend_enabled INTEGER NOT NULL DEFAULT 0,
+            autosend_mode INTEGER,
+            autosend_time TEXT,
+            autosend_last_date TEXT,
+
+            autosend_msg_id INTEGER,
+            autosend_cur_key TEXT,
+
+            gcal_connected INTEGER DEFAULT 0,
+            gcal_access_token TEXT,
+            gcal_refresh_token TEXT,
+            gcal_token_expiry TEXT,
+            gcal_calendar_id TEXT,
+            gcal_last_sync TEXT,
+
+            gcal_autosync_enabled INTEGER NOT NULL DEFAULT 0,
+            gcal_autosync_mode TEXT DEFAULT 'daily',
+            gcal_autosync_time TEXT,
+            gcal_autosync_weekday INTEGER,
+            gcal_autosync_last_key TEXT
         )
+    """
+    conn.execute(
+        create_users_sql
+    )
+    cols = [r["name"] for r in conn.execute("PRAGMA table_info(users)")]
+    cols_set = set(cols)
+
+    # Миграция удаления устаревших колонок (SQLite: только через rebuild).
+    obsolete_cols = {"myitmo_password"}
+    if obsolete_cols & cols_set:
+        conn.execute("DROP TABLE IF EXISTS users_new")
+        conn.execute(create_users_sql.replace("users (", "users_new (", 1))
+        desired_cols = [r["name"] for r in conn.execute("PRAGMA table_info(users_new)")]
+        copy_cols = [c for c in desired_cols if c in cols_set]
+        if copy_cols:
+            joined = ", ".join(copy_cols)
+            conn.execute(f"INSERT INTO users_new ({joined}) SELECT {joined} FROM users")
+        conn.execute("DROP TABLE users")
+        conn.execute("ALTER TABLE users_new RENAME TO users")
         cols = [r["name"] for r in conn.execute("PRAGMA table_info(users)")]
         cols_set = set(cols)
 
-        # Миграция удаления устаревших колонок (SQLite: только через rebuild).
-        obsolete_cols = {"myitmo_password"}
-        if obsolete_cols & cols_set:
-            conn.execute("DROP TABLE IF EXISTS users_new")
-            conn.execute(create_users_sql.replace("users (", "users_new (", 1))
-            desired_cols = [r["name"] for r in conn.execute("PRAGMA table_info(users_new)")]
-            copy_cols = [c for c in desired_cols if c in cols_set]
-            if copy_cols:
-                joined = ", ".join(copy_cols)
-                conn.execute(f"INSERT INTO users_new ({joined}) SELECT {joined} FROM users")
-            conn.execute("DROP TABLE users")
-            conn.execute("ALTER TABLE users_new RENAME TO users")
-            cols = [r["name"] for r in conn.execute("PRAGMA table_info(users)")]
-            cols_set = set(cols)
-
-        if "schedule_source_mode" not in cols:
-            conn.execute("ALTER TABLE users ADD COLUMN schedule_source_mode TEXT DEFAULT 'sheets'")
-        if "myitmo_username" not in cols:
-            conn.execute("ALTER TABLE users ADD COLUMN myitmo_username TEXT")
-        if "myitmo_access_token" not in cols:
-            conn.execute("ALTER TABLE users ADD COLUMN myitmo_access_token TEXT")
-        if "myitmo_refresh_token" not in cols:
-            conn.execute("ALTER TABLE users ADD COLUMN myitmo_refresh_token TEXT")
-        if "myitmo_token_expiry" not in cols:
-            conn.execute("ALTER TABLE users ADD COLUMN myitmo_token_expiry TEXT")
-        if "user_spreadsheet_id" not in cols:
-            conn.execute("ALTER TABLE users ADD COLUMN user_spreadsheet_id TEXT")
-        if "user_sheet_gid" not in cols:
-            conn.execute("ALTER TABLE users ADD COLUMN user_sheet_gid INTEGER")
-        if "gcal_autosync_enabled" not in cols:
-            conn.execute("ALTER TABLE users ADD COLUMN gcal_autosync_enabled INTEGER NOT NULL DEFAULT 0")
-        if "gcal_autosync_mode" not in cols:
-            conn.execute("ALTER TABLE users ADD COLUMN gcal_autosync_mode TEXT DEFAULT 'daily'")
-        if "gcal_autosync_time" not in cols:
-            conn.execute("ALTER TABLE users ADD COLUMN gcal_autosync_time TEXT")
-        if "gcal_autosync_weekday" not in cols:
-            conn.execute("ALTER TABLE users ADD COLUMN gcal_autosync_weekday INTEGER")
-        if "gcal_autosync_last_key" not in cols:
-            conn.execute("ALTER TABLE users ADD COLUMN gcal_autosync_last_key TEXT")
-        if "exam_alerts_enabled" not in cols:
-            conn.execute("ALTER TABLE users ADD COLUMN exam_alerts_enabled INTEGER NOT NULL DEFAULT 0")
-        conn.commit()
+    if "schedule_source_mode" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN schedule_source_mode TEXT DEFAULT 'sheets'")
+    if "myitmo_username" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN myitmo_username TEXT")
+    if "myitmo_access_token" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN myitmo_access_token TEXT")
+    if "myitmo_refresh_token" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN myitmo_refresh_token TEXT")
+    if "myitmo_token_expiry" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN myitmo_token_expiry TEXT")
+    if "user_spreadsheet_id" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN user_spreadsheet_id TEXT")
+    if "user_sheet_gid" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN user_sheet_gid INTEGER")
+    if "gcal_autosync_enabled" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN gcal_autosync_enabled INTEGER NOT NULL DEFAULT 0")
+    if "gcal_autosync_mode" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN gcal_autosync_mode TEXT DEFAULT 'daily'")
+    if "gcal_autosync_time" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN gcal_autosync_time TEXT")
+    if "gcal_autosync_weekday" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN gcal_autosync_weekday INTEGER")
+    if "gcal_autosync_last_key" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN gcal_autosync_last_key TEXT")
+    if "exam_alerts_enabled" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN exam_alerts_enabled INTEGER NOT NULL DEFAULT 0")
+
+
+def _m002_bot_settings(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS bot_settings (
+            key   TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS exam_alerts (
+            telegram_id INTEGER,
+            alert_key   TEXT,
+            PRIMARY KEY (telegram_id, alert_key)
+        )
+    """)
+
+
+def _m003_scheduler_indexes(conn: sqlite3.Connection) -> None:
+    """Индексы под запросы планировщиков (см. _SQL_* выше)."""
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_autosend "
+        "ON users(autosend_enabled, autosend_mode, autosend_time)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_gcal_autosync "
+        "ON users(gcal_autosync_enabled, gcal_connected, gcal_autosync_time)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_group ON users(group_code)")
+
+
+_MIGRATIONS = (
+    (1, "users", _m001_users),
+    (2, "bot_settings, exam_alerts", _m002_bot_settings),
+    (3, "scheduler indexes", _m003_scheduler_indexes),
+)
+SCHEMA_VERSION = _MIGRATIONS[-1][0]
+
+_schema_version: Optional[int] = None
+
+
+def _read_schema_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT MAX(version) AS v FROM schema_version").fetchone()
+    return int(row["v"] or 0)
+
+
+def init_db():
+    """Применить недостающие миграции схемы (один раз на процесс)."""
+    global _schema_version
+    if _schema_version == SCHEMA_VERSION:
+        return
+    conn = _get_conn()
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version    INTEGER PRIMARY KEY,
+                name       TEXT,
+                applied_at TEXT
+            )
+        """)
+    for version, name, migrate in _MIGRATIONS:
+        # IMMEDIATE: второй процесс с той же БД дождётся и увидит уже применённую версию
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if _read_schema_version(conn) < version:
+                migrate(conn)
+                conn.execute(
+                    "INSERT INTO schema_version(version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")),
+                )
+                log.info("schema migration %d applied: %s", version, name)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    _schema_version = SCHEMA_VERSION
+    invalidate_user()
+
+
+def get_schema_version() -> int:
+    """Версия схемы bot.db (из памяти после init_db)."""
+    if _schema_version is None:
+        with _get_conn() as conn:
+            return _read_schema_version(conn)
+    return _schema_version
 
 def get_user(telegram_id: int) -> Optional[Dict[str, Any]]:
+    uid = int(telegram_id)
+    cached = _USER_CACHE.get(uid)
+    if cached is not None:
+        return dict(cached)
+    writes_before = _user_writes
     with _conn() as con:
-        cur = con.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
+        cur = con.execute("SELECT * FROM users WHERE telegram_id = ?", (uid,))
         row = cur.fetchone()
-        return dict(row) if row else None
+    if not row:
+        return None
+    user = dict(row)
+    _cache_users_read(writes_before, [user])
+    return dict(user)
+
+def get_users(telegram_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Несколько профилей разом: из кэша, недостающие — одним SELECT ... IN (...)."""
+    out: Dict[int, Dict[str, Any]] = {}
+    missing: List[int] = []
+    for tid in dict.fromkeys(int(t) for t in telegram_ids):
+        cached = _USER_CACHE.get(tid)
+        if cached is not None:
+            out[tid] = dict(cached)
+        else:
+            missing.append(tid)
+    writes_before = _user_writes
+    for i in range(0, len(missing), 500):  # лимит параметров SQLite
+        chunk = missing[i:i + 500]
+        with _conn() as con:
+            rows = con.execute(
+                f"SELECT * FROM users WHERE telegram_id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+        users = [dict(row) for row in rows]
+        _cache_users_read(writes_before, users)
+        for user in users:
+            out[user["telegram_id"]] = dict(user)
+    return out
 
 def upsert_user(telegram_id: int, telegram_tag: Optional[str]) -> None:
     with _conn() as con:
@@ -133,26 +332,32 @@ def upsert_user(telegram_id: int, telegram_tag: Optional[str]) -> None:
             """,
             (telegram_id, telegram_tag),
         )
+    _user_written(telegram_id)
 
 def set_message_id(telegram_id: int, message_id: Optional[int]) -> None:
     with _conn() as con:
         con.execute("UPDATE users SET message_id = ? WHERE telegram_id = ?", (message_id, telegram_id))
+    _user_written(telegram_id, message_id=message_id)
 
 def set_type(telegram_id: int, value: int) -> None:
     with _conn() as con:
         con.execute("UPDATE users SET type = ? WHERE telegram_id = ?", (value, telegram_id))
+    _user_written(telegram_id, type=value)
 
 def set_timezone(telegram_id: int, tz: str) -> None:
     with _conn() as con:
         con.execute("UPDATE users SET timezone = ? WHERE telegram_id = ?", (tz, telegram_id))
+    _user_written(telegram_id, timezone=tz)
 
 def set_course(telegram_id: int, course: int) -> None:
     with _conn() as con:
         con.execute("UPDATE users SET course = ? WHERE telegram_id = ?", (course, telegram_id))
+    _user_written(telegram_id, course=course)
 
 def set_group(telegram_id: int, group_code: str) -> None:
     with _conn() as con:
         con.execute("UPDATE users SET group_code = ? WHERE telegram_id = ?", (group_code, telegram_id))
+    _user_written(telegram_id, group_code=group_code)
 
 def set_schedule_source_mode(telegram_id: int, mode: str) -> None:
     mode = str(mode or "").strip().lower()
@@ -160,6 +365,7 @@ def set_schedule_source_mode(telegram_id: int, mode: str) -> None:
         raise ValueError("schedule_source_mode must be 'sheets', 'myitmo_full' or 'hybrid'")
     with _conn() as con:
         con.execute("UPDATE users SET schedule_source_mode = ? WHERE telegram_id = ?", (mode, telegram_id))
+    _user_written(telegram_id, schedule_source_mode=mode)
 
 def clear_myitmo_credentials(telegram_id: int) -> None:
     with _conn() as con:
@@ -169,6 +375,10 @@ def clear_myitmo_credentials(telegram_id: int) -> None:
             "WHERE telegram_id = ?",
             (telegram_id,),
         )
+    _user_written(
+        telegram_id,
+        myitmo_username=None, myitmo_access_token=None, myitmo_refresh_token=None, myitmo_token_expiry=None,
+    )
 
 
 def set_myitmo_login(telegram_id: int, username: str) -> None:
@@ -179,6 +389,10 @@ def set_myitmo_login(telegram_id: int, username: str) -> None:
             "WHERE telegram_id = ?",
             (username, telegram_id),
         )
+    _user_written(
+        telegram_id,
+        myitmo_username=username, myitmo_access_token=None, myitmo_refresh_token=None, myitmo_token_expiry=None,
+    )
 
 
 def set_myitmo_tokens(
@@ -193,6 +407,10 @@ def set_myitmo_tokens(
             "myitmo_token_expiry = ? WHERE telegram_id = ?",
             (access_token, refresh_token, token_expiry_iso, telegram_id),
         )
+    _user_written(
+        telegram_id,
+        myitmo_access_token=access_token, myitmo_refresh_token=refresh_token, myitmo_token_expiry=token_expiry_iso,
+    )
 
 def set_user_sheet_source(telegram_id: int, spreadsheet_id: str, sheet_gid: int) -> None:
     with _conn() as con:
@@ -200,6 +418,7 @@ def set_user_sheet_source(telegram_id: int, spreadsheet_id: str, sheet_gid: int)
             "UPDATE users SET user_spreadsheet_id = ?, user_sheet_gid = ? WHERE telegram_id = ?",
             (spreadsheet_id, int(sheet_gid), telegram_id),
         )
+    _user_written(telegram_id, user_spreadsheet_id=spreadsheet_id, user_sheet_gid=int(sheet_gid))
 
 def clear_user_sheet_source(telegram_id: int) -> None:
     with _conn() as con:
@@ -207,6 +426,7 @@ def clear_user_sheet_source(telegram_id: int) -> None:
             "UPDATE users SET user_spreadsheet_id = NULL, user_sheet_gid = NULL WHERE telegram_id = ?",
             (telegram_id,),
         )
+    _user_written(telegram_id, user_spreadsheet_id=None, user_sheet_gid=None)
 
 def _ensure_user_exists(conn: sqlite3.Connection, telegram_id: int):
     cur = conn.execute("SELECT 1 FROM users WHERE telegram_id = ?", (telegram_id,))
@@ -224,6 +444,7 @@ def set_autosend_enabled(telegram_id: int, enabled: bool):
             (1 if enabled else 0, telegram_id),
         )
         conn.commit()
+    _user_written(telegram_id, autosend_enabled=1 if enabled else 0)
 
 def set_autosend_mode(telegram_id: int, mode: int):
     """
@@ -240,6 +461,7 @@ def set_autosend_mode(telegram_id: int, mode: int):
             (mode, telegram_id),
         )
         conn.commit()
+    _user_written(telegram_id, autosend_mode=mode)
 
 def set_gcal_calendar_id(telegram_id: int, cal_id: Optional[str]):
     """
@@ -252,6 +474,7 @@ def set_gcal_calendar_id(telegram_id: int, cal_id: Optional[str]):
             (cal_id, telegram_id),
         )
         conn.commit()
+    _user_written(telegram_id, gcal_calendar_id=cal_id)
 
 def set_autosend_time(telegram_id: int, hhmm: str):
     """
@@ -266,59 +489,60 @@ def set_autosend_time(telegram_id: int, hhmm: str):
             (hhmm, telegram_id),
         )
         conn.commit()
+    _user_written(telegram_id, autosend_time=hhmm)
 
 def get_autosend_last_date(telegram_id: int) -> Optional[str]:
-    with _get_conn() as conn:
-        cur = conn.execute("SELECT autosend_last_date FROM users WHERE telegram_id = ?", (telegram_id,))
-        row = cur.fetchone()
-        return row["autosend_last_date"] if row else None
+    user = get_user(telegram_id)
+    return user["autosend_last_date"] if user else None
 
 def set_autosend_last_date(telegram_id: int, ymd: str):
     with _get_conn() as conn:
         conn.execute("UPDATE users SET autosend_last_date = ? WHERE telegram_id = ?", (ymd, telegram_id))
         conn.commit()
+    _user_written(telegram_id, autosend_last_date=ymd)
 
-def list_users_for_autosend_at(hhmm: str, mode: int = 1) -> List[Dict[str, Any]]:
+def list_myitmo_tokens_expiring(before_utc: str, limit: int = 200) -> List[Dict[str, Any]]:
+    """
+    Пользователи с refresh_token my.itmo, у которых access_token истекает раньше
+    before_utc ('YYYY-MM-DDTHH:MM:SS', UTC) или срок не известен. Ближайшие — первыми.
+    """
     with _get_conn() as conn:
         cur = conn.execute(
             """
-            SELECT * FROM users
-            WHERE autosend_enabled = 1
-              AND autosend_mode = ?
-              AND autosend_time = ?
-              AND group_code IS NOT NULL
-              AND group_code <> ''
+            SELECT telegram_id, myitmo_username, myitmo_access_token,
+                   myitmo_refresh_token, myitmo_token_expiry
+            FROM users
+            WHERE myitmo_username IS NOT NULL AND myitmo_username <> ''
+              AND myitmo_refresh_token IS NOT NULL AND myitmo_refresh_token <> ''
+              AND (myitmo_token_expiry IS NULL OR substr(myitmo_token_expiry, 1, 19) < ?)
+            ORDER BY myitmo_token_expiry
+            LIMIT ?
             """,
-            (mode, hhmm),
+            (before_utc, int(limit)),
         )
         return [dict(r) for r in cur.fetchall()]
 
-def list_users_mode2_enabled() -> List[Dict[str, Any]]:
+def list_gcal_tokens_expiring(before_utc: str, limit: int = 200) -> List[int]:
+    """telegram_id подключённых к Google Calendar, чей access_token истекает раньше before_utc."""
     with _get_conn() as conn:
         cur = conn.execute(
             """
-            SELECT * FROM users
-            WHERE autosend_enabled = 1
-              AND autosend_mode = 2
-              AND group_code IS NOT NULL
-              AND group_code <> ''
-            """
+            SELECT telegram_id FROM users
+            WHERE gcal_connected = 1
+              AND gcal_refresh_token IS NOT NULL AND gcal_refresh_token <> ''
+              AND (gcal_token_expiry IS NULL OR substr(gcal_token_expiry, 1, 19) < ?)
+            ORDER BY gcal_token_expiry
+            LIMIT ?
+            """,
+            (before_utc, int(limit)),
         )
-        return [dict(r) for r in cur.fetchall()]
+        return [int(r["telegram_id"]) for r in cur.fetchall()]
 
-def migrate_gcal_autosync():
+def list_users_for_scheduler() -> List[Dict[str, Any]]:
+    """Все, у кого включена автоотправка или автосинк Google Calendar (поля для расписания задач)."""
     with _get_conn() as conn:
-        cols = {r["name"] for r in conn.execute("PRAGMA table_info(users)")}
-        def add(col_name: str, ddl: str):
-            if col_name not in cols:
-                conn.execute(f"ALTER TABLE users ADD COLUMN {ddl}")
-
-        add("gcal_autosync_enabled",  "gcal_autosync_enabled INTEGER NOT NULL DEFAULT 0")
-        add("gcal_autosync_mode",     "gcal_autosync_mode TEXT DEFAULT 'daily'")  # 'daily' | 'weekly'
-        add("gcal_autosync_time",     "gcal_autosync_time TEXT")                  # 'HH:MM'
-        add("gcal_autosync_weekday",  "gcal_autosync_weekday INTEGER")            # 0..6 (Mon..Sun)
-        add("gcal_autosync_last_key", "gcal_autosync_last_key TEXT")              # 'daily:YYYY-MM-DD' / 'weekly:YYYY-Www'
-        conn.commit()
+        cur = conn.execute(_SQL_SCHEDULER_USERS)
+        return [dict(r) for r in cur.fetchall()]
 
 def set_autosend_message_id(telegram_id: int, msg_id: Optional[int]):
     with _get_conn() as conn:
@@ -327,23 +551,55 @@ def set_autosend_message_id(telegram_id: int, msg_id: Optional[int]):
             (msg_id, telegram_id),
         )
         conn.commit()
+    _user_written(telegram_id, autosend_msg_id=msg_id)
 
 def get_autosend_message_id(telegram_id: int) -> Optional[int]:
-    with _get_conn() as conn:
-        cur = conn.execute("SELECT autosend_msg_id FROM users WHERE telegram_id = ?", (telegram_id,))
-        r = cur.fetchone()
-        return r["autosend_msg_id"] if r else None
+    user = get_user(telegram_id)
+    return user["autosend_msg_id"] if user else None
 
 def set_autosend_cur_key(telegram_id: int, key: str):
     with _get_conn() as conn:
         conn.execute("UPDATE users SET autosend_cur_key = ? WHERE telegram_id = ?", (key, telegram_id))
         conn.commit()
+    _user_written(telegram_id, autosend_cur_key=key)
 
 def get_autosend_cur_key(telegram_id: int) -> Optional[str]:
-    with _get_conn() as conn:
-        cur = conn.execute("SELECT autosend_cur_key FROM users WHERE telegram_id = ?", (telegram_id,))
-        r = cur.fetchone()
-        return r["autosend_cur_key"] if r else None
+    user = get_user(telegram_id)
+    return user["autosend_cur_key"] if user else None
+
+# Состояние автоотправки, которое runner пишет пачкой раз за тик.
+_AUTOSEND_STATE_FIELDS = ("autosend_last_date", "autosend_msg_id", "autosend_cur_key")
+# Флаг перед каждым значением: поля, которых нет в обновлении, остаются как есть.
+_SQL_SAVE_AUTOSEND_STATE = """
+    UPDATE users SET
+        autosend_last_date = CASE WHEN ? THEN ? ELSE autosend_last_date END,
+        autosend_msg_id    = CASE WHEN ? THEN ? ELSE autosend_msg_id END,
+        autosend_cur_key   = CASE WHEN ? THEN ? ELSE autosend_cur_key END
+    WHERE telegram_id = ?
+"""
+
+def save_autosend_states(updates: Dict[int, Dict[str, Any]]) -> int:
+    """
+    {telegram_id: {поле: значение}} → один executemany в одной транзакции.
+    Допустимые поля — _AUTOSEND_STATE_FIELDS; отсутствующие не меняются.
+    """
+    if not updates:
+        return 0
+    params = []
+    for uid, fields in updates.items():
+        unknown = set(fields) - set(_AUTOSEND_STATE_FIELDS)
+        if unknown:
+            raise ValueError(f"save_autosend_states: unknown fields {sorted(unknown)}")
+        row: List[Any] = []
+        for name in _AUTOSEND_STATE_FIELDS:
+            row += [1 if name in fields else 0, fields.get(name)]
+        row.append(int(uid))
+        params.append(row)
+    with _get_conn() as conn:
+        conn.executemany(_SQL_SAVE_AUTOSEND_STATE, params)
+    for uid, fields in updates.items():
+        _user_written(uid, **fields)
+    return len(params)
 
 def set_gcal_connected(telegram_id: int, connected: bool):
     with _get_conn() as conn:
@@ -353,6 +609,7 @@ def set_gcal_connected(telegram_id: int, connected: bool):
             (1 if connected else 0, telegram_id),
         )
         conn.commit()
+    _user_written(telegram_id, gcal_connected=1 if connected else 0)
 
 def set_gcal_tokens(telegram_id: int, access: str, refresh: Optional[str], expiry_iso: str):
     with _get_conn() as conn:
@@ -376,6 +633,10 @@ def set_gcal_tokens(telegram_id: int, access: str, refresh: Optional[str], expir
                 (access, expiry_iso, telegram_id),
             )
         conn.commit()
+    if refresh is not None:
+        _user_written(telegram_id, gcal_access_token=access, gcal_refresh_token=refresh, gcal_token_expiry=expiry_iso)
+    else:
+        _user_written(telegram_id, gcal_access_token=access, gcal_token_expiry=expiry_iso)
 
 def set_gcal_last_sync(telegram_id: int, iso: Optional[str] = None):
     if iso is None:
@@ -383,6 +644,7 @@ def set_gcal_last_sync(telegram_id: int, iso: Optional[str] = None):
     with _get_conn() as conn:
         conn.execute("UPDATE users SET gcal_last_sync = ? WHERE telegram_id = ?", (iso, telegram_id))
         conn.commit()
+    _user_written(telegram_id, gcal_last_sync=iso)
 
 def set_gcal_autosync_enabled(telegram_id: int, enabled: bool):
     with _get_conn() as conn:
@@ -390,6 +652,7 @@ def set_gcal_autosync_enabled(telegram_id: int, enabled: bool):
         conn.execute("UPDATE users SET gcal_autosync_enabled = ? WHERE telegram_id = ?",
                      (1 if enabled else 0, telegram_id))
         conn.commit()
+    _user_written(telegram_id, gcal_autosync_enabled=1 if enabled else 0)
 
 def set_gcal_autosync_mode(telegram_id: int, mode: str):
     mode = (mode or "daily").lower()
@@ -399,6 +662,7 @@ def set_gcal_autosync_mode(telegram_id: int, mode: str):
         _ensure_user_exists(conn, telegram_id)
         conn.execute("UPDATE users SET gcal_autosync_mode = ? WHERE telegram_id = ?", (mode, telegram_id))
         conn.commit()
+    _user_written(telegram_id, gcal_autosync_mode=mode)
 
 def set_gcal_autosync_time(telegram_id: int, hhmm: str):
     if not _TIME_RE.match(hhmm or ""):
@@ -407,6 +671,7 @@ def set_gcal_autosync_time(telegram_id: int, hhmm: str):
         _ensure_user_exists(conn, telegram_id)
         conn.execute("UPDATE users SET gcal_autosync_time = ? WHERE telegram_id = ?", (hhmm, telegram_id))
         conn.commit()
+    _user_written(telegram_id, gcal_autosync_time=hhmm)
 
 def set_gcal_autosync_weekday(telegram_id: int, weekday: int):
     if weekday not in range(0, 7):
@@ -415,28 +680,22 @@ def set_gcal_autosync_weekday(telegram_id: int, weekday: int):
         _ensure_user_exists(conn, telegram_id)
         conn.execute("UPDATE users SET gcal_autosync_weekday = ? WHERE telegram_id = ?", (weekday, telegram_id))
         conn.commit()
+    _user_written(telegram_id, gcal_autosync_weekday=weekday)
 
 def set_gcal_autosync_last_key(telegram_id: int, key: str):
     with _get_conn() as conn:
         conn.execute("UPDATE users SET gcal_autosync_last_key = ? WHERE telegram_id = ?", (key, telegram_id))
         conn.commit()
+    _user_written(telegram_id, gcal_autosync_last_key=key)
+
+_GCAL_AUTOSYNC_COLS = (
+    "gcal_autosync_enabled", "gcal_autosync_mode", "gcal_autosync_time",
+    "gcal_autosync_weekday", "gcal_autosync_last_key",
+)
 
 def get_gcal_autosync(user_id: int) -> Dict[str, Any]:
-    with _get_conn() as conn:
-        r = conn.execute(
-            "SELECT gcal_autosync_enabled, gcal_autosync_mode, gcal_autosync_time, "
-            "gcal_autosync_weekday, gcal_autosync_last_key FROM users WHERE telegram_id = ?",
-            (user_id,)
-        ).fetchone()
-        return dict(r) if r else {}
-
-def list_users_gcal_autosync_enabled() -> list[Dict[str, Any]]:
-    with _get_conn() as conn:
-        cur = conn.execute(
-            "SELECT * FROM users WHERE gcal_autosync_enabled = 1 AND gcal_connected = 1 "
-            "AND (gcal_autosync_time IS NOT NULL AND gcal_autosync_time <> '')"
-        )
-        return [dict(x) for x in cur.fetchall()]
+    user = get_user(user_id)
+    return {k: user[k] for k in _GCAL_AUTOSYNC_COLS} if user else {}
 
 
 def list_user_ids_for_broadcast() -> List[int]:
@@ -453,25 +712,6 @@ def list_user_ids_for_broadcast() -> List[int]:
 
 # ─── bot_settings ─────────────────────────────────────────────────────────────
 
-def init_bot_settings():
-    """Создаёт таблицы bot_settings и exam_alerts."""
-    with _get_conn() as conn:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS bot_settings (
-                key   TEXT PRIMARY KEY,
-                value TEXT
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS exam_alerts (
-                telegram_id INTEGER,
-                alert_key   TEXT,
-                PRIMARY KEY (telegram_id, alert_key)
-            )
-        """)
-        conn.commit()
-
-
 def get_bot_setting(key: str, default: Optional[str] = None) -> Optional[str]:
     with _get_conn() as conn:
         r = conn.execute("SELECT value FROM bot_settings WHERE key = ?", (key,)).fetchone()
@@ -504,20 +744,29 @@ def set_bot_mode(mode: str) -> None:
 
 # ─── exam_alerts ──────────────────────────────────────────────────────────────
 
-def exam_alert_sent(telegram_id: int, alert_key: str) -> bool:
-    with _get_conn() as conn:
-        r = conn.execute(
-            "SELECT 1 FROM exam_alerts WHERE telegram_id = ? AND alert_key = ?",
-            (telegram_id, alert_key),
-        ).fetchone()
-        return r is not None
-
-
-def mark_exam_alert_sent(telegram_id: int, alert_key: str) -> None:
-    with _get_conn() as conn:
-        conn.execute(
+def list_exam_alerts_sent(alert_keys: List[str]) -> Set[Tuple[int, str]]:
+    """Уже отправленные алерты по этим ключам: {(telegram_id, alert_key)} — один SELECT ... IN (...)."""
+    keys = list(dict.fromkeys(alert_keys))
+    out: Set[Tuple[int, str]] = set()
+    for i in range(0, len(keys), 500):  # лимит параметров SQLite
+        chunk = keys[i:i + 500]
+        with _get_conn() as conn:
+            rows = conn.execute(
+                f"SELECT telegram_id, alert_key FROM exam_alerts WHERE alert_key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+        out.update((int(r["telegram_id"]), r["alert_key"]) for r in rows)
+    return out
+
+
+def mark_exam_alerts_sent(sent: List[Tuple[int, str]]) -> None:
+    """Записать отправленные алерты [(telegram_id, alert_key)] одной транзакцией."""
+    if not sent:
+        return
+    with _get_conn() as conn:
+        conn.executemany(
             "INSERT OR IGNORE INTO exam_alerts(telegram_id, alert_key) VALUES (?, ?)",
-            (telegram_id, alert_key),
+            sent,
         )
         conn.commit()
 
@@ -530,13 +779,35 @@ def set_exam_alerts_enabled(telegram_id: int, enabled: bool) -> None:
             (1 if enabled else 0, telegram_id),
         )
         conn.commit()
+    _user_written(telegram_id, exam_alerts_enabled=1 if enabled else 0)
 
 
 def list_users_with_group() -> List[Dict[str, Any]]:
-    """Все пользователи у которых задана группа."""
+    """Все пользователи у которых задана группа (только поля для экзаменационных алертов)."""
     with _get_conn() as conn:
-        cur = conn.execute(
-            "SELECT * FROM users WHERE group_code IS NOT NULL AND group_code <> ''"
-        )
+        cur = conn.execute(_SQL_WITH_GROUP)
         return [dict(r) for r in cur.fetchall()]
 
+
+_PLAN_CHECKS = (
+    ("list_users_with_group", _SQL_WITH_GROUP, ()),
+    ("list_users_for_scheduler", _SQL_SCHEDULER_USERS, ()),
+)
+_FULL_SCAN_RE = re.compile(r"^SCAN (TABLE )?users\b(?!.*INDEX)")
+
+
+def check_query_plans() -> List[str]:
+    """
+    EXPLAIN QUERY PLAN для запросов планировщиков: если какой-то из них
+    скатился в полный скан users (пропал индекс, поменяли WHERE), пишем
+    предупреждение в лог. Возвращает список проблемных запросов.
+    """
+    bad: List[str] = []
+    with _get_conn() as conn:
+        for name, sql, params in _PLAN_CHECKS:
+            details = [r["detail"] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            if any(_FULL_SCAN_RE.match(d) for d in details):
+                bad.append(name)
+                log.warning("full table scan in %s: %s", name, "; ".join(details))
+    return bad
+
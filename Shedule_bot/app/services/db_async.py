@@ -0,0 +1,85 @@
+# app/services/db_async.py
+"""
+Асинхронный фасад над services/db.py и services/isu_db.py.
+
+Синхронные функции БД выполняются в выделенном потоке (один на файл БД,
+задачи идут через очередь ThreadPoolExecutor), поэтому хендлеры и циклы
+автоотправки не блокируют event loop на SQLite. Имена те же:
+
+    from app.services.db_async import adb
+    user = await adb.get_user(uid)
+
+Вызовы дольше DB_SLOW_QUERY_MS пишутся в лог с длительностью и временем
+ожидания в очереди.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+from typing import Any, Awaitable, Callable, Dict
+
+from app.config import settings
+from app.services import db as _db
+from app.services import isu_db as _isu_db
+
+log = logging.getLogger("db.async")
+
+
+class AsyncDB:
+    def __init__(self, module: ModuleType, name: str):
+        self._module = module
+        self._name = name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db-{name}")
+        self._wrappers: Dict[str, Callable[..., Awaitable[Any]]] = {}
+        self.calls = 0
+        self.slow = 0
+        self.max_ms = 0.0
+
+    def _timed(self, fn_name: str, fn: Callable[..., Any], queued_at: float, *args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            done = time.perf_counter()
+            run_ms = (done - started) * 1000
+            wait_ms = (started - queued_at) * 1000
+            self.calls += 1
+            self.max_ms = max(self.max_ms, run_ms)
+            if run_ms + wait_ms >= settings.db_slow_query_ms:
+                self.slow += 1
+                log.warning("slow db call %s.%s: %.1f ms (queued %.1f ms)", self._name, fn_name, run_ms, wait_ms)
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Выполнить произвольную синхронную функцию в потоке этой БД."""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(
+            self._timed, getattr(fn, "__name__", "call"), fn, time.perf_counter(), *args, **kwargs
+        )
+        return await loop.run_in_executor(self._executor, call)
+
+    def __getattr__(self, attr: str) -> Callable[..., Awaitable[Any]]:
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        wrapper = self._wrappers.get(attr)
+        if wrapper is None:
+            fn = getattr(self._module, attr)
+            if not callable(fn):
+                raise AttributeError(f"{self._module.__name__}.{attr} is not callable")
+
+            @functools.wraps(fn)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                return await self.run(fn, *args, **kwargs)
+
+            self._wrappers[attr] = wrapper
+        return wrapper
+
+    def stats(self) -> Dict[str, Any]:
+        return {"name": self._name, "calls": self.calls, "slow": self.slow, "max_ms": round(self.max_ms, 1)}
+
+
+adb = AsyncDB(_db, "bot")
+aisu = AsyncDB(_isu_db, "isu")
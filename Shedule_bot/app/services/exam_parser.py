@@ -16,17 +16,19 @@
 """
 from __future__ import annotations
 
+import asyncio
 import csv
 import io
 import re
 import logging
 from datetime import date, datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
 
 from app.services.sheets_client import fetch_sheet_values_and_links
 from app.config import settings
+from app.utils.ttl_cache import TTLCache
 
 log = logging.getLogger("exam_parser")
 
@@ -194,11 +196,28 @@ def load_exams(
     return parse_exam_matrix(matrix)
 
 
-def get_exams_for_group(
+# Экзамены нужны и алертам (раз в несколько минут), и кнопке расписания —
+# лист перечитываем не чаще раза в _EXAMS_TTL_SEC.
+_EXAMS_TTL_SEC = 600
+_EXAMS_CACHE: TTLCache[Tuple[str, int], List[Dict[str, Any]]] = TTLCache("exams", maxsize=4, ttl=_EXAMS_TTL_SEC)
+
+
+async def load_exams_cached(spreadsheet_id: str, sheet_gid: int) -> List[Dict[str, Any]]:
+    """load_exams в потоке (не блокирует event loop) с кэшем; пустой результат (сбой загрузки) не кэшируется."""
+    key = (spreadsheet_id, int(sheet_gid))
+    exams = _EXAMS_CACHE.get(key)
+    if exams is None:
+        exams = await asyncio.to_thread(load_exams, spreadsheet_id, int(sheet_gid))
+        if exams:
+            _EXAMS_CACHE.set(key, exams)
+    return exams
+
+
+async def get_exams_for_group(
     group: str,
     spreadsheet_id: str,
     sheet_gid: int,
 ) -> List[Dict[str, Any]]:
-    all_exams = load_exams(spreadsheet_id, sheet_gid)
+    all_exams = await load_exams_cached(spreadsheet_id, sheet_gid)
     g = (group or "").strip().upper()
     return [e for e in all_exams if e["group"].strip().upper() == g]
@@ -119,9 +119,10 @@ def _refresh_access_token(refresh_token: str) -> TokenBundle:
     return TokenBundle(access_token=access, refresh_token=None, expiry_iso=expiry_iso)
 
 
-def ensure_token(telegram_id: int) -> str:
+def ensure_token(telegram_id: int, skew_sec: int = 60) -> str:
     """
     Возвращает валидный access_token для пользователя. При необходимости обновляет.
+    skew_sec — за сколько секунд до истечения уже обновлять (фоновый рефрешер берёт с запасом).
     """
     u = get_user(telegram_id)
     if not u or not u.get("gcal_connected"):
@@ -137,7 +138,7 @@ def ensure_token(telegram_id: int) -> str:
         set_gcal_tokens(telegram_id, bundle.access_token, None, bundle.expiry_iso)
         return bundle.access_token
 
-    if _need_refresh(expiry):
+    if _need_refresh(expiry, skew_sec):
         if not refresh:
             # пробуем всё равно — может жить
             return access
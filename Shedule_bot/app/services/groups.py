@@ -1,45 +1,60 @@
 # app/services/groups.py
 from __future__ import annotations
-from typing import List, Optional
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
 
 from app.config import settings
-from app.services.sheets_client import fetch_sheet_grid
-from app.services.schedule_expand import expand_merged_matrix
 
 ROW_COURSE = 0
 ROW_GROUP  = 2
 COL_FIRST_GROUP = 3
 
+_MAX_GROUPS = 96
+
+
 def _clean(s: Optional[str]) -> str:
     return (s or "").strip()
 
-def list_groups_for_course(course: int) -> List[str]:
-    # ЧИТАЕМ ИЗ ENV (settings)
-    sheet = fetch_sheet_grid(
-        spreadsheet_id=settings.spreadsheet_id,
-        sheet_gid=settings.sheet_gid,
-        creds_path=settings.google_credentials,
-    )
-    m = expand_merged_matrix(sheet)
+
+def build_course_groups(m: List[List[Optional[str]]]) -> Mapping[str, Tuple[str, ...]]:
+    """
+    Заголовок курса → группы этого курса (порядок столбцов, без повторов).
+    Строится из шапки уже развёрнутой матрицы вместе со снимком листа.
+    """
     if not m or len(m) < 3:
-        return []
+        return MappingProxyType({})
 
     row_course = m[ROW_COURSE]
     row_group  = m[ROW_GROUP]
-    groups: List[str] = []
-    target = f"{course}"
+    by_course: Dict[str, List[str]] = {}
     for c in range(COL_FIRST_GROUP, max(len(row_course), len(row_group))):
         c_title = _clean(row_course[c] if c < len(row_course) else "")
         g_text  = _clean(row_group[c]  if c < len(row_group)  else "")
         if not g_text:
             continue
-        if target in c_title:
-            groups.append(g_text)
+        items = by_course.setdefault(c_title, [])
+        if g_text not in items:
+            items.append(g_text)
+    return MappingProxyType({t: tuple(gs) for t, gs in by_course.items()})
+
 
+def groups_for_course(course_groups: Mapping[str, Tuple[str, ...]], course: int) -> List[str]:
+    target = f"{course}"
     seen, out = set(), []
-    for g in groups:
-        if g not in seen:
-            seen.add(g)
-            out.append(g)
+    for c_title, groups in course_groups.items():
+        if target not in c_title:
+            continue
+        for g in groups:
+            if g not in seen:
+                seen.add(g)
+                out.append(g)
     out.sort(key=lambda s: (len(s), s))
-    return out[:96]
+    return out[:_MAX_GROUPS]
+
+
+async def list_groups_for_course(course: int) -> List[str]:
+    # Берём из того же снимка листа, что и расписание: без отдельной загрузки таблицы.
+    from app.services.sheet_cache import get_sheet_snapshot
+
+    snapshot = await get_sheet_snapshot(settings.spreadsheet_id, settings.sheet_gid)
+    return groups_for_course(snapshot.course_groups, course)
@@ -1,21 +1,17 @@
 from __future__ import annotations
 
-import os
 import sqlite3
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional, Tuple
 
 from app.config import settings
+from app.utils.sqlite_conn import connect
 
 DB_PATH = settings.isu_cache_db
 
 
 def _conn() -> sqlite3.Connection:
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    con = sqlite3.connect(DB_PATH, check_same_thread=False)
-    con.row_factory = sqlite3.Row
-    con.execute("PRAGMA journal_mode=WAL")
-    return con
+    return connect(DB_PATH)
 
 
 def init_isu_db() -> None:
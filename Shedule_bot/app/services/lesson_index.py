@@ -0,0 +1,83 @@
+# app/services/lesson_index.py
+"""
+Неизменяемый индекс пар: чётность → день недели → пары, отсортированные по началу.
+
+Строится один раз после разбора листа (или ответа my.itmo), дальше экраны
+расписания, автоотправка и синк в Google Calendar берут нужный день/неделю
+обычным поиском по словарю вместо фильтрации всего списка.
+"""
+from __future__ import annotations
+
+import re
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+DAY_ORDER = ["ПОНЕДЕЛЬНИК", "ВТОРНИК", "СРЕДА", "ЧЕТВЕРГ", "ПЯТНИЦА", "СУББОТА", "ВОСКРЕСЕНЬЕ"]
+
+_SLOT_START_RE = re.compile(r"^\s*(\d{1,2}):(\d{2})")
+_UNKNOWN_START = 24 * 60 + 1  # пары без разбираемого времени — в конец дня
+
+
+def norm_parity(p: str) -> str:
+    p = str(p or "").strip().lower().replace("ё", "е")
+    if "неч" in p:
+        return "нечёт"
+    if "чет" in p:
+        return "чёт"
+    return p
+
+
+def start_minute(lesson: Dict) -> int:
+    """'8:20-9:50' -> 500; неразбираемое время -> в конец."""
+    m = _SLOT_START_RE.match(str(lesson.get("time") or ""))
+    if not m:
+        return _UNKNOWN_START
+    return int(m.group(1)) * 60 + int(m.group(2))
+
+
+class LessonIndex:
+    __slots__ = ("_days", "_weeks", "_all")
+
+    def __init__(self, lessons: Iterable[Dict]):
+        ordered = sorted(lessons, key=start_minute)  # sorted стабилен: порядок листа внутри слота сохраняется
+        days: Dict[str, Dict[str, List[Dict]]] = {}
+        for it in ordered:
+            day = str(it.get("day") or "").strip().upper()
+            days.setdefault(norm_parity(it.get("parity")), {}).setdefault(day, []).append(it)
+
+        self._days: Mapping[str, Mapping[str, Tuple[Dict, ...]]] = MappingProxyType({
+            parity: MappingProxyType({d: tuple(items) for d, items in by_day.items()})
+            for parity, by_day in days.items()
+        })
+        weeks: Dict[str, Tuple[Dict, ...]] = {}
+        for parity, by_day in self._days.items():
+            known = [d for d in DAY_ORDER if d in by_day]
+            extra = [d for d in by_day if d not in DAY_ORDER]
+            weeks[parity] = tuple(it for d in known + extra for it in by_day[d])
+        self._weeks: Mapping[str, Tuple[Dict, ...]] = MappingProxyType(weeks)
+        self._all: Tuple[Dict, ...] = tuple(ordered)
+
+    def day(self, parity: str, day_upper: str) -> Tuple[Dict, ...]:
+        """Пары одного дня заданной чётности, по возрастанию времени начала."""
+        return self._days.get(norm_parity(parity), {}).get(str(day_upper or "").strip().upper(), ())
+
+    def week(self, parity: str) -> Tuple[Dict, ...]:
+        """Все пары недели заданной чётности: дни по порядку, внутри дня — по времени."""
+        return self._weeks.get(norm_parity(parity), ())
+
+    def all(self) -> Tuple[Dict, ...]:
+        return self._all
+
+    def __len__(self) -> int:
+        return len(self._all)
+
+
+EMPTY_INDEX = LessonIndex(())
+
+
+def build_group_indexes(lessons: Iterable[Dict]) -> Mapping[str, LessonIndex]:
+    """Разбивает общий список пар листа на индексы по группам."""
+    by_group: Dict[str, List[Dict]] = {}
+    for it in lessons:
+        by_group.setdefault(str(it.get("group") or ""), []).append(it)
+    return MappingProxyType({g: LessonIndex(items) for g, items in by_group.items()})
@@ -1,30 +1,41 @@
 from __future__ import annotations
+import asyncio
 import logging
-from datetime import date, datetime, timedelta
 import time
+from datetime import date, datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from zoneinfo import ZoneInfo
 
-from app.services.sheets_client import fetch_sheet_values_and_links
-from app.services.schedule_expand import expand_merged_matrix
-from app.services.schedule_list import list_lessons_matrix
+from app.services.sheet_cache import get_custom_sheet_snapshot, get_sheet_snapshot
+from app.services.lesson_index import LessonIndex
 from app.config import settings
 from app.services.myitmo_client import fetch_personal_schedule, MyItmoError
-from app.services.db import set_myitmo_tokens
+from app.services.db_async import adb
+from app.services.cache_db import load_myitmo_schedule, save_myitmo_schedule
 from app.utils.week_parity import week_parity_for_date
+from app.utils.single_flight import SingleFlight
+from app.utils.ttl_cache import TTLCache
 
 log = logging.getLogger("schedule.loader")
 
 _DAY_UP = ["ПОНЕДЕЛЬНИК", "ВТОРНИК", "СРЕДА", "ЧЕТВЕРГ", "ПЯТНИЦА", "СУББОТА", "ВОСКРЕСЕНЬЕ"]
 
-# Простые in-memory TTL-кэши для ускорения ответов в рантайме.
-_SHEETS_CACHE_TTL_SEC = 60
+# In-memory TTL-кэши для ускорения ответов в рантайме (ограничены по размеру).
 _MYITMO_CACHE_TTL_SEC = 60
+# Сколько держать в памяти устаревшую копию, отданную вместо упавшего my.itmo,
+# прежде чем снова попробовать сходить в сеть.
+_MYITMO_STALE_RETRY_SEC = 30
 _USER_VIEW_CACHE_TTL_SEC = 20
 
-_SHEETS_ALL_CACHE: Optional[Tuple[float, List[Dict]]] = None
-_MYITMO_RAW_CACHE: Dict[Tuple[str, str, str], Tuple[float, List[Dict]]] = {}
-_RESULT_CACHE: Dict[Tuple[str, str, str, str], Tuple[float, List[Dict]]] = {}
+_MYITMO_RAW_CACHE: TTLCache[Tuple[str, str, str], List[Dict]] = TTLCache(
+    "myitmo_raw", maxsize=1024, ttl=_MYITMO_CACHE_TTL_SEC
+)
+_RESULT_CACHE: TTLCache[Tuple[str, str, str, str], LessonIndex] = TTLCache(
+    "user_schedule", maxsize=4096, ttl=_USER_VIEW_CACHE_TTL_SEC
+)
+
+# Одновременные запросы одного и того же расписания my.itmo ждут одну загрузку.
+_MYITMO_FLIGHT = SingleFlight("myitmo")
 
 
 def _norm(s: str) -> str:
@@ -254,17 +265,121 @@ def _enrich_from_myitmo(lessons: List[Dict], itmo_index: Dict[Tuple[str, str], D
         enriched.append(lesson_copy)
     return enriched
 
-async def load_lessons_for_user_group(user: dict):
+async def _load_myitmo_raw(user: dict, tz: str, ttl: Optional[float] = None) -> List[Dict]:
+    """
+    Сырые пары my.itmo пользователя на текущую и следующую недели.
+
+    Порядок: память → cache.db (если копия моложе MYITMO_CACHE_FRESH_SEC) → сеть.
+    Если my.itmo не ответил, отдаём последнюю сохранённую копию (не старше
+    MYITMO_CACHE_MAX_STALE_SEC) вместо ошибки.
+    """
+    uid = int(user.get("telegram_id") or user.get("id") or 0)
+    username = (user.get("myitmo_username") or "").strip()
+    access_token = (user.get("myitmo_access_token") or "").strip()
+    refresh_token = (user.get("myitmo_refresh_token") or "").strip()
+    token_expiry = (user.get("myitmo_token_expiry") or "").strip()
+    if not username or not refresh_token:
+        raise MyItmoError("Не подключен my.itmo. Откройте Настройки → my.itmo аккаунт.")
+    date_start, date_end = _current_and_next_week_range(tz)
+    cache_key = (username, date_start, date_end)
+    cached = _MYITMO_RAW_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    async def _fetch() -> List[Dict]:
+        stored = None
+        try:
+            stored = await asyncio.to_thread(load_myitmo_schedule, username, date_start, date_end)
+        except Exception as e:
+            log.warning("my.itmo cache read failed for %s: %s", username, e)
+        if stored is not None:
+            age = time.time() - stored[0]
+            if age < settings.myitmo_cache_fresh_sec:
+                _MYITMO_RAW_CACHE.set(cache_key, stored[1], ttl=ttl)
+                return stored[1]
+
+        try:
+            raw, token_bundle = await fetch_personal_schedule(
+                username=username,
+                access_token=access_token or None,
+                refresh_token=refresh_token or None,
+                token_expiry=token_expiry or None,
+                timeout=settings.myitmo_timeout_sec,
+                date_start=date_start,
+                date_end=date_end,
+            )
+        except Exception as e:
+            if stored is None or age > settings.myitmo_cache_max_stale_sec:
+                raise
+            log.warning("my.itmo unavailable for %s, serving copy from %.0fs ago: %s", username, age, e)
+            _MYITMO_RAW_CACHE.set(cache_key, stored[1], ttl=_MYITMO_STALE_RETRY_SEC)
+            return stored[1]
+
+        if token_bundle.get("refresh_token") and (
+            token_bundle.get("access_token") != access_token
+            or token_bundle.get("refresh_token") != refresh_token
+            or token_bundle.get("token_expiry") != token_expiry
+        ):
+            await adb.set_myitmo_tokens(
+                uid,
+                token_bundle["access_token"],
+                token_bundle["refresh_token"],
+                token_bundle["token_expiry"],
+            )
+        _MYITMO_RAW_CACHE.set(cache_key, raw, ttl=ttl)
+        try:
+            await asyncio.to_thread(save_myitmo_schedule, username, date_start, date_end, time.time(), raw)
+        except Exception as e:
+            log.warning("my.itmo cache write failed for %s: %s", username, e)
+        return raw
+
+    return await _MYITMO_FLIGHT.do(cache_key, _fetch)
+
+
+async def prewarm_myitmo(users: List[dict], ttl: float, concurrency: int) -> Tuple[int, int]:
+    """
+    Заранее подтягивает my.itmo-расписания пользователей hybrid/myitmo_full
+    (например, за несколько минут до автоотправки) с ограниченным параллелизмом.
+    ttl — сколько держать прогретые записи (должно перекрывать время до отправки).
+    Возвращает (ok, fail).
+    """
+    targets = [
+        u for u in users
+        if str(u.get("schedule_source_mode") or "sheets").strip().lower() in ("myitmo_full", "hybrid")
+        and (u.get("myitmo_username") or "").strip()
+        and (u.get("myitmo_refresh_token") or "").strip()
+    ]
+    if not targets:
+        return 0, 0
+    sem = asyncio.Semaphore(max(1, int(concurrency)))
+    ok = fail = 0
+
+    async def _one(u: dict) -> None:
+        nonlocal ok, fail
+        async with sem:
+            try:
+                await _load_myitmo_raw(u, u.get("timezone") or settings.timezone, ttl=ttl)
+                ok += 1
+            except Exception as e:
+                fail += 1
+                log.warning("my.itmo prewarm failed user=%s: %s", u.get("telegram_id"), e)
+
+    await asyncio.gather(*(_one(u) for u in targets))
+    return ok, fail
+
+
+def schedule_scope(user: dict) -> Tuple[str, str, str]:
+    """
+    (режим, группа, scope) — у пользователей с одинаковым scope одно и то же расписание.
+
+    Для sheets-кейсов из .env расписание одинаково для группы.
+    Если у пользователя задана персональная таблица — scope отдельный.
+    Для my.itmo-режимов scope строго персональный (по user id), чтобы
+    не смешивать индивидуальные пары (английский/история и т.п.).
+    """
     mode = str(user.get("schedule_source_mode") or "sheets").strip().lower()
-    tz = user.get("timezone") or settings.timezone
     uid = int(user.get("telegram_id") or user.get("id") or 0)
-    today_key, week_key = _today_and_week_key(tz)
     group_code = str(user.get("group_code") or "")
-
-    # Для sheets-кейсов из .env расписание одинаково для группы.
-    # Если у пользователя задана персональная таблица — scope отдельный.
-    # Для my.itmo-режимов кэш строго персональный (по user id), чтобы
-    # не смешивать индивидуальные пары (английский/история и т.п.).
     custom_sheet_id = str(user.get("user_spreadsheet_id") or "").strip()
     custom_sheet_gid = str(user.get("user_sheet_gid") if user.get("user_sheet_gid") is not None else "")
     if mode in ("myitmo_full", "hybrid"):
@@ -273,103 +388,67 @@ async def load_lessons_for_user_group(user: dict):
         cache_scope = f"sheet:{custom_sheet_id}:{custom_sheet_gid}"
     else:
         cache_scope = "group_shared"
+    return mode, group_code, cache_scope
+
+
+async def load_schedule_for_user(user: dict) -> LessonIndex:
+    """
+    Расписание пользователя в виде индекса чётность → день → пары (по времени).
+    Для sheets-режима индекс группы берётся из снимка листа как есть.
+    """
+    mode, group_code, cache_scope = schedule_scope(user)
+    tz = user.get("timezone") or settings.timezone
+    today_key, week_key = _today_and_week_key(tz)
     result_key = (mode, group_code, today_key, f"{week_key}:{cache_scope}")
 
     cached_user = _RESULT_CACHE.get(result_key)
-    now_ts = time.monotonic()
-    if cached_user and cached_user[0] > now_ts:
-        return cached_user[1]
+    if cached_user is not None:
+        return cached_user
 
-    def _load_sheets_lessons() -> List[Dict]:
-        global _SHEETS_ALL_CACHE
+    async def _load_sheets_lessons() -> LessonIndex:
         spreadsheet_id = str(user.get("user_spreadsheet_id") or settings.spreadsheet_id)
         sheet_gid_raw = user.get("user_sheet_gid")
         try:
             sheet_gid = int(sheet_gid_raw) if sheet_gid_raw is not None else int(settings.sheet_gid)
         except Exception:
             sheet_gid = int(settings.sheet_gid)
-        now_local = time.monotonic()
         use_shared_cache = not bool(user.get("user_spreadsheet_id"))
-        if use_shared_cache and _SHEETS_ALL_CACHE and _SHEETS_ALL_CACHE[0] > now_local:
-            all_lessons = _SHEETS_ALL_CACHE[1]
+        # Загрузка и парсинг уходят в поток — event loop продолжает обслуживать чаты.
+        if use_shared_cache:
+            snapshot = await get_sheet_snapshot(spreadsheet_id, sheet_gid)
         else:
-            vals, links, merges = fetch_sheet_values_and_links(
-                spreadsheet_id=spreadsheet_id,
-                sheet_gid=sheet_gid,
-                creds_path=settings.google_credentials,
-            )
-            mtx_vals = expand_merged_matrix(vals, merges=merges)
-            mtx_links = expand_merged_matrix(links, merges=merges)
-            all_lessons = list_lessons_matrix(mtx_vals, mtx_links)
-            if use_shared_cache:
-                _SHEETS_ALL_CACHE = (now_local + _SHEETS_CACHE_TTL_SEC, all_lessons)
-        return [it for it in all_lessons if it["group"] == user["group_code"]]
-
-    def _load_myitmo_raw() -> List[Dict]:
-        username = (user.get("myitmo_username") or "").strip()
-        access_token = (user.get("myitmo_access_token") or "").strip()
-        refresh_token = (user.get("myitmo_refresh_token") or "").strip()
-        token_expiry = (user.get("myitmo_token_expiry") or "").strip()
-        if not username or not refresh_token:
-            raise MyItmoError("Не подключен my.itmo. Откройте Настройки → my.itmo аккаунт.")
-        date_start, date_end = _current_and_next_week_range(tz)
-        cache_key = (username, date_start, date_end)
-        now_local = time.monotonic()
-        cached = _MYITMO_RAW_CACHE.get(cache_key)
-        if cached and cached[0] > now_local:
-            return cached[1]
-        raw, token_bundle = fetch_personal_schedule(
-            username=username,
-            access_token=access_token or None,
-            refresh_token=refresh_token or None,
-            token_expiry=token_expiry or None,
-            timeout=settings.myitmo_timeout_sec,
-            date_start=date_start,
-            date_end=date_end,
-        )
-        if token_bundle.get("refresh_token") and (
-            token_bundle.get("access_token") != access_token
-            or token_bundle.get("refresh_token") != refresh_token
-            or token_bundle.get("token_expiry") != token_expiry
-        ):
-            set_myitmo_tokens(
-                uid,
-                token_bundle["access_token"],
-                token_bundle["refresh_token"],
-                token_bundle["token_expiry"],
-            )
-        _MYITMO_RAW_CACHE[cache_key] = (now_local + _MYITMO_CACHE_TTL_SEC, raw)
-        return raw
+            snapshot = await get_custom_sheet_snapshot(spreadsheet_id, sheet_gid)
+        return snapshot.for_group(group_code)
 
     if mode == "sheets":
-        lessons = _load_sheets_lessons()
-        _RESULT_CACHE[result_key] = (time.monotonic() + _USER_VIEW_CACHE_TTL_SEC, lessons)
-        return lessons
+        schedule = await _load_sheets_lessons()
+        _RESULT_CACHE.set(result_key, schedule)
+        return schedule
 
     if mode == "myitmo_full":
         try:
-            raw_itmo = _load_myitmo_raw()
-            lessons = _build_lessons_from_myitmo(raw_itmo, fallback_group=user.get("group_code"), tz=tz)
-            _RESULT_CACHE[result_key] = (time.monotonic() + _USER_VIEW_CACHE_TTL_SEC, lessons)
-            return lessons
+            raw_itmo = await _load_myitmo_raw(user, tz)
+            schedule = LessonIndex(_build_lessons_from_myitmo(raw_itmo, fallback_group=user.get("group_code"), tz=tz))
+            _RESULT_CACHE.set(result_key, schedule)
+            return schedule
         except (MyItmoError, Exception) as e:
             log.warning("my.itmo full mode unavailable, fallback to sheets: %s", e)
-            lessons = _load_sheets_lessons()
-            _RESULT_CACHE[result_key] = (time.monotonic() + _USER_VIEW_CACHE_TTL_SEC, lessons)
-            return lessons
+            schedule = await _load_sheets_lessons()
+            _RESULT_CACHE.set(result_key, schedule)
+            return schedule
 
     # hybrid (по умолчанию для неизвестных значений — тоже hybrid)
-    lessons = _load_sheets_lessons()
+    schedule = await _load_sheets_lessons()
     try:
-        raw_itmo = _load_myitmo_raw()
+        raw_itmo = await _load_myitmo_raw(user, tz)
         idx = _build_myitmo_index(raw_itmo)
         if not idx:
-            _RESULT_CACHE[result_key] = (time.monotonic() + _USER_VIEW_CACHE_TTL_SEC, lessons)
-            return lessons
-        enriched = _enrich_from_myitmo(lessons, idx)
-        _RESULT_CACHE[result_key] = (time.monotonic() + _USER_VIEW_CACHE_TTL_SEC, enriched)
+            _RESULT_CACHE.set(result_key, schedule)
+            return schedule
+        enriched = LessonIndex(_enrich_from_myitmo(list(schedule.all()), idx))
+        _RESULT_CACHE.set(result_key, enriched)
         return enriched
     except (MyItmoError, Exception) as e:
         log.warning("Не удалось обогатить расписание через my.itmo: %s", e)
-        _RESULT_CACHE[result_key] = (time.monotonic() + _USER_VIEW_CACHE_TTL_SEC, lessons)
-        return lessons
+        _RESULT_CACHE.set(result_key, schedule)
+        return schedule
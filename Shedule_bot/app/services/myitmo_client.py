@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import html
 import os
 import re
@@ -10,8 +11,12 @@ from hashlib import sha256
 from time import time
 from typing import Any, Dict, List, Optional, Tuple
 
+import aiohttp
 import requests
 
+from app.config import settings
+from app.utils.ttl_cache import TTLCache
+
 
 class MyItmoError(RuntimeError):
     pass
@@ -23,7 +28,40 @@ _PROVIDER = "https://id.itmo.ru/auth/realms/itmo"
 _API_BASE_URL = "https://my.itmo.ru/api"
 _LOGIN_ACTION_RE = re.compile(r'"loginAction":\s*"(?P<action>[^"]+)"', re.DOTALL)
 _FORM_ACTION_RE = re.compile(r'<form\s+.*?\s+action="(?P<action>[^"]+)"', re.DOTALL)
-_TOKEN_CACHE: Dict[str, Tuple[str, float]] = {}
+# username -> (access_token, expiry_ts); запись живёт до истечения самого токена
+_TOKEN_CACHE: TTLCache[str, Tuple[str, float]] = TTLCache("myitmo_tokens", maxsize=2048, ttl=1800)
+
+
+def _remember_token(username: str, access: str, expiry_ts: float) -> None:
+    _TOKEN_CACHE.set(username, (access, expiry_ts), ttl=max(0.0, expiry_ts - time()))
+
+
+# Общая aiohttp-сессия: keep-alive пул соединений к id.itmo.ru / my.itmo.ru
+# вместо нового TCP+TLS на каждый запрос, с ограничением параллелизма на хост.
+_HTTP_SESSION: Optional[aiohttp.ClientSession] = None
+
+
+def _http_session() -> aiohttp.ClientSession:
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None or _HTTP_SESSION.closed:
+        connector = aiohttp.TCPConnector(
+            limit=max(1, int(settings.myitmo_http_pool_size)),
+            limit_per_host=max(1, int(settings.myitmo_http_per_host)),
+            ttl_dns_cache=300,
+            keepalive_timeout=30,
+        )
+        _HTTP_SESSION = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=settings.myitmo_timeout_sec),
+        )
+    return _HTTP_SESSION
+
+
+async def close_http_session() -> None:
+    global _HTTP_SESSION
+    if _HTTP_SESSION is not None and not _HTTP_SESSION.closed:
+        await _HTTP_SESSION.close()
+    _HTTP_SESSION = None
 
 
 def _generate_code_verifier() -> str:
@@ -137,19 +175,19 @@ def _token_request_by_password(username: str, password: str, timeout: int = 20)
         return token_resp.json()
 
 
-def _token_request_by_refresh(refresh_token: str, timeout: int = 20) -> Dict[str, Any]:
-    token_resp = requests.post(
-        url=f"{_PROVIDER}/protocol/openid-connect/token",
+async def _token_request_by_refresh(refresh_token: str, timeout: int = 20) -> Dict[str, Any]:
+    async with _http_session().post(
+        f"{_PROVIDER}/protocol/openid-connect/token",
         data={
             "grant_type": "refresh_token",
             "client_id": _CLIENT_ID,
             "refresh_token": refresh_token,
         },
         allow_redirects=False,
-        timeout=timeout,
-    )
-    token_resp.raise_for_status()
-    return token_resp.json()
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    ) as token_resp:
+        token_resp.raise_for_status()
+        return await token_resp.json(content_type=None)
 
 
 def exchange_password_for_tokens(username: str, password: str, timeout: int = 20) -> Dict[str, str]:
@@ -161,7 +199,7 @@ def exchange_password_for_tokens(username: str, password: str, timeout: int = 20
     if not refresh:
         raise MyItmoError("my.itmo не вернул refresh_token.")
     expiry = _expiry_iso(int(payload.get("expires_in", 1800)))
-    _TOKEN_CACHE[username] = (access, _parse_expiry_to_ts(expiry))
+    _remember_token(username, access, _parse_expiry_to_ts(expiry))
     return {
         "access_token": access,
         "refresh_token": refresh,
@@ -169,7 +207,7 @@ def exchange_password_for_tokens(username: str, password: str, timeout: int = 20
     }
 
 
-def _ensure_access_token(
+async def _ensure_access_token(
     username: str,
     timeout: int = 20,
     access_token: Optional[str] = None,
@@ -184,7 +222,7 @@ def _ensure_access_token(
     now = time()
 
     if not force_refresh and access and expiry_ts - now > 30:
-        _TOKEN_CACHE[username] = (access, expiry_ts)
+        _remember_token(username, access, expiry_ts)
         return {
             "access_token": access,
             "refresh_token": refresh,
@@ -201,13 +239,13 @@ def _ensure_access_token(
 
     if refresh:
         try:
-            payload = _token_request_by_refresh(refresh_token=refresh, timeout=timeout)
+            payload = await _token_request_by_refresh(refresh_token=refresh, timeout=timeout)
             access_new = str(payload.get("access_token") or "").strip()
             if not access_new:
                 raise MyItmoError("my.itmo не вернул access_token при refresh.")
             refresh_new = str(payload.get("refresh_token") or "").strip() or refresh
             expiry_new = _expiry_iso(int(payload.get("expires_in", 1800)))
-            _TOKEN_CACHE[username] = (access_new, _parse_expiry_to_ts(expiry_new))
+            _remember_token(username, access_new, _parse_expiry_to_ts(expiry_new))
             return {
                 "access_token": access_new,
                 "refresh_token": refresh_new,
@@ -218,12 +256,38 @@ def _ensure_access_token(
                 raise MyItmoError("Не удалось обновить токен my.itmo. Введите пароль заново в настройках.")
 
     if password:
-        return exchange_password_for_tokens(username=username, password=password, timeout=timeout)
+        # Вход по паролю — редкий интерактивный сценарий, оставлен на requests в потоке.
+        return await asyncio.to_thread(
+            exchange_password_for_tokens, username=username, password=password, timeout=timeout
+        )
 
     raise MyItmoError("Не заданы токены my.itmo. Откройте Настройки → my.itmo аккаунт и выполните вход.")
 
 
-def fetch_personal_schedule(
+async def refresh_tokens(username: str, refresh_token: str, timeout: int = 20) -> Dict[str, str]:
+    """Принудительно обновляет access_token по refresh_token (для фонового рефрешера)."""
+    return await _ensure_access_token(
+        username=username,
+        timeout=timeout,
+        refresh_token=refresh_token,
+        force_refresh=True,
+    )
+
+
+async def _get_personal_schedule(token: str, params: Dict[str, str], timeout: int) -> Tuple[int, Any]:
+    async with _http_session().get(
+        f"{_API_BASE_URL}/schedule/schedule/personal",
+        params=params,
+        headers={"Authorization": f"Bearer {token}"},
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    ) as resp:
+        if resp.status == 401:
+            return resp.status, None
+        resp.raise_for_status()
+        return resp.status, await resp.json(content_type=None)
+
+
+async def fetch_personal_schedule(
     username: str,
     access_token: Optional[str] = None,
     refresh_token: Optional[str] = None,
@@ -234,7 +298,7 @@ def fetch_personal_schedule(
     date_end: Optional[str] = None,
 ) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
     params = _get_date_range_params(date_start=date_start, date_end=date_end)
-    bundle = _ensure_access_token(
+    bundle = await _ensure_access_token(
         username=username,
         timeout=timeout,
         access_token=access_token,
@@ -243,16 +307,10 @@ def fetch_personal_schedule(
         password=password,
         force_refresh=False,
     )
-    token = bundle["access_token"]
-    resp = requests.get(
-        f"{_API_BASE_URL}/schedule/schedule/personal",
-        params=params,
-        headers={"Authorization": f"Bearer {token}"},
-        timeout=timeout,
-    )
-    if resp.status_code == 401:
+    status, payload = await _get_personal_schedule(bundle["access_token"], params, timeout)
+    if status == 401:
         # Токен мог протухнуть между запросами — обновим и повторим один раз.
-        bundle = _ensure_access_token(
+        bundle = await _ensure_access_token(
             username=username,
             timeout=timeout,
             access_token=access_token,
@@ -261,15 +319,10 @@ def fetch_personal_schedule(
             password=password,
             force_refresh=True,
         )
-        token = bundle["access_token"]
-        resp = requests.get(
-            f"{_API_BASE_URL}/schedule/schedule/personal",
-            params=params,
-            headers={"Authorization": f"Bearer {token}"},
-            timeout=timeout,
-        )
-    resp.raise_for_status()
-    data = resp.json().get("data") or []
+        status, payload = await _get_personal_schedule(bundle["access_token"], params, timeout)
+        if status == 401:
+            raise MyItmoError("my.itmo отклонил токен (401) после обновления.")
+    data = (payload or {}).get("data") or []
 
     lessons: List[Dict[str, Any]] = []
     for day in data:
@@ -277,4 +330,3 @@ def fetch_personal_schedule(
         for lesson in day.get("lessons", []):
             lessons.append({"date": day_date, **lesson})
     return lessons, bundle
-
@@ -1,45 +1,81 @@
 # ПОЛНОСТЬЮ ЗАМЕНИТЕ файл/функции на эти (или добавьте отсутствующие)
 
 from __future__ import annotations
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 
-def _apply_merges_into(matrix: List[List[Optional[str]]], merges: List[Dict[str, Any]]) -> None:
-    """Копирует значение из верх-левого угла каждого merge-диапазона во все его ячейки."""
-    if not matrix or not merges:
-        return
+Matrix = List[List[Optional[str]]]
 
-    # гарантируем размеры перед обращением по индексам
-    max_row_len = max((len(r) for r in matrix), default=0)
-
-    def _ensure_size(rows: int, cols: int):
-        nonlocal max_row_len
-        # добить строки
-        while len(matrix) < rows:
-            matrix.append([])
-        # добить колонки в каждой строке
-        for r in range(len(matrix)):
-            need = cols - len(matrix[r])
-            if need > 0:
-                matrix[r].extend([None] * need)
-        max_row_len = max(max_row_len, cols)
 
+def _merge_ranges(merges: List[Dict[str, Any]]) -> List[Tuple[int, int, int, int]]:
+    """Нормализованные (sr, er, sc, ec) без пустых диапазонов."""
+    out: List[Tuple[int, int, int, int]] = []
     for m in merges:
         sr = int(m.get("startRowIndex", 0) or 0)
         er = int(m.get("endRowIndex", sr + 1) or (sr + 1))
         sc = int(m.get("startColumnIndex", 0) or 0)
         ec = int(m.get("endColumnIndex", sc + 1) or (sc + 1))
-
         if er <= sr or ec <= sc:
             continue
+        out.append((sr, er, sc, ec))
+    return out
+
+
+def _apply_merges_many(matrices: List[Matrix], merges: List[Dict[str, Any]]) -> None:
+    """
+    Копирует значение из верх-левого угла каждого merge-диапазона во все его ячейки,
+    сразу во всех переданных матрицах (значения, ссылки — одинаковые мерджи).
+
+    Размеры выравниваются один раз до цикла по мерджам, поэтому работа линейна:
+    O(ячейки матрицы + суммарная площадь мерджей).
+    """
+    ranges = _merge_ranges(merges) if merges else []
+    if not ranges or not matrices:
+        return
 
-        _ensure_size(er, ec)
+    need_rows = max(er for _, er, _, _ in ranges)
+    need_cols = max(ec for _, _, _, ec in ranges)
+    for matrix in matrices:
+        while len(matrix) < need_rows:
+            matrix.append([])
+        for row in matrix:
+            short = need_cols - len(row)
+            if short > 0:
+                row.extend([None] * short)
+
+    for sr, er, sc, ec in ranges:
+        width = ec - sc
+        for matrix in matrices:
+            top = matrix[sr][sc]
+            fill = [top] * width
+            for r in range(sr, er):
+                matrix[r][sc:ec] = fill
+
+
+def _apply_merges_into(matrix: Matrix, merges: List[Dict[str, Any]]) -> None:
+    """Копирует значение из верх-левого угла каждого merge-диапазона во все его ячейки."""
+    if not matrix or not merges:
+        return
+    _apply_merges_many([matrix], merges)
+
+
+def expand_merged_matrices(
+    values: Matrix,
+    links: Matrix,
+    merges: Optional[List[Dict[str, Any]]] = None,
+) -> Tuple[Matrix, Matrix]:
+    """
+    Разворачивает мерджи в матрице значений и матрице ссылок за один проход
+    (у листа они общие). Возвращает копии, исходные списки не меняются.
+    """
+    mtx_vals = [list(row) for row in values]
+    mtx_links = [list(row) for row in links]
+    if merges:
+        # пустая матрица остаётся пустой — как и в expand_merged_matrix
+        _apply_merges_many([m for m in (mtx_vals, mtx_links) if m], merges)
+    return mtx_vals, mtx_links
 
-        top = matrix[sr][sc] if sr < len(matrix) and sc < len(matrix[sr]) else None
-        for r in range(sr, er):
-            for c in range(sc, ec):
-                matrix[r][c] = top
 
-def expand_merged_matrix(sheet_or_matrix, merges: Optional[List[Dict[str, Any]]] = None) -> List[List[Optional[str]]]:
+def expand_merged_matrix(sheet_or_matrix, merges: Optional[List[Dict[str, Any]]] = None) -> Matrix:
     """
     Универсальная функция:
     • Если передан объект листа (dict с ключами 'data', 'merges') — соберём матрицу и развернём мерджи.
@@ -56,7 +92,7 @@ def expand_merged_matrix(sheet_or_matrix, merges: Optional[List[Dict[str, Any]]]
     if isinstance(sheet_or_matrix, dict):
         data_blocks = sheet_or_matrix.get("data", []) or []
         row_data = data_blocks[0].get("rowData", []) if data_blocks else []
-        matrix: List[List[Optional[str]]] = []
+        matrix: Matrix = []
         for row in row_data:
             vals_row: List[Optional[str]] = []
             for cell in (row.get("values") or []):
@@ -0,0 +1,302 @@
+# app/services/sheet_cache.py
+"""
+Кэш разобранного листа расписания с проверкой ревизии.
+
+Таблица меняется несколько раз в неделю, а TTL кэша — минута. Поэтому по
+истечении TTL сначала делаем дешёвую проверку версии (Drive version/modifiedTime);
+если версия та же — просто продлеваем запись, не скачивая и не разбирая лист.
+Если Drive API недоступен, лист всё-таки скачивается, но по хэшу содержимого
+пропускается повторный разбор.
+
+Разобранный общий лист сохраняется в cache.db: после рестарта бот поднимает
+снимок с диска до начала polling и перепроверяет его в фоне.
+
+Stale-while-revalidate: по истечении TTL пользователь сразу получает старый
+снимок, а обновление идёт в фоне. Ждать загрузку приходится только если снимка
+нет вовсе или он не подтверждался дольше SHEET_CACHE_MAX_STALE_SEC.
+
+Персональные таблицы пользователей (Настройки → своя таблица) живут в отдельном
+ограниченном LRU-кэше: пользователи одной и той же таблицы делят один снимок,
+проверка ревизии и single-flight — те же, что у общего листа.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from app.config import settings
+from app.services.sheets_client import fetch_sheet_values_and_links, fetch_sheet_revision
+from app.services.schedule_expand import expand_merged_matrices
+from app.services.schedule_list import list_lessons_matrix
+from app.services.lesson_index import EMPTY_INDEX, LessonIndex, build_group_indexes
+from app.services.groups import build_course_groups
+from app.services.cache_db import load_sheet_snapshot, save_sheet_snapshot
+from app.utils.single_flight import SingleFlight
+from app.utils.ttl_cache import TTLCache
+
+log = logging.getLogger("schedule.sheets")
+
+_SHEETS_CACHE_TTL_SEC = max(5, int(settings.sheet_cache_ttl_sec))
+_SHEETS_MAX_STALE_SEC = max(_SHEETS_CACHE_TTL_SEC, int(settings.sheet_cache_max_stale_sec))
+# После неудачного фонового обновления не пробуем снова на каждом запросе.
+_REFRESH_RETRY_SEC = 30
+# Если Drive API отказал (не включён, нет прав) — не дёргаем его какое-то время.
+_REVISION_PROBE_COOLDOWN_SEC = 3600
+
+
+@dataclass(frozen=True)
+class SheetSnapshot:
+    spreadsheet_id: str
+    sheet_gid: int
+    revision: Optional[str]    # версия файла из Drive (None, если проверка недоступна)
+    content_hash: str          # sha1 значений/ссылок/мерджей листа
+    fetched_at: float          # time.time() последней загрузки или подтверждения версии
+    lessons: List[Dict]
+    groups: Mapping[str, LessonIndex]   # группа → индекс чётность/день
+    course_groups: Mapping[str, Tuple[str, ...]]  # заголовок курса → группы (для онбординга)
+
+    @property
+    def version(self) -> str:
+        return self.revision or self.content_hash
+
+    def for_group(self, group_code: str) -> LessonIndex:
+        return self.groups.get(str(group_code or ""), EMPTY_INDEX)
+
+
+# (spreadsheet_id, gid) -> (monotonic-время истечения, снимок)
+_SHEETS_CACHE: Dict[Tuple[str, int], Tuple[float, SheetSnapshot]] = {}
+_REVISION_PROBE_DISABLED_UNTIL: Dict[str, float] = {}
+_REVALIDATE_TASKS: Dict[Tuple[str, int], asyncio.Task] = {}
+_SHEET_FLIGHT = SingleFlight("sheets")
+
+# Персональные таблицы: (spreadsheet_id, gid) -> снимок, LRU
+_CUSTOM_SHEETS_CACHE: TTLCache[Tuple[str, int], SheetSnapshot] = TTLCache(
+    "custom_sheets", maxsize=settings.custom_sheet_cache_size, ttl=_SHEETS_CACHE_TTL_SEC
+)
+
+
+def _content_hash(vals, links, merges) -> str:
+    raw = json.dumps([vals, links, merges], ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _probe_revision(spreadsheet_id: str) -> Optional[str]:
+    """Версия таблицы из Drive или None (проверка недоступна/в cooldown)."""
+    if _REVISION_PROBE_DISABLED_UNTIL.get(spreadsheet_id, 0.0) > time.monotonic():
+        return None
+    try:
+        return fetch_sheet_revision(spreadsheet_id, settings.google_credentials)
+    except Exception as e:
+        _REVISION_PROBE_DISABLED_UNTIL[spreadsheet_id] = time.monotonic() + _REVISION_PROBE_COOLDOWN_SEC
+        log.warning(
+            "revision probe unavailable for %s (%s); falling back to content hash for %ds",
+            spreadsheet_id, e, _REVISION_PROBE_COOLDOWN_SEC,
+        )
+        return None
+
+
+def _persist_snapshot(snapshot: SheetSnapshot) -> None:
+    try:
+        save_sheet_snapshot(
+            snapshot.spreadsheet_id,
+            snapshot.sheet_gid,
+            snapshot.revision,
+            snapshot.content_hash,
+            snapshot.fetched_at,
+            {
+                "lessons": snapshot.lessons,
+                "course_groups": {t: list(gs) for t, gs in snapshot.course_groups.items()},
+            },
+        )
+    except Exception:
+        log.exception("failed to persist sheet snapshot %s gid=%s", snapshot.spreadsheet_id, snapshot.sheet_gid)
+
+
+def _restore_snapshot_sync(spreadsheet_id: str, sheet_gid: int) -> Optional[SheetSnapshot]:
+    try:
+        row = load_sheet_snapshot(spreadsheet_id, sheet_gid)
+    except Exception:
+        log.exception("failed to read stored sheet snapshot %s gid=%s", spreadsheet_id, sheet_gid)
+        return None
+    if not row:
+        return None
+    payload = row["payload"]
+    lessons = payload.get("lessons") or []
+    return SheetSnapshot(
+        spreadsheet_id=spreadsheet_id,
+        sheet_gid=int(sheet_gid),
+        revision=row["revision"],
+        content_hash=row["content_hash"],
+        fetched_at=row["fetched_at"],
+        lessons=lessons,
+        groups=build_group_indexes(lessons),
+        course_groups=MappingProxyType({
+            t: tuple(gs) for t, gs in (payload.get("course_groups") or {}).items()
+        }),
+    )
+
+
+def _load_snapshot_sync(
+    spreadsheet_id: str,
+    sheet_gid: int,
+    previous: Optional[SheetSnapshot],
+    persist: bool = False,
+) -> SheetSnapshot:
+    """
+    Синхронная часть обновления (вызывается только через asyncio.to_thread):
+    проверка ревизии → при необходимости загрузка → при изменившемся содержимом разбор.
+    persist=True — сохранить изменившийся снимок на диск (только для общего кэша).
+    """
+    revision = _probe_revision(spreadsheet_id)
+    if previous is not None and revision is not None and revision == previous.revision:
+        log.debug("sheet %s gid=%s unchanged (revision %s)", spreadsheet_id, sheet_gid, revision)
+        return replace(previous, fetched_at=time.time())
+
+    vals, links, merges = fetch_sheet_values_and_links(
+        spreadsheet_id=spreadsheet_id,
+        sheet_gid=sheet_gid,
+        creds_path=settings.google_credentials,
+    )
+    content_hash = _content_hash(vals, links, merges)
+    if previous is not None and content_hash == previous.content_hash:
+        log.debug("sheet %s gid=%s content unchanged, parse skipped", spreadsheet_id, sheet_gid)
+        snapshot = replace(previous, revision=revision, fetched_at=time.time())
+        if persist and revision != previous.revision:
+            _persist_snapshot(snapshot)
+        return snapshot
+
+    started = time.monotonic()
+    mtx_vals, mtx_links = expand_merged_matrices(vals, links, merges=merges)
+    lessons = list_lessons_matrix(mtx_vals, mtx_links)
+    groups = build_group_indexes(lessons)
+    course_groups = build_course_groups(mtx_vals)
+    log.info(
+        "sheet %s gid=%s parsed: lessons=%d parse=%.0fms version=%s",
+        spreadsheet_id, sheet_gid, len(lessons), (time.monotonic() - started) * 1000,
+        revision or content_hash[:12],
+    )
+    snapshot = SheetSnapshot(
+        spreadsheet_id=spreadsheet_id,
+        sheet_gid=int(sheet_gid),
+        revision=revision,
+        content_hash=content_hash,
+        fetched_at=time.time(),
+        lessons=lessons,
+        groups=groups,
+        course_groups=course_groups,
+    )
+    if persist:
+        _persist_snapshot(snapshot)
+    return snapshot
+
+
+async def _refresh_shared(spreadsheet_id: str, sheet_gid: int) -> SheetSnapshot:
+    key = (spreadsheet_id, int(sheet_gid))
+    cached = _SHEETS_CACHE.get(key)
+    snapshot = await asyncio.to_thread(
+        _load_snapshot_sync, spreadsheet_id, int(sheet_gid), cached[1] if cached else None, True
+    )
+    _SHEETS_CACHE[key] = (time.monotonic() + _SHEETS_CACHE_TTL_SEC, snapshot)
+    return snapshot
+
+
+async def refresh_sheet_snapshot(spreadsheet_id: str, sheet_gid: int) -> SheetSnapshot:
+    """Принудительная перепроверка общего снимка (не дожидаясь TTL)."""
+    key = (spreadsheet_id, int(sheet_gid))
+    return await _SHEET_FLIGHT.do(key, lambda: _refresh_shared(spreadsheet_id, int(sheet_gid)))
+
+
+async def get_sheet_snapshot(spreadsheet_id: str, sheet_gid: int) -> SheetSnapshot:
+    """
+    Снимок из кэша. После TTL отдаётся старый снимок и запускается фоновая
+    перепроверка; синхронно ждём загрузку, только если снимка нет или он старше
+    жёсткого предела. Все промахи по одному (spreadsheet_id, gid) ждут одну загрузку.
+    """
+    key = (spreadsheet_id, int(sheet_gid))
+    cached = _SHEETS_CACHE.get(key)
+    if cached:
+        expires, snapshot = cached
+        if expires > time.monotonic():
+            return snapshot
+        if time.time() - snapshot.fetched_at < _SHEETS_MAX_STALE_SEC:
+            schedule_sheet_refresh(spreadsheet_id, sheet_gid, reason="stale")
+            return snapshot
+    return await refresh_sheet_snapshot(spreadsheet_id, sheet_gid)
+
+
+async def _refresh_custom(spreadsheet_id: str, sheet_gid: int) -> SheetSnapshot:
+    key = (spreadsheet_id, int(sheet_gid))
+    # просроченный снимок всё ещё нужен — для сравнения ревизии/хэша
+    previous = _CUSTOM_SHEETS_CACHE.peek(key)
+    snapshot = await asyncio.to_thread(_load_snapshot_sync, spreadsheet_id, int(sheet_gid), previous)
+    _CUSTOM_SHEETS_CACHE.set(key, snapshot)
+    return snapshot
+
+
+async def get_custom_sheet_snapshot(spreadsheet_id: str, sheet_gid: int) -> SheetSnapshot:
+    """
+    Снимок персональной таблицы пользователя из общего LRU-кэша.
+    По истечении TTL — та же проверка ревизии; одновременные промахи ждут одну загрузку.
+    """
+    key = (spreadsheet_id, int(sheet_gid))
+    if key == (settings.spreadsheet_id, int(settings.sheet_gid)):
+        return await get_sheet_snapshot(spreadsheet_id, sheet_gid)
+    cached = _CUSTOM_SHEETS_CACHE.get(key)
+    if cached is not None:
+        return cached
+    return await _SHEET_FLIGHT.do(("custom",) + key, lambda: _refresh_custom(spreadsheet_id, int(sheet_gid)))
+
+
+async def _revalidate(spreadsheet_id: str, sheet_gid: int, reason: str) -> None:
+    key = (spreadsheet_id, int(sheet_gid))
+    try:
+        snapshot = await refresh_sheet_snapshot(spreadsheet_id, sheet_gid)
+        log.debug("sheet %s gid=%s revalidated (%s): version=%s",
+                  spreadsheet_id, sheet_gid, reason, snapshot.version[:24])
+    except Exception:
+        log.exception("background revalidation (%s) failed for %s gid=%s", reason, spreadsheet_id, sheet_gid)
+        cached = _SHEETS_CACHE.get(key)
+        if cached:
+            _SHEETS_CACHE[key] = (time.monotonic() + _REFRESH_RETRY_SEC, cached[1])
+    finally:
+        _REVALIDATE_TASKS.pop(key, None)
+
+
+def schedule_sheet_refresh(spreadsheet_id: str, sheet_gid: int, reason: str = "manual") -> None:
+    """Фоновая перепроверка снимка, если она ещё не идёт."""
+    key = (spreadsheet_id, int(sheet_gid))
+    if key in _REVALIDATE_TASKS or _SHEET_FLIGHT.in_flight(key):
+        return
+    _REVALIDATE_TASKS[key] = asyncio.create_task(_revalidate(spreadsheet_id, int(sheet_gid), reason))
+
+
+def sheet_snapshot_age(spreadsheet_id: str, sheet_gid: int) -> Optional[float]:
+    """Сколько секунд назад снимок последний раз подтверждался (None — снимка нет)."""
+    cached = _SHEETS_CACHE.get((spreadsheet_id, int(sheet_gid)))
+    if not cached:
+        return None
+    return time.time() - cached[1].fetched_at
+
+
+async def warm_start_sheet_cache(spreadsheet_id: str, sheet_gid: int) -> bool:
+    """
+    Поднимает сохранённый снимок листа в память (до старта polling) и запускает
+    фоновую перепроверку. Возвращает True, если снимок нашёлся на диске.
+    """
+    key = (spreadsheet_id, int(sheet_gid))
+    snapshot = await asyncio.to_thread(_restore_snapshot_sync, spreadsheet_id, int(sheet_gid))
+    if snapshot is not None:
+        _SHEETS_CACHE[key] = (time.monotonic() + _SHEETS_CACHE_TTL_SEC, snapshot)
+        log.info(
+            "sheet %s gid=%s restored from disk: lessons=%d age=%.0fs version=%s",
+            spreadsheet_id, sheet_gid, len(snapshot.lessons), time.time() - snapshot.fetched_at,
+            snapshot.version[:24],
+        )
+    schedule_sheet_refresh(spreadsheet_id, sheet_gid, reason="warm start")
+    return snapshot is not None
@@ -2,11 +2,13 @@
 from __future__ import annotations
 
 import os
+import time
 from pathlib import Path
 from typing import Any, Dict, Optional, List, Tuple
 
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
 from app.config import settings
 import logging
@@ -21,6 +23,21 @@ FIELDS = (
     ")"
 )
 
+# Минимальная маска для расписания: только текст ячеек, ссылки и мерджи.
+# effectiveValue — запасной источник текста, если formattedValue нет.
+VALUES_LINKS_FIELDS = (
+    "sheets("
+    "properties(sheetId),"
+    "merges,"
+    "data(rowData(values(formattedValue,effectiveValue,hyperlink,textFormatRuns(format(link(uri))))))"
+    ")"
+)
+
+# (spreadsheet_id, gid) -> title листа; нужен, чтобы запрашивать только один диапазон.
+_SHEET_TITLES: Dict[Tuple[str, int], str] = {}
+# (spreadsheet_id, gid) -> статистика последней загрузки (байты, время).
+_FETCH_STATS: Dict[Tuple[str, int], Dict[str, Any]] = {}
+
 ROOT_DIR = Path(__file__).resolve().parents[2]  # корень проекта (…/Shedule_bot)
 
 def _resolve_creds_path(creds_path: Optional[str]) -> str:
@@ -69,6 +86,115 @@ def _get_service(creds_path: Optional[str] = None, readonly: bool = True):
     # ВАЖНО: cache_discovery=False, как в другом месте файла
     return build("sheets", "v4", credentials=credentials, cache_discovery=False)
 
+def _execute_counting(request) -> Tuple[Dict[str, Any], int]:
+    """
+    Выполняет запрос googleapiclient и возвращает (json, размер тела ответа в байтах).
+    Размер — уже распакованного тела (httplib2 снимает gzip сам).
+    """
+    counted = {"bytes": 0}
+    orig_postproc = request.postproc
+
+    def _postproc(resp, content):
+        counted["bytes"] = len(content or b"")
+        return orig_postproc(resp, content)
+
+    request.postproc = _postproc
+    return request.execute(), counted["bytes"]
+
+
+def _a1_sheet_range(title: str) -> str:
+    # Весь лист целиком: 'Имя листа' (кавычки внутри имени удваиваются).
+    return "'" + title.replace("'", "''") + "'"
+
+
+def _sheet_title(service, spreadsheet_id: str, sheet_gid: int, *, refresh: bool = False) -> Optional[str]:
+    """Имя листа по gid. Запрос метаданных лёгкий (только properties), результат кэшируется."""
+    key = (spreadsheet_id, int(sheet_gid))
+    if not refresh and key in _SHEET_TITLES:
+        return _SHEET_TITLES[key]
+    meta = service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id,
+        fields="sheets.properties(sheetId,title)",
+    ).execute()
+    for sh in meta.get("sheets", []):
+        props = sh.get("properties", {}) or {}
+        _SHEET_TITLES[(spreadsheet_id, int(props.get("sheetId", -1)))] = props.get("title") or ""
+    return _SHEET_TITLES.get(key)
+
+
+def _fetch_sheet_range(service, spreadsheet_id: str, sheet_gid: int, fields: str) -> Tuple[Optional[dict], int]:
+    """
+    Скачивает grid data ТОЛЬКО нужного листа (ranges=<лист>, fields=<маска>).
+    Возвращает (объект листа или None, если gid не найден; размер ответа в байтах).
+    Если лист переименовали — перечитываем имя и повторяем один раз.
+    """
+    total_bytes = 0
+    for attempt in range(2):
+        title = _sheet_title(service, spreadsheet_id, sheet_gid, refresh=attempt > 0)
+        if title is None:
+            return None, total_bytes
+        try:
+            doc, nbytes = _execute_counting(service.spreadsheets().get(
+                spreadsheetId=spreadsheet_id,
+                ranges=[_a1_sheet_range(title)],
+                includeGridData=True,
+                fields=fields,
+            ))
+        except HttpError as e:
+            if attempt == 0 and getattr(e, "resp", None) is not None and e.resp.status == 400:
+                log.info("sheet %s gid=%s: range %r rejected, refreshing title", spreadsheet_id, sheet_gid, title)
+                continue
+            raise
+        total_bytes += nbytes
+        for sh in doc.get("sheets", []):
+            if (sh.get("properties", {}) or {}).get("sheetId") == sheet_gid:
+                return sh, total_bytes
+        # под старым именем теперь другой лист — обновим имя и попробуем ещё раз
+    return None, total_bytes
+
+
+def _record_fetch_stats(spreadsheet_id: str, sheet_gid: int, nbytes: int, fetch_sec: float, parse_sec: float, rows: int) -> None:
+    _FETCH_STATS[(spreadsheet_id, int(sheet_gid))] = {
+        "bytes": nbytes,
+        "fetch_ms": fetch_sec * 1000,
+        "parse_ms": parse_sec * 1000,
+        "rows": rows,
+        "at": time.time(),
+    }
+    log.info(
+        "sheets fetch %s gid=%s: %d bytes, rows=%d, fetch=%.0fms parse=%.0fms",
+        spreadsheet_id, sheet_gid, nbytes, rows, fetch_sec * 1000, parse_sec * 1000,
+    )
+
+
+def get_fetch_stats() -> Dict[Tuple[str, int], Dict[str, Any]]:
+    """Статистика последней загрузки по каждому листу (для админки/логов)."""
+    return dict(_FETCH_STATS)
+
+
+def fetch_sheet_revision(spreadsheet_id: str, creds_path: Optional[str] = None) -> Optional[str]:
+    """
+    Дешёвая проверка изменений таблицы без скачивания данных:
+    Drive files.get(fields=version,modifiedTime). Возвращает строку ревизии.
+    Требует включённого Drive API у сервисного аккаунта; ошибки пробрасываются —
+    вызывающий решает, как деградировать (см. sheet_cache).
+    """
+    scopes = ["https://www.googleapis.com/auth/drive.metadata.readonly"]
+    path = _resolve_creds_path(creds_path)
+    credentials = Credentials.from_service_account_file(path, scopes=scopes)
+    drive = build("drive", "v3", credentials=credentials, cache_discovery=False)
+    meta = drive.files().get(
+        fileId=spreadsheet_id,
+        fields="version,modifiedTime",
+        supportsAllDrives=True,
+    ).execute()
+    version = meta.get("version")
+    modified = meta.get("modifiedTime")
+    if not version and not modified:
+        return None
+    return f"{version}:{modified}"
+
+
 def fetch_sheet_grid(
     spreadsheet_id: Optional[str] = None,
     sheet_gid: Optional[int] = None,
@@ -82,16 +208,13 @@ def fetch_sheet_grid(
     sheet_gid = sheet_gid if sheet_gid is not None else settings.sheet_gid
 
     service = _get_service(creds_path=creds_path, readonly=True)
-    resp = service.spreadsheets().get(
-        spreadsheetId=spreadsheet_id,
-        includeGridData=True,
-        fields=FIELDS,
-    ).execute()
-
-    for sh in resp.get("sheets", []):
-        if sh["properties"]["sheetId"] == sheet_gid:
-            return sh
-    raise ValueError(f"Лист с sheetId/gid={sheet_gid} не найден в таблице {spreadsheet_id}.")
+    started = time.monotonic()
+    sh, nbytes = _fetch_sheet_range(service, spreadsheet_id, sheet_gid, FIELDS)
+    if sh is None:
+        raise ValueError(f"Лист с sheetId/gid={sheet_gid} не найден в таблице {spreadsheet_id}.")
+    rows = len(((sh.get("data") or [{}])[0] or {}).get("rowData", []) or [])
+    _record_fetch_stats(spreadsheet_id, sheet_gid, nbytes, time.monotonic() - started, 0.0, rows)
+    return sh
 
 def fetch_sheet_values_and_links(
     *,
@@ -103,26 +226,27 @@ def fetch_sheet_values_and_links(
     Возвращает (values_matrix, links_matrix, merges) для нужного листа.
     links_matrix: URL или None для каждой ячейки.
     merges: список merge-диапазонов (как в Google Sheets API).
+
+    Запрашивается только диапазон этого листа и только нужные поля,
+    поэтому объём ответа зависит от одного листа, а не от всей книги.
     """
     scopes = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
     credentials = Credentials.from_service_account_file(creds_path, scopes=scopes)
     service = build("sheets", "v4", credentials=credentials, cache_discovery=False)
-    doc = service.spreadsheets().get(spreadsheetId=spreadsheet_id, includeGridData=True).execute()
+
+    started = time.monotonic()
+    sh, nbytes = _fetch_sheet_range(service, spreadsheet_id, sheet_gid, VALUES_LINKS_FIELDS)
+    fetched = time.monotonic()
 
     values: List[List[Optional[str]]] = []
     links:  List[List[Optional[str]]] = []
     merges: List[dict] = []
 
-    for sh in doc.get("sheets", []):
-        if sh.get("properties", {}).get("sheetId") != sheet_gid:
-            continue
-
+    if sh is not None:
         merges = sh.get("merges", []) or []
 
         grid = sh.get("data", [])
-        if not grid:
-            break
-        row_data = grid[0].get("rowData", []) or []
+        row_data = (grid[0].get("rowData", []) or []) if grid else []
         for row in row_data:
             row_vals: List[Optional[str]] = []
             row_links: List[Optional[str]] = []
@@ -143,6 +267,6 @@ def fetch_sheet_values_and_links(
                 row_links.append(url)
             values.append(row_vals)
             links.append(row_links)
-        break
 
-    return values, links, merges
\ No newline at end of file
+    _record_fetch_stats(spreadsheet_id, sheet_gid, nbytes, fetched - started, time.monotonic() - fetched, len(values))
+    return values, links, merges
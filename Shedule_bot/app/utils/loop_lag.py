@@ -0,0 +1,61 @@
+# app/utils/loop_lag.py
+"""
+Мониторинг задержки event loop.
+
+Фоновая задача раз в _INTERVAL_SEC засыпает через asyncio.sleep и меряет,
+насколько позже запланированного она проснулась. Если какой-то код держит
+loop синхронной работой (сеть, парсинг, SQLite), задержка сразу видна в
+метрике и в логах.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+log = logging.getLogger("loop.lag")
+
+_INTERVAL_SEC = 0.5
+_WARN_LAG_SEC = 0.25
+_WINDOW = 120  # ~1 минута истории при _INTERVAL_SEC=0.5
+
+_samples: Deque[float] = deque(maxlen=_WINDOW)
+_max_lag_total: float = 0.0
+_stalls_total: int = 0
+_task: Optional[asyncio.Task] = None
+
+
+async def _monitor() -> None:
+    global _max_lag_total, _stalls_total
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(_INTERVAL_SEC)
+        lag = max(0.0, loop.time() - started - _INTERVAL_SEC)
+        _samples.append(lag)
+        if lag > _max_lag_total:
+            _max_lag_total = lag
+        if lag >= _WARN_LAG_SEC:
+            _stalls_total += 1
+            log.warning("event loop stalled for %.0f ms", lag * 1000)
+
+
+def start_loop_lag_monitor() -> None:
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.ensure_future(_monitor())
+        log.info("loop lag monitor started (interval=%.1fs)", _INTERVAL_SEC)
+
+
+def get_loop_lag_stats() -> Dict[str, Any]:
+    """Сводка в миллисекундах: последний замер, среднее/максимум за окно, максимум за всё время."""
+    window = list(_samples)
+    return {
+        "last_ms": window[-1] * 1000 if window else 0.0,
+        "avg_ms": (sum(window) / len(window)) * 1000 if window else 0.0,
+        "max_ms": max(window) * 1000 if window else 0.0,
+        "max_total_ms": _max_lag_total * 1000,
+        "stalls_total": _stalls_total,
+        "samples": len(window),
+    }
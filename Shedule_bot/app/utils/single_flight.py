@@ -0,0 +1,63 @@
+# app/utils/single_flight.py
+"""
+Single-flight: склейка одновременных запросов к одному ресурсу.
+
+Пока загрузка по ключу в полёте, остальные вызовы с тем же ключом не стартуют
+свою, а ждут её результат (или исключение). Отмена одного ожидающего не
+отменяет общую загрузку — её ждут остальные.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, TypeVar
+
+log = logging.getLogger("single_flight")
+
+T = TypeVar("T")
+
+_REGISTRY: List["SingleFlight"] = []
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.started = 0
+        self.coalesced = 0
+        _REGISTRY.append(self)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(fn())
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda f, k=key: self._done(k, f))
+            self.started += 1
+        else:
+            self.coalesced += 1
+            log.debug("%s: joined in-flight load for %r", self.name, key)
+        return await asyncio.shield(fut)
+
+    def _done(self, key: Hashable, fut: asyncio.Future) -> None:
+        if self._inflight.get(key) is fut:
+            del self._inflight[key]
+        # Если все ожидающие отменились — забираем исключение, чтобы не было
+        # "Task exception was never retrieved".
+        if not fut.cancelled():
+            fut.exception()
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
+
+
+def get_flight_stats() -> List[Dict[str, Any]]:
+    return [f.stats() for f in _REGISTRY]
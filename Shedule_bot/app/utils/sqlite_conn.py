@@ -0,0 +1,76 @@
+# app/utils/sqlite_conn.py
+"""
+Долгоживущие соединения SQLite: одно на (файл БД, поток).
+
+Раньше каждая функция в services/db.py открывала новое соединение
+(os.makedirs + sqlite3.connect + журнал по умолчанию). Теперь соединение
+открывается один раз на поток (event loop, потоки asyncio.to_thread) и
+переиспользуется вместе с кэшем подготовленных выражений.
+
+Прагмы: WAL (читатели не ждут писателя), synchronous=NORMAL (в WAL это
+безопасно при падении процесса, fsync только на checkpoint), mmap и
+увеличенный page cache.
+
+Использование не меняется: `with connect(path) as con:` — коммит/откат
+транзакции на выходе из блока, соединение при этом не закрывается.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Set
+
+# Сколько подготовленных выражений держит каждое соединение (по умолчанию 128).
+STATEMENT_CACHE_SIZE = 256
+MMAP_SIZE = 64 * 1024 * 1024
+CACHE_SIZE_KIB = 8 * 1024
+
+_local = threading.local()
+_all: List[sqlite3.Connection] = []
+_all_lock = threading.Lock()
+_ready_dirs: Set[str] = set()
+_generation = 0  # растёт при close_all(): thread-local словари прежнего поколения недействительны
+
+
+def _open(path: str) -> sqlite3.Connection:
+    folder = os.path.dirname(path)
+    if folder and folder not in _ready_dirs:
+        os.makedirs(folder, exist_ok=True)
+        _ready_dirs.add(folder)
+    con = sqlite3.connect(path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+    con.row_factory = sqlite3.Row
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    con.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute("PRAGMA busy_timeout=5000")
+    return con
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Соединение текущего потока с файлом path (создаётся при первом обращении)."""
+    conns: Dict[str, sqlite3.Connection] = getattr(_local, "conns", None)
+    if conns is None or getattr(_local, "generation", -1) != _generation:
+        conns = _local.conns = {}
+        _local.generation = _generation
+    con = conns.get(path)
+    if con is None:
+        con = conns[path] = _open(path)
+        with _all_lock:
+            _all.append(con)
+    return con
+
+
+def close_all() -> None:
+    """Закрыть все открытые соединения (при остановке бота)."""
+    global _generation
+    with _all_lock:
+        conns, _all[:] = list(_all), []
+        _generation += 1
+    for con in conns:
+        try:
+            con.close()
+        except Exception:
+            pass
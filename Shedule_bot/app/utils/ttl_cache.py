@@ -0,0 +1,92 @@
+# app/utils/ttl_cache.py
+"""
+Ограниченный in-memory кэш: TTL + вытеснение по LRU + счётчики.
+
+Заменяет «голые» dict-кэши уровня модуля, у которых ключ содержит дату/неделю
+и которые никто не чистил. Потокобезопасен (часть записей делается из
+asyncio.to_thread). Все экземпляры регистрируются, сводка — в админке.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+_REGISTRY: List["TTLCache"] = []
+
+
+class TTLCache(Generic[K, V]):
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self._data: "OrderedDict[K, Tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        _REGISTRY.append(self)
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        """Свежее значение или default. Просроченная запись остаётся доступной через peek()."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] <= time.monotonic():
+                self.misses += 1
+                self.expired += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def peek(self, key: K) -> Optional[V]:
+        """Значение без учёта TTL и без счётчиков (например, предыдущий снимок для ревалидации)."""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry[1] if entry else None
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else float(ttl))
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: K) -> Optional[V]:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[1] if entry else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+def get_cache_stats() -> List[Dict[str, Any]]:
+    return [c.stats() for c in _REGISTRY]
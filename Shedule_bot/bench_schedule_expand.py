@@ -0,0 +1,107 @@
+"""Запуск: python3 bench_schedule_expand.py [строк] [столбцов] [мерджей]
+
+Микро-бенчмарк разворачивания мерджей: прежняя реализация (два прохода,
+выравнивание всей матрицы на каждый мердж) против expand_merged_matrices.
+Данные синтетические, сеть и .env не нужны (кроме импорта app.config).
+"""
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.services.schedule_expand import expand_merged_matrices
+
+
+# --- прежняя реализация (как было до переписывания) ---
+def _legacy_apply_merges_into(matrix: List[List[Optional[str]]], merges: List[Dict[str, Any]]) -> None:
+    if not matrix or not merges:
+        return
+    max_row_len = max((len(r) for r in matrix), default=0)
+
+    def _ensure_size(rows: int, cols: int):
+        nonlocal max_row_len
+        while len(matrix) < rows:
+            matrix.append([])
+        for r in range(len(matrix)):
+            need = cols - len(matrix[r])
+            if need > 0:
+                matrix[r].extend([None] * need)
+        max_row_len = max(max_row_len, cols)
+
+    for m in merges:
+        sr = int(m.get("startRowIndex", 0) or 0)
+        er = int(m.get("endRowIndex", sr + 1) or (sr + 1))
+        sc = int(m.get("startColumnIndex", 0) or 0)
+        ec = int(m.get("endColumnIndex", sc + 1) or (sc + 1))
+        if er <= sr or ec <= sc:
+            continue
+        _ensure_size(er, ec)
+        top = matrix[sr][sc] if sr < len(matrix) and sc < len(matrix[sr]) else None
+        for r in range(sr, er):
+            for c in range(sc, ec):
+                matrix[r][c] = top
+
+
+def _legacy_expand(values, links, merges):
+    mv = [list(r) for r in values]
+    ml = [list(r) for r in links]
+    _legacy_apply_merges_into(mv, merges)
+    _legacy_apply_merges_into(ml, merges)
+    return mv, ml
+
+
+def _make_sheet(rows: int, cols: int, n_merges: int):
+    rnd = random.Random(42)
+    # как в реальном листе: строки разной длины (хвостовые пустые ячейки API не присылает)
+    values = [[f"r{r}c{c}" for c in range(rnd.randint(cols // 2, cols))] for r in range(rows)]
+    links = [[(f"https://zoom.us/j/{r}{c}" if rnd.random() < 0.05 else None) for c in range(len(v))]
+             for r, v in enumerate(values)]
+    merges, used = [], set()
+    while len(merges) < n_merges:
+        sr, sc = rnd.randrange(rows - 2), rnd.randrange(cols - 3)
+        er, ec = sr + rnd.randint(1, 2), sc + rnd.randint(1, 3)
+        cells = {(r, c) for r in range(sr, er) for c in range(sc, ec)}
+        if cells & used:
+            continue  # мерджи в Sheets не пересекаются
+        used |= cells
+        merges.append({"startRowIndex": sr, "endRowIndex": er, "startColumnIndex": sc, "endColumnIndex": ec})
+    return values, links, merges
+
+
+def _padded(m, width):
+    return [row + [None] * (width - len(row)) for row in m]
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    cols = int(sys.argv[2]) if len(sys.argv) > 2 else 120
+    n_merges = int(sys.argv[3]) if len(sys.argv) > 3 else 3000
+    values, links, merges = _make_sheet(rows, cols, n_merges)
+
+    old_v, old_l = _legacy_expand(values, links, merges)
+    new_v, new_l = expand_merged_matrices(values, links, merges)
+    width = max(len(r) for r in old_v + new_v + old_l + new_l)
+    assert _padded(old_v, width) == _padded(new_v, width), "values differ"
+    assert _padded(old_l, width) == _padded(new_l, width), "links differ"
+
+    t_old = _best_of(lambda: _legacy_expand(values, links, merges), 3)
+    t_new = _best_of(lambda: expand_merged_matrices(values, links, merges), 3)
+    print(f"Лист: {rows}x{cols}, мерджей: {len(merges)}")
+    print(f"  прежняя реализация    : {t_old * 1000:8.1f} ms")
+    print(f"  expand_merged_matrices: {t_new * 1000:8.1f} ms  (x{t_old / t_new:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Запуск: python3 bench_sqlite_conn.py [пользователей] [повторов]
+
+Микро-бенчмарк доступа к bot.db: прежняя схема (новое соединение на каждый
+вызов, журнал по умолчанию) против долгоживущего соединения из
+app/utils/sqlite_conn.py (WAL, synchronous=NORMAL, кэш выражений).
+Работает на временной копии схемы users, реальную БД не трогает.
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.utils import sqlite_conn
+
+_SCHEMA = """
+CREATE TABLE users (
+    telegram_id INTEGER PRIMARY KEY,
+    telegram_tag TEXT,
+    message_id INTEGER,
+    timezone TEXT DEFAULT 'Europe/Moscow',
+    group_code TEXT,
+    autosend_enabled INTEGER NOT NULL DEFAULT 0,
+    autosend_time TEXT,
+    autosend_last_date TEXT
+)
+"""
+
+
+# --- прежняя реализация (как в services/db.py до переписывания) ---
+def _legacy_conn(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    con = sqlite3.connect(path, check_same_thread=False)
+    con.row_factory = sqlite3.Row
+    return con
+
+
+def _legacy_get_user(path: str, uid: int):
+    with _legacy_conn(path) as con:
+        row = con.execute("SELECT * FROM users WHERE telegram_id = ?", (uid,)).fetchone()
+        return dict(row) if row else None
+
+
+def _legacy_set_message_id(path: str, uid: int, mid: int) -> None:
+    with _legacy_conn(path) as con:
+        con.execute("UPDATE users SET message_id = ? WHERE telegram_id = ?", (mid, uid))
+
+
+def _new_get_user(path: str, uid: int):
+    with sqlite_conn.connect(path) as con:
+        row = con.execute("SELECT * FROM users WHERE telegram_id = ?", (uid,)).fetchone()
+        return dict(row) if row else None
+
+
+def _new_set_message_id(path: str, uid: int, mid: int) -> None:
+    with sqlite_conn.connect(path) as con:
+        con.execute("UPDATE users SET message_id = ? WHERE telegram_id = ?", (mid, uid))
+
+
+def _make_db(path: str, n_users: int) -> None:
+    con = sqlite3.connect(path)
+    con.execute(_SCHEMA)
+    con.executemany(
+        "INSERT INTO users(telegram_id, telegram_tag, group_code, autosend_enabled, autosend_time) VALUES (?,?,?,?,?)",
+        [(i, f"user{i}", f"M31{i % 40:02d}", i % 3 == 0, "08:00") for i in range(n_users)],
+    )
+    con.commit()
+    con.close()
+
+
+def _per_call_us(fn, path: str, ids, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for uid in ids:
+            fn(path, uid)
+    return (time.perf_counter() - t0) / (repeat * len(ids)) * 1e6
+
+
+def main() -> None:
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    rnd = random.Random(42)
+    ids = [rnd.randrange(n_users) for _ in range(500)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy", "bot.db")
+        new_path = os.path.join(tmp, "new", "bot.db")
+        os.makedirs(os.path.dirname(legacy_path))
+        os.makedirs(os.path.dirname(new_path))
+        _make_db(legacy_path, n_users)
+        _make_db(new_path, n_users)
+
+        assert _legacy_get_user(legacy_path, ids[0]) == _new_get_user(new_path, ids[0])
+
+        rows = [
+            ("get_user", _legacy_get_user, _new_get_user),
+            ("set_message_id", lambda p, u: _legacy_set_message_id(p, u, 1),
+             lambda p, u: _new_set_message_id(p, u, 1)),
+        ]
+        print(f"Пользователей: {n_users}, вызовов на замер: {len(ids) * repeat}")
+        for name, old_fn, new_fn in rows:
+            t_old = _per_call_us(old_fn, legacy_path, ids, repeat)
+            t_new = _per_call_us(new_fn, new_path, ids, repeat)
+            print(f"  {name:<15} прежняя схема: {t_old:8.1f} us/вызов   sqlite_conn: {t_new:8.1f} us/вызов  (x{t_old / t_new:.1f})")
+        sqlite_conn.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Запуск: python3 -m pytest -q test_query_plans.py (или python3 test_query_plans.py)
+
+Регрессионный тест индексов bot.db: на чистой временной БД после init_db()
+ни один запрос планировщиков из services/db._PLAN_CHECKS не должен уходить
+в полный скан users (EXPLAIN QUERY PLAN). Реальную БД не трогает.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+_TMP = tempfile.mkdtemp(prefix="sb-plans-")
+os.environ["DB_PATH"] = os.path.join(_TMP, "bot.db")
+os.environ["ISU_CACHE_DB"] = os.path.join(_TMP, "isu.db")
+os.environ.setdefault("BOT_TOKEN", "123:test")
+os.environ.setdefault("SPREADSHEET_ID", "test")
+os.environ.setdefault("SHEET_GID", "0")
+
+from app.services import db  # noqa: E402
+from app.utils import sqlite_conn  # noqa: E402
+
+
+def test_scheduler_queries_use_indexes():
+    db.init_db()
+    assert db.get_schema_version() == db.SCHEMA_VERSION
+    assert db.check_query_plans() == []
+
+
+def test_missing_index_is_reported():
+    db.init_db()
+    with db._conn() as con:
+        con.execute("DROP INDEX idx_users_group")
+    sqlite_conn.close_all()  # новое соединение — новые планы
+    try:
+        assert "list_users_with_group" in db.check_query_plans()
+    finally:
+        with db._conn() as con:
+            con.execute("CREATE INDEX IF NOT EXISTS idx_users_group ON users(group_code)")
+        sqlite_conn.close_all()
+
+
+if __name__ == "__main__":
+    test_scheduler_queries_use_indexes()
+    test_missing_index_is_reported()
+    print("ok")